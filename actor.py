@@ -5,16 +5,25 @@ import random
 import traceback
 from resources import ResourceManager
 from settings import Settings
+from runtime import Runtime
 
 class Actor:
     """
     An actor is a 2D point that can move itself in space.
     """
+    # Speed and arrival distance used when walking to a goal
+    walk_speed = 40
+    walk_epsilon = 3
+
     def __init__(self, x=0, y=0):
         self._x = x
         self._y = y
+        # Position at the start of the current simulation step, for interpolation
+        self._previous_x = x
+        self._previous_y = y
         self._goal = None
         self._flipped = False
+        self._puppet = False
 
     def move_to_point(self, point, speed, epsilon, deltatime):
         # Calculate the vector between self and the point
@@ -30,9 +39,8 @@ class Actor:
         # If we're not close enough to the point
         if abs(self._x-point[0]) > epsilon or abs(self._y-point[1]) > epsilon:
             # If we're close to the goal slow down a little bit
-            distance = math.sqrt(vec_x*vec_x + vec_y*vec_y)
-            if distance < epsilon*3:
-                speed = speed*(distance/(epsilon*3))
+            if magnitude < epsilon*3:
+                speed = speed*(magnitude/(epsilon*3))
                 speed = speed if speed > 5 else 5
             # Move along the vector by speed
             self._x += speed * deltatime * vec_x_norm
@@ -45,7 +53,7 @@ class Actor:
 
     def run(self, deltatime):
         if self._goal:
-            state = self.move_to_point(self._goal, 40, 3, deltatime)
+            state = self.move_to_point(self._goal, self.walk_speed, self.walk_epsilon, deltatime)
             if state == "SUCCESS":
                 self._goal = None
                 return "SUCCESS"
@@ -74,48 +82,53 @@ class Actor:
     def get_position(self):
         return (self._x, self._y)
 
+    def save_previous_position(self):
+        # Called before every simulation step
+        self._previous_x = self._x
+        self._previous_y = self._y
+
+    def get_interpolated_position(self, alpha):
+        """
+        Returns the position between the last two simulation steps, where alpha is 0 for the previous step and 1 for the current one.
+        """
+        return (self._previous_x + (self._x-self._previous_x)*alpha, self._previous_y + (self._y-self._previous_y)*alpha)
+
+    def set_puppet(self, puppet):
+        self._puppet = puppet
+
+    def get_puppet(self):
+        return self._puppet
+
+    def remove(self):
+        # Called when the actor leaves the fight pit
+        return "SUCCESS"
+
 class Animation:
     """
-    An animation is a sequence of images that can play. It does not have a position in 2D space; it returns an image and a crop square.
+    An animation is an immutable sequence of frame images with a framerate and looping flag. It holds no playback state,
+    so a single animation is shared by every animator using the same skin.
     """
-    def __init__(self, spritesheet, framerate, frames, loop, size):
-        self._current_frame = 0
-        self._img = spritesheet
-        self._frames = frames
+    def __init__(self, frames, flipped_frames, framerate, loop, size):
+        self._frame_imgs = frames
+        self._flipped_frame_imgs = flipped_frames
+        self._frames = len(frames)
         self._framerate = framerate
         self._size = size
-        self._timer = 0
         self._loop = loop
-        self._flipped = False
-    
-    def play(self, deltatime):
-        self._timer += deltatime
-        if self._timer > self._framerate*(self._current_frame+1) and self._current_frame < self._frames-1:
-            self._current_frame += 1
-        if self._current_frame == self._frames-1 and self._loop and self._timer >= self._framerate*self._frames:
-            self.reset()
-        return "SUCCESS" if self._current_frame == self._frames-1 and self._timer >= self._framerate*self._frames else "RUNNING"
-    
-    def reset(self):
-        self._timer = 0
-        self._current_frame = 0
-        return "SUCCESS"
 
-    def get_crop_square(self):
-        crop_x1 = self._size * (self._current_frame if not self.get_flipped() else self._frames-self._current_frame-1)
-        crop_y1 = 0
-        crop_x2 = self._size
-        crop_y2 = self._size
-        return crop_x1, crop_y1, crop_x2, crop_y2
+    def get_frame(self, index, flipped=False):
+        if flipped:
+            return self._flipped_frame_imgs[index]
+        return self._frame_imgs[index]
     
-    def set_flipped(self, flip):
-        self._flipped = flip
+    def get_frames(self):
+        return self._frames
     
-    def get_flipped(self):
-        return self._flipped
+    def get_framerate(self):
+        return self._framerate
     
-    def get_img(self):
-        return self._img
+    def get_loop(self):
+        return self._loop
     
     def get_size(self):
         return self._size
@@ -123,19 +136,35 @@ class Animation:
     def get_half_size(self):
         return self._size/2
 
-class Animator:
+class _SkinRegistry:
     """
-    An animator wraps Animation functions and can swap out animations. It also loads images and instantiates animations from a path.
+    The skin registry parses each skin directory once into a dictionary of animations and shares it between animators.
     """
-    def __init__(self, path):
-        # Build a dictionary of animations
-        # Each animation will have a list of possible animations that might play
-        # when it's selected
-        self._animations = {}
-        self._current_animation = None
-        # Load all the animation sprite sheets in the path
-        paths = os.listdir(path)
-        for item in paths:
+    def __init__(self):
+        self._skins = {}
+        self._random_skins = None
+        self._special_skins = None
+
+    def _scan(self):
+        # List the skin directories once; new skins require a restart
+        bundle_skins = ResourceManager.get_bundle_skin_names()
+        if bundle_skins:
+            self._random_skins = sorted(bundle_skins["random"])
+            self._special_skins = set(bundle_skins["special"])
+            return
+        random_path = os.path.join("skins", "random")
+        special_path = os.path.join("skins", "special")
+        self._random_skins = sorted(filter(lambda x: os.path.isdir(os.path.join(random_path, x)), os.listdir(random_path)))
+        self._special_skins = set()
+        if os.path.isdir(special_path):
+            self._special_skins = set(filter(lambda x: os.path.isdir(os.path.join(special_path, x)), os.listdir(special_path)))
+
+    def list_skin_sheets(self, path):
+        """
+        Lists the spritesheets in a skin directory as (image path, animation name, seconds per frame, looping) tuples.
+        """
+        sheets = []
+        for item in sorted(os.listdir(path)):
             try:
                 item = os.path.join(path, item)
                 if not os.path.isfile(item):
@@ -156,25 +185,87 @@ class Animator:
                     anim_basename = filename[:-4]
                     anim_framerate = 1/12
                     anim_loop = False
-                # Load image for animation
-                anim_img = ResourceManager.load_img(item)
-                # Determine anim size and number of frames
-                anim_size = anim_img.get_rect().height
-                anim_frames = int(anim_img.get_rect().width/anim_size)
-                # Create the animation
-                anim = Animation(anim_img, anim_framerate, anim_frames, anim_loop, anim_size)
-                # Instantiate a list for this animation name if it doesn't exist
-                if not anim_basename in self._animations:
-                    self._animations[anim_basename] = []
-                # Add this animation to the list
-                self._animations[anim_basename] += [anim]
-                # Set the default animation if there is none
-                if not self._current_animation:
-                    self._current_animation = self._animations[anim_basename][0]
-                    self._current_animation_name = anim_basename
+                sheets.append((item, anim_basename, anim_framerate, anim_loop))
             except:
                 print("Failed to create animation from {} (is the filename formatted correctly?)".format(item))
                 sys.exit(traceback.format_exc())
+        return sheets
+
+    def _load_skin(self, path):
+        # Build a dictionary of animations
+        # Each animation will have a list of possible animations that might play
+        # when it's selected
+        animations = {}
+        # Use the asset bundle if the skin is in it, otherwise read the skin directory
+        sheets = ResourceManager.get_bundle_skin(path)
+        if sheets is None:
+            sheets = self.list_skin_sheets(path)
+        for item, anim_basename, anim_framerate, anim_loop in sheets:
+            # Load (shared) frame images for animation
+            anim_frames, anim_flipped_frames = ResourceManager.load_frames(item)
+            anim_size = anim_frames[0].get_rect().height
+            # Create the animation
+            anim = Animation(anim_frames, anim_flipped_frames, anim_framerate, anim_loop, anim_size)
+            # Instantiate a list for this animation name if it doesn't exist
+            if not anim_basename in animations:
+                animations[anim_basename] = []
+            # Add this animation to the list
+            animations[anim_basename] += [anim]
+        return animations
+
+    def get_skin(self, path):
+        """
+        Returns the dictionary of animation name to list of animations for the skin at path, loading it on first use.
+        """
+        path = os.path.normpath(path)
+        if not path in self._skins:
+            self._skins[path] = self._load_skin(path)
+        return self._skins[path]
+
+    def preload_random_skins(self):
+        for skin in self.get_random_skins():
+            self.get_skin(os.path.join("skins", "random", skin))
+
+    def preload_special_skins(self):
+        # Special skins are picked by name from chat, so load them up front rather than mid-frame
+        for skin in self.get_special_skins():
+            self.get_skin(os.path.join("skins", "special", skin))
+
+    def get_random_skins(self):
+        if self._random_skins is None:
+            self._scan()
+        return self._random_skins
+
+    def get_special_skins(self):
+        if self._special_skins is None:
+            self._scan()
+        return sorted(self._special_skins)
+
+    def has_special_skin(self, name):
+        if self._special_skins is None:
+            self._scan()
+        return name in self._special_skins
+
+SkinRegistry = _SkinRegistry()
+
+class Animator:
+    """
+    An animator plays animations from a skin and can swap between them. It only holds playback state; the animations
+    themselves are shared through the skin registry.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._animations = SkinRegistry.get_skin(path)
+        self._current_animation = None
+        self._current_animation_name = None
+        self._current_frame = 0
+        self._timer = 0
+        self._flipped = False
+        # Set the default animation if there is one
+        for name in self._animations:
+            self._current_animation = self._animations[name][0]
+            self._current_animation_name = name
+            break
     
     def set_animation(self, name, index=-1, reset=True):
         """
@@ -186,12 +277,12 @@ class Animator:
             return "FAILURE"
         # Pick a random animation if not set
         if index < 0:
-            index = random.randint(0, len(self._animations[name])-1)
+            index = Runtime.get_game_random().randint(0, len(self._animations[name])-1)
         # Set the animation
         self._current_animation = self._animations[name][index]
         self._current_animation_name = name
         if reset:
-            self._current_animation.reset()
+            self.reset()
     
     def get_animations(self):
         return list(self._animations.keys())
@@ -202,35 +293,46 @@ class Animator:
     def get_animation_name(self):
         return self._current_animation_name
     
+    def get_path(self):
+        return self._path
+    
     def play(self, deltatime):
+        """
+        Advances the animation by deltatime. The frame is worked out from the elapsed time, so a long step can skip frames.
+        Returns "SUCCESS" once a non-looping animation has run its full duration.
+        """
         if not self._current_animation:
             return "FAILURE"
-        return self._current_animation.play(deltatime)
+        frames = self._current_animation.get_frames()
+        framerate = self._current_animation.get_framerate()
+        duration = framerate*frames
+        self._timer += deltatime
+        if self._current_animation.get_loop():
+            # Wrap around, keeping the time past the end
+            if self._timer >= duration:
+                self._timer %= duration
+            self._current_frame = min(int(self._timer/framerate), frames-1)
+            return "RUNNING"
+        self._current_frame = min(int(self._timer/framerate), frames-1)
+        return "SUCCESS" if self._timer >= duration else "RUNNING"
     
     def reset(self):
         if not self._current_animation:
             return "FAILURE"
-        return self._current_animation.reset()
+        self._timer = 0
+        self._current_frame = 0
+        return "SUCCESS"
     
     def set_flipped(self, flip):
-        if not self._current_animation:
-            return "FAILURE"
-        return self._current_animation.set_flipped(flip)
+        self._flipped = flip
     
     def get_flipped(self):
-        if not self._current_animation:
-            return "FAILURE"
-        return self._current_animation.get_flipped()
-    
-    def get_img(self):
-        if not self._current_animation:
-            return "FAILURE"
-        return self._current_animation.get_img()
+        return self._flipped
     
-    def get_crop_square(self):
+    def get_frame(self):
         if not self._current_animation:
             return "FAILURE"
-        return self._current_animation.get_crop_square()
+        return self._current_animation.get_frame(self._current_frame, self._flipped)
     
     def get_size(self):
         if not self._current_animation:
@@ -269,7 +371,7 @@ if __name__ == "__main__":
         animator.play(deltatime)
 
         screen.fill((0,0,0))
-        screen.blit(animator.get_img(), (actor.get_x()-animator.get_half_size(), actor.get_y()-animator.get_half_size()), animator.get_crop_square())
+        screen.blit(animator.get_frame(), (actor.get_x()-animator.get_half_size(), actor.get_y()-animator.get_half_size()))
         pygame.display.flip()
         clock.tick(Settings.framerate)
         deltatime = clock.get_time() * 0.001
\ No newline at end of file
@@ -0,0 +1,175 @@
+from actor import Actor
+from runtime import Runtime
+
+# NumPy is optional; the actor store is only used if it's installed
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class ActorStore:
+    """
+    The actor store keeps every actor's position, goal, walking speed and flags in contiguous NumPy arrays, so all
+    walking actors can be moved in one vectorized step. Actors in the store are StoredActor views with the usual Actor API.
+    """
+    def __init__(self, capacity=256):
+        self._capacity = 0
+        self._free = []
+        # Seeded from the runtime so runs with the same seed roll the same moves
+        self._rng = numpy.random.default_rng(Runtime.get_game_random().getrandbits(64))
+        self.x = numpy.zeros(0)
+        self.y = numpy.zeros(0)
+        self.previous_x = numpy.zeros(0)
+        self.previous_y = numpy.zeros(0)
+        self.goal_x = numpy.zeros(0)
+        self.goal_y = numpy.zeros(0)
+        self.speed = numpy.zeros(0)
+        self.has_goal = numpy.zeros(0, dtype=bool)
+        self.flipped = numpy.zeros(0, dtype=bool)
+        self.puppet = numpy.zeros(0, dtype=bool)
+        self.active = numpy.zeros(0, dtype=bool)
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        extra = capacity-self._capacity
+        if extra <= 0:
+            return
+        for name in ("x", "y", "previous_x", "previous_y", "goal_x", "goal_y", "speed", "has_goal", "flipped", "puppet", "active"):
+            array = getattr(self, name)
+            setattr(self, name, numpy.concatenate((array, numpy.zeros(extra, dtype=array.dtype))))
+        # Hand out low indices first
+        self._free = list(range(capacity-1, self._capacity-1, -1)) + self._free
+        self._capacity = capacity
+
+    def allocate(self):
+        if len(self._free) < 1:
+            self.grow(self._capacity*2)
+        index = self._free.pop()
+        self.has_goal[index] = False
+        self.flipped[index] = False
+        self.puppet[index] = False
+        self.speed[index] = Actor.walk_speed
+        self.active[index] = True
+        return index
+
+    def release(self, index):
+        self.active[index] = False
+        self.has_goal[index] = False
+        self._free.append(index)
+
+    def save_previous_positions(self):
+        # Same as calling Actor.save_previous_position on every actor in the store
+        self.previous_x[:] = self.x
+        self.previous_y[:] = self.y
+
+    def roll_moves(self, chance):
+        """
+        Rolls a 1 in chance die for every slot at once. Returns a list indexed by actor index.
+        """
+        return (self._rng.integers(1, chance+1, self._capacity) == 1).tolist()
+
+    def run(self, deltatime, epsilon=Actor.walk_epsilon):
+        """
+        Moves every active, non-puppeted actor with a goal towards it, same as calling Actor.run on each of them.
+        """
+        walking = self.active & self.has_goal & ~self.puppet
+        if not walking.any():
+            return
+        vec_x = self.goal_x-self.x
+        vec_y = self.goal_y-self.y
+        magnitude = numpy.sqrt(vec_x*vec_x + vec_y*vec_y)
+        # Actors within epsilon of their goal have arrived
+        arrived = walking & ((magnitude == 0) | ((numpy.abs(vec_x) <= epsilon) & (numpy.abs(vec_y) <= epsilon)))
+        moving = walking & ~arrived
+        self.has_goal[arrived] = False
+        if not moving.any():
+            return
+        vec_x = vec_x[moving]
+        vec_y = vec_y[moving]
+        magnitude = magnitude[moving]
+        # If we're close to the goal slow down a little bit
+        speed = self.speed[moving]
+        speed = numpy.where(magnitude < epsilon*3, numpy.maximum(speed*(magnitude/(epsilon*3)), 5), speed)
+        # Move along the vector by speed
+        self.x[moving] += speed * deltatime * vec_x/magnitude
+        self.y[moving] += speed * deltatime * vec_y/magnitude
+        self.flipped[moving] = vec_x < 0
+
+class StoredActor(Actor):
+    """
+    An actor whose state lives in an ActorStore. Actor's methods work unchanged through the properties below.
+    """
+    def __init__(self, store, x=0, y=0):
+        self._store = store
+        self._index = store.allocate()
+        super().__init__(x, y)
+
+    def get_index(self):
+        return self._index
+
+    @property
+    def _x(self):
+        return float(self._store.x[self._index])
+
+    @_x.setter
+    def _x(self, x):
+        self._store.x[self._index] = x
+
+    @property
+    def _y(self):
+        return float(self._store.y[self._index])
+
+    @_y.setter
+    def _y(self, y):
+        self._store.y[self._index] = y
+
+    @property
+    def _previous_x(self):
+        return float(self._store.previous_x[self._index])
+
+    @_previous_x.setter
+    def _previous_x(self, x):
+        self._store.previous_x[self._index] = x
+
+    @property
+    def _previous_y(self):
+        return float(self._store.previous_y[self._index])
+
+    @_previous_y.setter
+    def _previous_y(self, y):
+        self._store.previous_y[self._index] = y
+
+    @property
+    def _goal(self):
+        if not self._store.has_goal[self._index]:
+            return None
+        return (float(self._store.goal_x[self._index]), float(self._store.goal_y[self._index]))
+
+    @_goal.setter
+    def _goal(self, goal):
+        self._store.has_goal[self._index] = goal is not None
+        if goal is not None:
+            self._store.goal_x[self._index] = goal[0]
+            self._store.goal_y[self._index] = goal[1]
+
+    @property
+    def _flipped(self):
+        return bool(self._store.flipped[self._index])
+
+    @_flipped.setter
+    def _flipped(self, flip):
+        self._store.flipped[self._index] = flip
+
+    @property
+    def _puppet(self):
+        return bool(self._store.puppet[self._index])
+
+    @_puppet.setter
+    def _puppet(self, puppet):
+        self._store.puppet[self._index] = puppet
+
+    def remove(self):
+        if self._index is not None:
+            self._store.release(self._index)
+            self._index = None
+        return "SUCCESS"
@@ -0,0 +1,316 @@
+import os
+# Run without a window unless told otherwise
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from collections import deque
+import pygame
+from settings import Settings
+from fakes import FakeMessage, FakeCommand, FakeChat, percentile
+
+# Built in load profiles. Each profile is a list of phases that run one after another:
+# - join:   "count" new chatters chat for the first time, spread over "duration" seconds
+# - chat:   existing chatters send "rate" plain messages per second for "duration" seconds
+# - attack, defend, heal, pet: existing chatters send "rate" commands per second for "duration" seconds
+# - idle:   nothing happens for "duration" seconds
+PROFILES = {
+    "join": [
+        {"type": "join", "count": 500, "duration": 5},
+        {"type": "idle", "duration": 5}
+    ],
+    "attack": [
+        {"type": "join", "count": 100, "duration": 1},
+        {"type": "attack", "rate": 50, "duration": 10},
+        {"type": "idle", "duration": 5}
+    ],
+    "mixed": [
+        {"type": "join", "count": 200, "duration": 2},
+        {"type": "attack", "rate": 20, "duration": 5},
+        {"type": "heal", "rate": 10, "duration": 5},
+        {"type": "pet", "rate": 10, "duration": 5},
+        {"type": "chat", "rate": 50, "duration": 5},
+        {"type": "idle", "duration": 5}
+    ]
+}
+
+class LoadGenerator:
+    """
+    Feeds chat messages and commands through the handlers in twitch.py from a load profile.
+    Runs its own asyncio loop in a separate thread, like the real twitch handler.
+    """
+    def __init__(self, profile, seed):
+        self._profile = profile
+        self._random = random.Random(seed)
+        self._chatters = []
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._latencies = []
+        self._sent_commands = 0
+        self._done = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.run()))
+        self._thread.start()
+
+    def is_done(self):
+        return self._done
+
+    def get_latencies(self):
+        return self._latencies
+
+    def get_sent_commands(self):
+        return self._sent_commands
+
+    def on_director_event(self, event, command):
+        # Match interactions the director starts to the commands we sent
+        if event != "start" or "actor1" not in command:
+            return
+        key = (command["action"], command["actor1"], command["actor2"])
+        with self._pending_lock:
+            if key in self._pending and len(self._pending[key]) > 0:
+                self._latencies.append(time.perf_counter()-self._pending[key].popleft())
+
+    async def run(self):
+        import twitch
+        from chat_outbox import ChatOutbox
+        ChatOutbox.set_chat(FakeChat(), Settings.target_channel)
+        ChatOutbox.set_rate_limit(Settings.chat_message_limit, Settings.chat_message_period)
+        ChatOutbox.set_batch_delay(Settings.chat_batch_delay)
+        outbox_task = asyncio.create_task(ChatOutbox.run())
+        handlers = {
+            Settings.attack_cmd: twitch.attack_command,
+            Settings.defend_cmd: twitch.defend_command,
+            Settings.heal_cmd: twitch.heal_command,
+            Settings.pet_cmd: twitch.pet_command
+        }
+        for phase in self._profile:
+            if phase["type"] == "join":
+                count = phase["count"]
+                interval = phase["duration"]/count if count > 0 else 0
+                await self.run_at_interval(count, interval, lambda: twitch.on_message(FakeMessage(self.new_chatter(), "hello")))
+            elif phase["type"] == "chat":
+                count = int(phase["rate"]*phase["duration"])
+                await self.run_at_interval(count, 1/phase["rate"], lambda: twitch.on_message(FakeMessage(self.pick_chatter(), "hello")))
+            elif phase["type"] in ("attack", "defend", "heal", "pet"):
+                action = getattr(Settings, phase["type"] + "_cmd")
+                count = int(phase["rate"]*phase["duration"])
+                await self.run_at_interval(count, 1/phase["rate"], lambda: self.send_command(action, handlers[action]))
+            elif phase["type"] == "idle":
+                await asyncio.sleep(phase["duration"])
+            else:
+                print("Unrecognized load profile phase. Ignoring: {}".format(phase))
+        ChatOutbox.stop()
+        await outbox_task
+        self._done = True
+
+    async def run_at_interval(self, count, interval, make_coroutine):
+        start = time.perf_counter()
+        for i in range(count):
+            delay = start + i*interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await make_coroutine()
+
+    def new_chatter(self):
+        name = "bench{}".format(len(self._chatters))
+        self._chatters.append(name)
+        return name
+
+    def pick_chatter(self):
+        if len(self._chatters) < 1:
+            return self.new_chatter()
+        return self._random.choice(self._chatters)
+
+    async def send_command(self, action, handler):
+        commander = self.pick_chatter()
+        target = self.pick_chatter()
+        with self._pending_lock:
+            key = (action, commander, target)
+            if key not in self._pending:
+                self._pending[key] = deque()
+            self._pending[key].append(time.perf_counter())
+        self._sent_commands += 1
+        await handler(FakeCommand(commander, action, target))
+
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak/(1024*1024) if sys.platform == "darwin" else peak/1024
+
+def run_benchmark(profile, seed=0):
+    from game import Game
+    from twitch_interface import TwitchInterface
+    from tracing import CommandTracer
+    from chat_outbox import ChatOutbox
+
+    screen = pygame.display.set_mode(Settings.screen_size)
+    game = Game(screen)
+    TwitchInterface.set_target_channel(Settings.target_channel)
+    TwitchInterface.set_ignore_list(Settings.ignore_list)
+    TwitchInterface.set_chatter_default_health(Settings.default_health)
+    TwitchInterface.set_chatter_inactivity_timeout(Settings.chatter_inactivity_timeout)
+
+    load = LoadGenerator(profile, seed)
+    game.get_director().add_listener(load.on_director_event)
+    load.start()
+
+    frame_times = []
+    queue_depths = []
+    while not load.is_done():
+        start = time.perf_counter()
+        game.run_frame()
+        frame_times.append((time.perf_counter()-start)*1000)
+        queue_depths.append(game.get_director().get_queue_length())
+        game.tick()
+
+    latencies = load.get_latencies()
+    return {
+        "frames": len(frame_times),
+        "frame_time_ms": {
+            "p50": percentile(frame_times, 50),
+            "p90": percentile(frame_times, 90),
+            "p99": percentile(frame_times, 99),
+            "max": max(frame_times) if frame_times else 0
+        },
+        "director_queue_depth": {
+            "mean": sum(queue_depths)/len(queue_depths) if queue_depths else 0,
+            "max": max(queue_depths) if queue_depths else 0,
+            "final": queue_depths[-1] if queue_depths else 0
+        },
+        "command_latency_s": {
+            "sent": load.get_sent_commands(),
+            "started": len(latencies),
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99)
+        },
+        "command_trace_s": CommandTracer.get_summary(),
+        "dropped_commands": game.get_director().get_dropped_counts(),
+        "coalesced_commands": game.get_director().get_coalesced_count(),
+        "actors": len(game.get_director().get_actors()),
+        "chat_messages": {
+            "sent": FakeChat.messages,
+            "merged_replies": ChatOutbox.get_merged_count(),
+            "dropped_replies": ChatOutbox.get_dropped_count()
+        },
+        "peak_rss_mb": get_peak_rss_mb()
+    }
+
+def run_blit_benchmark(counts=(100, 300, 1000), frames=120, seed=0):
+    """
+    Measures the cost of blitting actor sprites per frame with raw loaded images, display-converted images and
+    display-converted images with RLE acceleration where the resource manager would use it.
+    """
+    from actor import SkinRegistry
+    from resources import ResourceManager
+    screen = pygame.display.set_mode(Settings.screen_size)
+    rng = random.Random(seed)
+    # Slice frames out of every random skin's sheets without going through the resource manager
+    raw_frames = []
+    for skin in SkinRegistry.get_random_skins():
+        for sheet in SkinRegistry.list_skin_sheets(os.path.join("skins", "random", skin)):
+            img = pygame.image.load(sheet[0])
+            size = img.get_height()
+            raw_frames += [img.subsurface((size*i, 0, size, size)).copy() for i in range(int(img.get_width()/size))]
+    ResourceManager.set_rle_acceleration(True)
+    modes = {
+        "raw": raw_frames,
+        "converted": [frame.convert_alpha() for frame in raw_frames],
+        "converted+rle": [ResourceManager.convert_surface(frame, True) for frame in raw_frames]
+    }
+    results = {}
+    for mode in modes:
+        results[mode] = {}
+        for count in counts:
+            sprites = [(rng.choice(modes[mode]), (rng.randint(0, Settings.screen_width), Settings.sprite_elevation)) for i in range(count)]
+            start = time.perf_counter()
+            for i in range(frames):
+                screen.fill(Settings.background_color)
+                for frame, position in sprites:
+                    screen.blit(frame, position)
+            results[mode][count] = (time.perf_counter()-start)*1000/frames
+    return results
+
+def print_blit_results(results):
+    modes = list(results)
+    print("Blit cost per frame (ms)")
+    print("actors  " + "".join("{:>16}".format(mode) for mode in modes))
+    for count in results[modes[0]]:
+        print("{:<8}".format(count) + "".join("{:>16.2f}".format(results[mode][count]) for mode in modes))
+
+def print_results(results):
+    print("Frames:               {}".format(results["frames"]))
+    print("Frame time (ms):      p50 {p50:.2f}  p90 {p90:.2f}  p99 {p99:.2f}  max {max:.2f}".format(**results["frame_time_ms"]))
+    print("Director queue depth: mean {mean:.1f}  max {max}  final {final}".format(**results["director_queue_depth"]))
+    print("Command latency (s):  p50 {p50:.3f}  p90 {p90:.3f}  p99 {p99:.3f}  ({started}/{sent} started)".format(**results["command_latency_s"]))
+    trace = results["command_trace_s"]
+    if "queueing" in trace and "execution" in trace:
+        print("Command timing (s):   mean queueing {:.3f}  mean execution {:.3f}  ({} completed)".format(
+            trace["queueing"]["mean"], trace["execution"]["mean"], trace["execution"]["count"]))
+    print("Skipped commands:     {} stale  {} overflow  {} coalesced".format(
+        results["dropped_commands"].get("stale", 0), results["dropped_commands"].get("overflow", 0), results["coalesced_commands"]))
+    print("Chat messages:        {sent} sent  {merged_replies} replies merged  {dropped_replies} replies dropped".format(**results["chat_messages"]))
+    print("Actors at end:        {}".format(results["actors"]))
+    if results["peak_rss_mb"] is not None:
+        print("Peak RSS (MB):        {:.1f}".format(results["peak_rss_mb"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay synthetic chat load through the fight pit without a Twitch connection or a window.")
+    parser.add_argument("--profile", default="mixed", help="Built in load profile ({})".format(", ".join(PROFILES)))
+    parser.add_argument("--profile-file", help="JSON file with a list of load profile phases; overrides --profile")
+    parser.add_argument("--settings", help="JSON settings file to benchmark with (Twitch details are not needed)")
+    parser.add_argument("--scheduler", help="Director scheduler to benchmark with (fifo or fair); overrides the settings file")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for picking chatters")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--blit", action="store_true", help="Only measure sprite blit cost at 100/300/1000 actors with and without display conversion")
+    args = parser.parse_args()
+
+    # Load the profile
+    if args.profile_file:
+        with open(args.profile_file, "r") as profile_file:
+            profile = json.load(profile_file)
+    elif args.profile in PROFILES:
+        profile = PROFILES[args.profile]
+    else:
+        sys.exit("Unknown profile {}".format(args.profile))
+
+    # Init pygame and settings; paths given on the command line are relative to where it was run from
+    if args.settings:
+        args.settings = os.path.abspath(args.settings)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    pygame.init()
+    pygame.font.init()
+    settings_json = {}
+    if args.settings:
+        with open(args.settings, "r") as settings_file:
+            settings_json = json.load(settings_file)
+    if args.scheduler:
+        settings_json["DIRECTOR_SCHEDULER"] = args.scheduler
+    settings_json["TWITCH_APP_ID"] = "benchmark"
+    settings_json["TWITCH_APP_SECRET"] = "benchmark"
+    settings_json["TWITCH_CHANNEL"] = "benchmark"
+    Settings.init_from_dict(settings_json)
+
+    if args.blit:
+        results = run_blit_benchmark(seed=args.seed)
+        print_blit_results(results)
+    else:
+        results = run_benchmark(profile, args.seed)
+        print_results(results)
+    if args.json:
+        with open(args.json, "w+") as results_file:
+            json.dump(results, results_file, indent=2)
+    pygame.quit()
@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import argparse
+import pygame
+from resources import BUNDLE_MAGIC, BUNDLE_VERSION, BUNDLE_HEADER, bundle_key, get_source_stamps
+from actor import SkinRegistry
+
+def list_skin_folders(path):
+    if not os.path.isdir(path):
+        return []
+    return sorted(filter(lambda x: os.path.isdir(os.path.join(path, x)), os.listdir(path)))
+
+def build_bundle(output_path, extra_images=("shield.png",)):
+    """
+    Decodes every skin in skins/ plus extra_images and writes them to a single asset bundle with their animation metadata
+    and the modification times of the folders and images they came from.
+    """
+    # Taken first so a file changed while building makes the bundle look out of date rather than up to date. Adding,
+    # removing or renaming a skin or spritesheet changes its folder's modification time
+    source_paths = [os.path.join("skins", kind) for kind in ("random", "special")] + list(extra_images)
+    for kind in ("random", "special"):
+        source_paths += [os.path.join("skins", kind, skin) for skin in list_skin_folders(os.path.join("skins", kind))]
+    sources = get_source_stamps(source_paths)
+    images = {}
+    image_data = []
+    offset = 0
+
+    def add_image(img_path):
+        nonlocal offset
+        if bundle_key(img_path) in images:
+            return
+        img = pygame.image.load(img_path)
+        pixels = pygame.image.tobytes(img, "RGBA")
+        images[bundle_key(img_path)] = {
+            "offset": offset,
+            "width": img.get_width(),
+            "height": img.get_height()
+        }
+        image_data.append(pixels)
+        offset += len(pixels)
+
+    # Decode every spritesheet and record how the skin registry would parse it
+    skins = {}
+    skin_names = {"random": [], "special": []}
+    for kind in skin_names:
+        for skin in list_skin_folders(os.path.join("skins", kind)):
+            skin_path = os.path.join("skins", kind, skin)
+            sheets = SkinRegistry.list_skin_sheets(skin_path)
+            for sheet in sheets:
+                add_image(sheet[0])
+            skins[bundle_key(skin_path)] = [[bundle_key(sheet[0])] + list(sheet[1:]) for sheet in sheets]
+            skin_names[kind].append(skin)
+    for img_path in extra_images:
+        add_image(img_path)
+
+    # Write header, index and pixel data
+    index = json.dumps({
+        "images": images,
+        "skins": skins,
+        "skin_names": skin_names,
+        "sources": sources
+    }).encode("utf-8")
+    with open(output_path, "wb") as bundle_file:
+        bundle_file.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(index)))
+        bundle_file.write(index)
+        for pixels in image_data:
+            bundle_file.write(pixels)
+    print("Wrote {} skins and {} images ({:.1f} MB) to {}".format(len(skins), len(images), offset/(1024*1024), output_path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack skins/ and shield.png into a pre-decoded asset bundle for fast startup.")
+    parser.add_argument("output", nargs="?", default="assets.bundle", help="Bundle file to write (default: assets.bundle)")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    pygame.init()
+    build_bundle(output)
@@ -0,0 +1,206 @@
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+
+class TokenBucket:
+    """
+    Allows up to capacity actions at once, refilling at rate actions per second.
+    """
+    def __init__(self, rate, capacity):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._last_time = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now-self._last_time)*self._rate)
+        self._last_time = now
+
+    def try_take(self):
+        self.refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def get_wait(self):
+        # Seconds until a token is available
+        self.refill()
+        return max(0, (1-self._tokens)/self._rate)
+
+class _ChatOutbox:
+    """
+    The chat outbox queues outgoing chat messages so command handlers never wait on chat. A dedicated task sends them,
+    staying under Twitch's message rate limit with a token bucket. Messages that pile up are merged into as few chat
+    messages as possible, e.g. "A attacked B for 420 damage! | C healed D for 99 HP!", up to max_length characters each.
+    A message that goes out on its own is sent as a reply to the chat message it answers, if it was given one.
+
+    Run the outbox on the loop twitchAPI calls the chat handlers on, since it sends through the chat's connection.
+    Messages can be posted from any thread.
+    """
+    separator = " | "
+    max_length = 500
+
+    def __init__(self):
+        self._chat = None
+        self._channel = None
+        # Pending (text, reply_to) pairs
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._bucket = TokenBucket(20/30, 20)
+        self._batch_delay = 0
+        self._max_pending = 200
+        self._wakeup = None
+        self._running = False
+        self._sent = 0
+        self._merged = 0
+        self._dropped = 0
+
+    def set_chat(self, chat, channel):
+        """
+        Sets where messages go. chat must have an async send_message(channel, text) like twitchAPI's Chat.
+        """
+        self._chat = chat
+        self._channel = channel
+
+    def set_rate_limit(self, messages, period):
+        self._bucket = TokenBucket(messages/period, messages)
+
+    def set_batch_delay(self, delay):
+        # How long to wait for more messages to merge after the first one arrives in an empty outbox
+        self._batch_delay = delay
+
+    def set_max_pending(self, max_pending):
+        self._max_pending = max_pending
+
+    def post(self, text, reply_to=None):
+        """
+        Queues a message to be sent. reply_to is the chat message (e.g. a twitchAPI ChatCommand) it answers, if any.
+        """
+        text = str(text)[:self.max_length]
+        with self._lock:
+            self._pending.append((text, reply_to))
+            # If chat can't keep up, the oldest messages are the least relevant
+            while len(self._pending) > self._max_pending:
+                self._pending.popleft()
+                self._dropped += 1
+        self.wake()
+
+    def wake(self):
+        # The wakeup event belongs to the outbox's loop, which may be running on another thread
+        loop = self._loop
+        if loop and self._wakeup:
+            try:
+                loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # The loop has closed
+                pass
+
+    def drain(self):
+        # Removes and returns every pending message without sending them (e.g. for replays)
+        with self._lock:
+            messages = [text for text, reply_to in self._pending]
+            self._pending.clear()
+        return messages
+
+    def take_batch(self):
+        """
+        Merges as many pending messages as fit in one chat message. Returns the message and what it replies to (only
+        if it wasn't merged with anything).
+        """
+        with self._lock:
+            message, reply_to = self._pending.popleft()
+            while self._pending and len(message) + len(self.separator) + len(self._pending[0][0]) <= self.max_length:
+                message += self.separator + self._pending.popleft()[0]
+                reply_to = None
+                self._merged += 1
+        return message, reply_to
+
+    async def run(self):
+        """
+        Sends queued messages until stop is called. Run this as its own task.
+        """
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._running = True
+        while self._running:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                # Give a burst a moment to arrive so it can be merged. A backlog is sent as fast as the rate limit
+                # allows instead, since waiting would only put chat further behind
+                if self._batch_delay > 0 and self._running:
+                    await asyncio.sleep(self._batch_delay)
+                continue
+            wait = self._bucket.get_wait()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            if not self._bucket.try_take() or not self._pending:
+                continue
+            message, reply_to = self.take_batch()
+            try:
+                if reply_to is not None:
+                    await reply_to.reply(message)
+                else:
+                    await self._chat.send_message(self._channel, message)
+                self._sent += 1
+            except:
+                print("Failed to send chat message: {}".format(message))
+                print(traceback.format_exc())
+        self._wakeup = None
+        self._loop = None
+
+    def stop(self):
+        # Safe to call from any thread
+        self._running = False
+        self.wake()
+
+    def is_running(self):
+        return self._running
+
+    def get_pending_count(self):
+        return len(self._pending)
+
+    def get_sent_count(self):
+        return self._sent
+
+    def get_merged_count(self):
+        return self._merged
+
+    def get_dropped_count(self):
+        return self._dropped
+
+ChatOutbox = _ChatOutbox()
+
+if __name__ == "__main__":
+    class FakeChat:
+        """
+        Stand-in for twitchAPI's Chat that prints messages instead of sending them.
+        """
+        def __init__(self):
+            self.start_time = time.monotonic()
+
+        async def send_message(self, channel, text):
+            print("[{:5.2f}s] #{}: {}".format(time.monotonic()-self.start_time, channel, text))
+
+    async def flood():
+        # Post a burst of results faster than the rate limit allows and watch them get merged
+        ChatOutbox.set_chat(FakeChat(), "fightpit")
+        ChatOutbox.set_rate_limit(4, 2)
+        ChatOutbox.set_batch_delay(0.1)
+        task = asyncio.create_task(ChatOutbox.run())
+        for i in range(60):
+            ChatOutbox.post("chatter{} attacked chatter{} for {} damage!".format(i, i+1, i*7))
+            await asyncio.sleep(0.02)
+        while ChatOutbox.get_pending_count() > 0:
+            await asyncio.sleep(0.1)
+        ChatOutbox.stop()
+        await task
+        print("Sent {} messages, merged {}, dropped {}".format(ChatOutbox.get_sent_count(), ChatOutbox.get_merged_count(), ChatOutbox.get_dropped_count()))
+
+    asyncio.run(flood())
@@ -0,0 +1,150 @@
+# NumPy is optional; without it random numbers are drawn one at a time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MASK64 = (1 << 64) - 1
+
+def mix(seed, index):
+    # SplitMix64: the index-th 64 bit number of the stream started by seed
+    z = (seed + (index+1)*0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30))*0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27))*0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+def mix_array(seed, start, count):
+    # The same numbers as mix for indices start to start+count-1, as a NumPy array (uint64 arithmetic wraps)
+    with numpy.errstate(over="ignore"):
+        z = numpy.uint64(seed) + numpy.arange(start+1, start+count+1, dtype=numpy.uint64)*numpy.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> numpy.uint64(30)))*numpy.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> numpy.uint64(27)))*numpy.uint64(0x94D049BB133111EB)
+        return z ^ (z >> numpy.uint64(31))
+
+class CombatEngine:
+    """
+    The combat engine works out the outcome of attacks and heals. It doesn't know about chat or the game, so a whole
+    batch (e.g. a tournament round) can be resolved in one pass and the balance can be checked on its own.
+
+    Actions are dictionaries of {"action": "attack" or "heal", "actor1": name, "actor2": name}. Resolving them is split
+    in two so the rolls can be shown before anything changes:
+    - roll draws the random numbers for every action at once and halves damage to defended chatters
+    - apply takes those rolls to a dictionary of chatter health, in order, and returns what happened as events
+    Each batch's numbers come from one seed taken from the RNG passed in. NumPy (for big batches) and plain Python draw
+    exactly the same numbers from it, so a seed gives the same outcome with or without NumPy and whatever the threshold.
+
+    Events are dictionaries with a "type":
+    - "damage" and "counter": {"source", "target", "amount", "health"} (health is the target's health afterwards)
+    - "heal": {"source", "target", "amount", "health"}
+    - "faint": {"target"}; fainted chatters are back at full health and don't counter
+    """
+    # Batches smaller than this are drawn one action at a time (NumPy's overhead isn't worth it); the numbers are the same
+    vectorize_threshold = 16
+
+    def __init__(self, damage_range, healing_range, counter_chance, max_health):
+        self._damage_range = damage_range
+        self._healing_range = healing_range
+        self._counter_chance = counter_chance
+        self._max_health = max_health
+
+    def integers(self, seed, block, count, low, high):
+        # count numbers from low to high (inclusive) from block of seed's stream; each block holds count numbers
+        span = high-low+1
+        if numpy is not None and count >= self.vectorize_threshold:
+            return ((mix_array(seed, block*count, count) % numpy.uint64(span)).astype(numpy.int64) + low).tolist()
+        return [low + mix(seed, block*count + i) % span for i in range(count)]
+
+    def draw(self, rng, count, attacks):
+        # Returns lists of damage, counter damage and counter rolls for attacks, or healing for heals. Only one number is
+        # taken from rng, so NumPy and plain Python draw exactly the same numbers
+        if count == 0:
+            return ([], [], []) if attacks else []
+        seed = rng.getrandbits(64)
+        if not attacks:
+            return self.integers(seed, 0, count, self._healing_range[0], self._healing_range[1])
+        return (self.integers(seed, 0, count, self._damage_range[0], self._damage_range[1]),
+                self.integers(seed, 1, count, self._damage_range[0], self._damage_range[1]),
+                [roll == 1 for roll in self.integers(seed, 2, count, 1, self._counter_chance)])
+
+    def roll(self, actions, is_defended, rng):
+        """
+        Returns a roll for each action: the action plus "damage", "counter_damage" and "counter" for attacks, or
+        "healing" for heals. is_defended(name) is asked about each attack's target, then its attacker, in order.
+        """
+        attacks = [action for action in actions if action["action"] == "attack"]
+        heals = [action for action in actions if action["action"] == "heal"]
+        damage, counter_damage, counter = self.draw(rng, len(attacks), True)
+        healing = self.draw(rng, len(heals), False)
+        rolls = []
+        attack_index = 0
+        heal_index = 0
+        for action in actions:
+            roll = dict(action)
+            if action["action"] == "attack":
+                i = attack_index
+                attack_index += 1
+                roll["damage"] = int(damage[i]/2) if is_defended(action["actor2"]) else damage[i]
+                roll["counter_damage"] = int(counter_damage[i]/2) if is_defended(action["actor1"]) else counter_damage[i]
+                roll["counter"] = counter[i]
+            elif action["action"] == "heal":
+                roll["healing"] = healing[heal_index]
+                heal_index += 1
+            else:
+                continue
+            rolls.append(roll)
+        return rolls
+
+    def apply(self, rolls, health):
+        """
+        Applies rolls to health (a dictionary of chatter name to health, changed in place) and returns the events.
+        """
+        events = []
+        for roll in rolls:
+            attacker = roll["actor1"]
+            target = roll["actor2"]
+            if roll["action"] == "heal":
+                health[target] = min(self._max_health, health[target] + roll["healing"])
+                events.append({"type": "heal", "source": attacker, "target": target, "amount": roll["healing"], "health": health[target]})
+                continue
+            fainted = self.damage(events, "damage", attacker, target, roll["damage"], health)
+            # Can't counter if you've fainted
+            if roll["counter"] and not fainted:
+                self.damage(events, "counter", target, attacker, roll["counter_damage"], health)
+        return events
+
+    def damage(self, events, event_type, source, target, amount, health):
+        health[target] -= amount
+        fainted = health[target] <= 0
+        if fainted:
+            health[target] = self._max_health
+        events.append({"type": event_type, "source": source, "target": target, "amount": amount, "health": health[target]})
+        if fainted:
+            events.append({"type": "faint", "target": target})
+        return fainted
+
+    def resolve(self, actions, health, is_defended, rng):
+        """
+        Rolls and applies actions in one go. Returns the events.
+        """
+        return self.apply(self.roll(actions, is_defended, rng), health)
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import random
+
+    # Resolve a tournament's worth of attacks between a few hundred chatters
+    engine = CombatEngine((99, 9999), (99, 2999), 10, 20000)
+    rng = random.Random(0)
+    chatters = ["chatter{}".format(i) for i in range(500)]
+    health = {name: 20000 for name in chatters}
+    defended = set(rng.sample(chatters, 100))
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    actions = [{"action": "attack" if rng.randint(1, 4) > 1 else "heal", "actor1": rng.choice(chatters), "actor2": rng.choice(chatters)} for i in range(count)]
+    start = time.perf_counter()
+    events = engine.resolve(actions, health, lambda name: name in defended, rng)
+    elapsed = time.perf_counter()-start
+    totals = {}
+    for event in events:
+        totals[event["type"]] = totals.get(event["type"], 0) + 1
+    print("Resolved {} actions in {:.1f}ms ({}): {}".format(count, elapsed*1000, "numpy" if numpy is not None else "random", totals))
@@ -1,223 +1,327 @@
 import traceback
-import threading
-import pygame
 from settings import Settings
 from game_interface import GameInterface
+from scheduler import CommandScheduler, SCHEDULERS
+from tracing import CommandTracer
 
-class Director:
+class Interaction:
     """
-    The director runs in another thread and coordinates active actors and animation sequences based on commands in a queue
+    An interaction is a non-blocking state machine that carries out one command. The director steps it every frame
+    until it stops returning "RUNNING". Actors involved in an interaction are reserved by the director until it ends.
     """
-    def __init__(self, actors):
-        self._command_queue = []
-        self._actors = actors
-        self._clock = pygame.time.Clock()
-        self._quit = False
-        self._director_thread = None
-    
-    def enqueue_command(self, command):
-        self._command_queue.append(command)
-    
-    def quit(self):
-        if not self._director_thread:
-            return
-        self._quit = True
-        self._director_thread.join(10)
-
-    def run(self):
-        self._director_thread = threading.Thread(target=self.direct)
-        self._director_thread.start()
-
-    def direct(self):
-        while not self._quit:
-            # Get command off queue
-            if len(self._command_queue) > 0:
-                try:
-                    # Search the queue for an action where the actors aren't fainted
-                    command = None
-                    for i, command in enumerate(self._command_queue):
-                        if not self.actors_are_fainted_or_puppeted(command):
-                            command = self._command_queue.pop(i)
-                            break
-                    if not command:
-                        self._clock.tick(Settings.framerate)
-                        continue
-                    # Handle the command based on the action
-                    print("Processing command: {}".format(command))
-                    if command["action"] == Settings.pet_cmd:
-                        self.direct_pet_interaction(command)
-                    elif command["action"] == Settings.attack_cmd:
-                        self.direct_attack_interaction(command)
-                    elif command["action"] == Settings.heal_cmd:
-                        self.direct_heal_interaction(command)
-                    elif command["action"] == Settings.defend_cmd:
-                        self.direct_defend_interaction(command)
-                    elif command["action"] == "faint":
-                        self.direct_faint_interaction(command)
-                    elif command["action"] == "update_skin":
-                        self.direct_update_skin(command)
-                    else:
-                        print("Unrecognized command. Ignoring: {}: {}".format(command["action"], command))
-                except:
-                    print("Failed to carry out command: {}".format(command))
-                    print(traceback.format_exc())
-            else:
-                # The clock will tick while commands are being directed so we don't want to double tick
-                self._clock.tick(Settings.framerate)
-    
-    def puppet_actor(self, actor):
-        self._actors[actor]["puppet"] = True
+    def __init__(self, director, command):
+        self._director = director
+        self._command = command
 
-    def unpuppet_actor(self, actor):
-        self._actors[actor]["puppet"] = False
-    
-    def make_actors_face_each_other(self, actor1, actor2):
-        if actor1.get_x() < actor2.get_x():
-            actor1.set_flipped(False)
-            actor2.set_flipped(True)
-        else:
-            actor1.set_flipped(True)
-            actor2.set_flipped(False)
-    
-    def position_actors_for_interaction(self, actor1, actor1_animator, actor2, actor2_animator):
-        move_to_pos_running = "RUNNING"
-        actor1_animator.set_animation("run")
-        actor2_animator.set_animation("idle")
+    def get_command(self):
+        return self._command
+
+    def start(self):
+        return "SUCCESS"
+
+    def run(self, deltatime):
+        return "SUCCESS"
+
+    def stop(self):
+        # Called once the interaction is finished (or failed) so it can release any puppets
+        return "SUCCESS"
+
+class PairInteraction(Interaction):
+    """
+    Moves actor1 over to actor2, then plays an animation on both of them.
+    """
+    def __init__(self, director, command, actor1_anim, actor2_anim):
+        super().__init__(director, command)
+        self._actor1 = director.get_actors()[command["actor1"]]
+        self._actor2 = director.get_actors()[command["actor2"]]
+        self._actor1_anim = actor1_anim
+        self._actor2_anim = actor2_anim
+        self._state = "POSITIONING"
+
+    def start(self):
+        self._director.set_puppet(self._actor1, True)
+        self._director.set_puppet(self._actor2, True)
+        self._actor1["animator"].set_animation("run")
+        self._actor2["animator"].set_animation("idle")
+        CommandTracer.mark(self._command, "movement_started")
         # Make actors face each other
-        self.make_actors_face_each_other(actor1, actor2)
-        deltatime = 0
-        # Move actor1 into position
-        while move_to_pos_running != "SUCCESS":
-            actor1_animator.play(deltatime)
-            actor2_animator.play(deltatime)
+        self._director.make_actors_face_each_other(self._actor1["actor"], self._actor2["actor"])
+        return "SUCCESS"
+
+    def run(self, deltatime):
+        actor1 = self._actor1["actor"]
+        actor2 = self._actor2["actor"]
+        actor1_anim_playing = self._actor1["animator"].play(deltatime)
+        actor2_anim_playing = self._actor2["animator"].play(deltatime)
+        if self._state == "POSITIONING":
+            # Move actor1 into position
             move_to_pos_running = actor1.move_to_point(
                 (actor2.get_x()+(-Settings.sprite_spacing if actor1.get_x() < actor2.get_x() else Settings.sprite_spacing), 
                  Settings.sprite_elevation), 
                 Settings.run_speed, 
                 Settings.move_epsilon, 
                 deltatime)
-            self._clock.tick(Settings.framerate)
-            deltatime = self._clock.get_time() * 0.001
-    
-    def play_interaction_animations(self, actor1_animator, actor2_animator, actor1_anim, actor2_anim):
-        actor1_anim_playing = "RUNNING"
-        actor2_anim_playing = "RUNNING"
-        actor1_animator.set_animation(actor1_anim)
-        actor2_animator.set_animation(actor2_anim)
-        deltatime = 0
-        while actor1_anim_playing == "RUNNING" or actor2_anim_playing == "RUNNING":
-            actor1_anim_playing = actor1_animator.play(deltatime)
-            actor2_anim_playing = actor2_animator.play(deltatime)
-            self._clock.tick(Settings.framerate)
-            deltatime = self._clock.get_time() * 0.001
-    
-    def direct_interaction(self, command, actor1_anim, actor2_anim):
-        # Get actors and animators
-        actor1 = self._actors[command["actor1"]]["actor"]
-        actor2 = self._actors[command["actor2"]]["actor"]
-        self.puppet_actor(command["actor1"])
-        self.puppet_actor(command["actor2"])
-        actor1_animator = self._actors[command["actor1"]]["animator"]
-        actor2_animator = self._actors[command["actor2"]]["animator"]
-        # Get actors into position
-        self.position_actors_for_interaction(actor1, actor1_animator, actor2, actor2_animator)
-        self.make_actors_face_each_other(actor1, actor2)
-        # Play animations
-        self.play_interaction_animations(actor1_animator, actor2_animator, actor1_anim, actor2_anim)
-        if command["action"] == Settings.attack_cmd:
-            GameInterface.undefend_actor(command["actor2"])
-        elif command["action"] == Settings.defend_cmd:
-            GameInterface.defend_actor(command["actor2"])
+            if move_to_pos_running == "SUCCESS":
+                # Play animations
+                self._director.make_actors_face_each_other(actor1, actor2)
+                self._actor1["animator"].set_animation(self._actor1_anim)
+                self._actor2["animator"].set_animation(self._actor2_anim)
+                self._state = "ANIMATING"
+                CommandTracer.mark(self._command, "animation_started")
+            return "RUNNING"
+        if actor1_anim_playing == "RUNNING" or actor2_anim_playing == "RUNNING":
+            return "RUNNING"
+        self._director.apply_command_effects(self._command)
         # Return to idle
-        actor1_animator.set_animation("idle")
-        actor2_animator.set_animation("idle")
-        self.unpuppet_actor(command["actor1"])
-        self.unpuppet_actor(command["actor2"])
+        self._actor1["animator"].set_animation("idle")
+        self._actor2["animator"].set_animation("idle")
         return "SUCCESS"
-    
-    def actors_are_fainted_or_puppeted(self, command):
-        if "actor" in command:
-            animator = self._actors[command["actor"]]["animator"]
-            if (animator.get_animation_name().startswith("faint") or
-                self._actors[command["actor"]]["puppet"]):
-                return True
-        if "actor1" in command:
-            animator = self._actors[command["actor1"]]["animator"]
-            if (animator.get_animation_name().startswith("faint") or
-                self._actors[command["actor1"]]["puppet"]):
-                return True
-        if "actor2" in command:
-            animator = self._actors[command["actor2"]]["animator"]
-            if (animator.get_animation_name().startswith("faint") or
-                self._actors[command["actor2"]]["puppet"]):
-                return True
-        return False
 
-    def direct_pet_interaction(self, command):
-        self.direct_interaction(command, "pet", "get-pet")
-    
-    def direct_attack_interaction(self, command):
-        self.direct_interaction(command, "attack", "get-attacked")
-    
-    def direct_defend_interaction(self, command):
-        self.direct_interaction(command, "defend", "get-defended")
-    
-    def direct_heal_interaction(self, command):
-        self.direct_interaction(command, "heal", "get-healed")
-    
-    def direct_faint_interaction(self, command):
-        # Just set the animation
-        self.puppet_actor(command["actor"])
-        actor1 = self._actors[command["actor"]]["actor"]
-        actor1_animator = self._actors[command["actor"]]["animator"]
+    def stop(self):
+        self._director.set_puppet(self._actor1, False)
+        self._director.set_puppet(self._actor2, False)
+        return "SUCCESS"
+
+class FaintInteraction(Interaction):
+    """
+    Plays the fainting animation, then leaves the actor fainted. The actor stays reserved (so no other command can use it)
+    until the faint animation has finished and at least MINIMUM_FAINT_TIME has passed.
+    """
+    def __init__(self, director, command):
+        super().__init__(director, command)
+        self._actor = director.get_actors()[command["actor"]]
+        self._state = "FAINTING"
+        self._timer = 0
+
+    def start(self):
+        self._director.set_puppet(self._actor, True)
+        CommandTracer.mark(self._command, "animation_started")
         # Play the fainting animation if available
-        if "fainting" in actor1_animator.get_animations():
-            deltatime = 0
-            fainting_status = "RUNNING"
-            actor1_animator.set_animation("fainting")
-            while fainting_status == "RUNNING":
-                fainting_status = actor1_animator.play(deltatime)
-                self._clock.tick(Settings.framerate)
-                deltatime = self._clock.get_time() * 0.001
+        if "fainting" in self._actor["animator"].get_animations():
+            self._actor["animator"].set_animation("fainting")
+        else:
+            self.set_fainted()
+        return "SUCCESS"
+
+    def set_fainted(self):
         # Play the fainted or faint animation and don't wait for exit
-        if "fainted" in actor1_animator.get_animations():
-            anim = "fainted"
-        elif "faint" in actor1_animator.get_animations():
-            anim = "faint"
-        actor1.set_goal(None)
-        actor1_animator.set_animation(anim)
-        self.unpuppet_actor(command["actor"])
-        # Don't process any more commands for another few seconds
-        deltatimer = 0
-        while deltatimer < Settings.minimum_faint_time:
-            self._clock.tick(Settings.framerate)
-            deltatimer += self._clock.get_time() * 0.001
+        animator = self._actor["animator"]
+        if "fainted" in animator.get_animations():
+            animator.set_animation("fainted")
+        elif "faint" in animator.get_animations():
+            animator.set_animation("faint")
+        self._actor["actor"].set_goal(None)
+        self._director.set_puppet(self._actor, False)
+        self._state = "FAINTED"
+
+    def run(self, deltatime):
+        self._timer += deltatime
+        if self._state == "FAINTING":
+            if self._actor["animator"].play(deltatime) == "RUNNING":
+                return "RUNNING"
+            self.set_fainted()
+            return "RUNNING"
+        # The main loop plays the faint animation and returns the actor to idle once it's done
+        if (self._timer < Settings.minimum_faint_time or
+            self._actor["animator"].get_animation_name().startswith("faint")):
+            return "RUNNING"
         return "SUCCESS"
-    
-    def play_animation(self, actor, animator, anim, puppet):
-        if puppet:
-            self.puppet_actor(actor)
-        animator.set_animation(anim)
-        deltatime = 0
-        faint_status = "RUNNING"
-        animator.set_animation(anim)
-        while faint_status == "RUNNING" and not self._quit:
-            faint_status = animator.play(deltatime)
-            self._clock.tick(Settings.framerate)
-            deltatime = self._clock.get_time() * 0.001
-        if puppet:
-            self.unpuppet_actor(actor)
+
+    def stop(self):
+        self._director.set_puppet(self._actor, False)
         return "SUCCESS"
-    
-    def direct_update_skin(self, command):
-        actor = self._actors[command["actor"]]["actor"]
-        result = GameInterface.change_actor_skin(command["actor"])
+
+class UpdateSkinInteraction(Interaction):
+    """
+    Swaps the actor's skin. Finishes immediately.
+    """
+    def start(self):
+        result = GameInterface.change_actor_skin(self._command["actor"])
         if result == "FAILURE":
             return "FAILURE"
-        actor_animator = self._actors[command["actor"]]["animator"]
-        actor_animator.set_animation("idle")
+        self._director.get_actors()[self._command["actor"]]["animator"].set_animation("idle")
+        CommandTracer.mark(self._command, "animation_started")
         return "SUCCESS"
 
+class Director:
+    """
+    The director coordinates active actors and animation sequences based on commands in a queue. It is stepped once per
+    frame from the main loop and runs as many interactions at once as it can, as long as they don't share any actors.
+    """
+    def __init__(self, actors):
+        scheduler = SCHEDULERS.get(Settings.director_scheduler)
+        if not scheduler:
+            print("WARNING: Unknown DIRECTOR_SCHEDULER {}; using fifo".format(Settings.director_scheduler))
+            scheduler = CommandScheduler
+        self._command_queue = scheduler(
+            max_length=Settings.director_queue_limit,
+            max_age=Settings.stale_command_age,
+            droppable_actions=(Settings.pet_cmd, Settings.defend_cmd),
+            coalesce=Settings.coalesce_commands,
+            on_drop=self.drop_command)
+        self._actors = actors
+        self._interactions = []
+        self._busy_actors = set()
+        self._listeners = []
+    
+    def enqueue_command(self, command):
+        self._command_queue.push(command)
+
+    def get_actors(self):
+        return self._actors
+
+    def add_listener(self, listener):
+        """
+        Registers listener(event, command) to be called when an interaction starts ("start") or finishes ("finish"), or
+        when a command is dropped from the queue without being played ("drop").
+        """
+        self._listeners.append(listener)
+
+    def notify_listeners(self, event, command):
+        for listener in self._listeners:
+            listener(event, command)
+
+    def get_queue_length(self):
+        return len(self._command_queue)
+
+    def get_active_interaction_count(self):
+        return len(self._interactions)
+
+    def get_pending_commands(self):
+        """
+        Returns the commands being played followed by the queued ones, e.g. to carry them over a restart.
+        """
+        return [interaction.get_command() for interaction in self._interactions] + self._command_queue.get_commands()
+
+    def get_dropped_counts(self):
+        return self._command_queue.get_dropped_counts()
+
+    def get_coalesced_count(self):
+        return self._command_queue.get_coalesced_count()
+
+    def step(self, deltatime):
+        # Advance running interactions and release the actors of finished ones
+        for interaction in list(self._interactions):
+            try:
+                status = interaction.run(deltatime)
+            except:
+                print("Failed to carry out command: {}".format(interaction.get_command()))
+                print(traceback.format_exc())
+                status = "FAILURE"
+            if status != "RUNNING":
+                self.finish_interaction(interaction)
+        # Start every queued command whose actors are free
+        while True:
+            command = self._command_queue.pop_runnable(self.get_busy_actor)
+            if not command:
+                break
+            if self.command_has_missing_actors(command):
+                print("Actor no longer exists. Ignoring: {}".format(command))
+                continue
+            self.start_interaction(command)
+
+    def start_interaction(self, command):
+        # Handle the command based on the action
+        CommandTracer.mark(command, "dequeued")
+        print("Processing command: {}".format(command))
+        interaction = None
+        try:
+            if command["action"] == Settings.pet_cmd:
+                interaction = PairInteraction(self, command, "pet", "get-pet")
+            elif command["action"] == Settings.attack_cmd:
+                interaction = PairInteraction(self, command, "attack", "get-attacked")
+            elif command["action"] == Settings.heal_cmd:
+                interaction = PairInteraction(self, command, "heal", "get-healed")
+            elif command["action"] == Settings.defend_cmd:
+                interaction = PairInteraction(self, command, "defend", "get-defended")
+            elif command["action"] == "faint":
+                interaction = FaintInteraction(self, command)
+            elif command["action"] == "update_skin":
+                interaction = UpdateSkinInteraction(self, command)
+            else:
+                print("Unrecognized command. Ignoring: {}: {}".format(command["action"], command))
+                return "FAILURE"
+            self._interactions.append(interaction)
+            self._busy_actors.update(self.get_command_actors(command))
+            if interaction.start() == "FAILURE":
+                self.finish_interaction(interaction)
+                return "FAILURE"
+            self.notify_listeners("start", command)
+            return "SUCCESS"
+        except:
+            print("Failed to carry out command: {}".format(command))
+            print(traceback.format_exc())
+            if interaction in self._interactions:
+                self.finish_interaction(interaction)
+            return "FAILURE"
+
+    def apply_command_effects(self, command):
+        # Effects that take place at the end of an interaction's animation
+        if command["action"] == Settings.attack_cmd:
+            GameInterface.undefend_actor(command["actor2"])
+        elif command["action"] == Settings.defend_cmd:
+            GameInterface.defend_actor(command["actor2"])
+        elif command["action"] == "update_skin":
+            GameInterface.change_actor_skin(command["actor"])
+
+    def drop_command(self, command, reason):
+        # Skip the animation but keep the outcome; health was already changed when chat sent the command
+        print("Dropping {} command: {}".format(reason, command))
+        if not self.command_has_missing_actors(command):
+            self.apply_command_effects(command)
+        self.notify_listeners("drop", command)
+
+    def finish_interaction(self, interaction):
+        try:
+            interaction.stop()
+        except:
+            print("Failed to clean up command: {}".format(interaction.get_command()))
+            print(traceback.format_exc())
+        self._interactions.remove(interaction)
+        for actor in self.get_command_actors(interaction.get_command()):
+            self._busy_actors.discard(actor)
+            # Wake up any commands waiting on this actor
+            self._command_queue.release(actor)
+        CommandTracer.mark(interaction.get_command(), "completed")
+        self.notify_listeners("finish", interaction.get_command())
+
+    def get_command_actors(self, command):
+        actors = []
+        for key in ("actor", "actor1", "actor2"):
+            if key in command:
+                actors.append(command[key])
+        return actors
+
+    def command_has_missing_actors(self, command):
+        for actor in self.get_command_actors(command):
+            if actor not in self._actors:
+                return True
+        return False
+
+    def get_busy_actor(self, command):
+        # Commands with missing actors are never busy so they get popped and dropped right away
+        if self.command_has_missing_actors(command):
+            return None
+        for actor in self.get_command_actors(command):
+            if actor in self._busy_actors:
+                return actor
+        return None
+
+    def is_actor_busy(self, actor):
+        return actor in self._busy_actors
+    
+    def set_puppet(self, actor, puppet):
+        actor["puppet"] = puppet
+        actor["actor"].set_puppet(puppet)
+
+    def make_actors_face_each_other(self, actor1, actor2):
+        if actor1.get_x() < actor2.get_x():
+            actor1.set_flipped(False)
+            actor2.set_flipped(True)
+        else:
+            actor1.set_flipped(True)
+            actor2.set_flipped(False)
+
 if __name__ == "__main__":
     import pygame
     import sys
@@ -265,7 +369,6 @@ if __name__ == "__main__":
         }
     }
     director = Director(actors)
-    director.run()
 
     director.enqueue_command({
         "actor1": "zingochris",
@@ -273,11 +376,16 @@ if __name__ == "__main__":
         "action": "pet",
         "metadata": None
     })
+    director.enqueue_command({
+        "actor1": "spagettd",
+        "actor2": "lifeuhfindsaway",
+        "action": "pet",
+        "metadata": None
+    })
 
     while True:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                director.quit()
                 sys.exit()
 
         # Game logic
@@ -294,6 +402,9 @@ if __name__ == "__main__":
             if not actor["actor"].get_goal() and actor["animator"].get_animation_name() == "walk":
                 actor["animator"].set_animation("idle")
             actor["actor"].run(deltatime)
+
+        # Advance interactions
+        director.step(deltatime)
         
         screen.fill((0,0,0))
 
@@ -303,9 +414,8 @@ if __name__ == "__main__":
                 actor["animator"].play(deltatime)
             actor["animator"].set_flipped(actor["actor"].get_flipped())
             screen.blit(
-                pygame.transform.flip(actor["animator"].get_img(), actor["animator"].get_flipped(), False), 
-                (actor["actor"].get_x()-actor["animator"].get_half_size(), actor["actor"].get_y()-actor["animator"].get_half_size()), 
-                actor["animator"].get_crop_square()
+                actor["animator"].get_frame(), 
+                (actor["actor"].get_x()-actor["animator"].get_half_size(), actor["actor"].get_y()-actor["animator"].get_half_size())
             )
 
         pygame.display.flip()
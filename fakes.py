@@ -0,0 +1,40 @@
+# Stand-ins for twitchAPI's chat objects and helpers shared by benchmark.py and replay.py
+
+class FakeUser:
+    def __init__(self, name):
+        self.name = name
+
+class FakeMessage:
+    """
+    Stand-in for twitchAPI's ChatMessage with just what the handlers in twitch.py use.
+    """
+    def __init__(self, user, text):
+        self.user = FakeUser(user)
+        self.text = text
+
+    async def reply(self, text):
+        FakeChat.messages += 1
+
+class FakeCommand(FakeMessage):
+    """
+    Stand-in for twitchAPI's ChatCommand.
+    """
+    def __init__(self, user, name, parameter):
+        super().__init__(user, "!{} {}".format(name, parameter))
+        self.name = name
+        self.parameter = parameter
+
+class FakeChat:
+    """
+    Stand-in for twitchAPI's Chat. Messages from the chat outbox are counted instead of sent.
+    """
+    messages = 0
+
+    async def send_message(self, channel, text):
+        FakeChat.messages += 1
+
+def percentile(values, percent):
+    if len(values) < 1:
+        return 0
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values)*percent/100))]
@@ -0,0 +1,207 @@
+import pygame
+import time
+from director import Director
+from game_interface import GameInterface
+from twitch_interface import TwitchInterface
+from settings import Settings
+from resources import ResourceManager
+from actor import SkinRegistry
+from nametag import layout_nametags
+from renderer import Renderer, DirtyRectRenderer
+from governor import QualityGovernor
+from profiler import FrameProfiler
+from tracing import CommandTracer
+from metrics import Metrics
+from runtime import Runtime
+
+class Game:
+    """
+    The game loads resources and runs the main loop: actor logic, the director and rendering. It expects the display to
+    already be set up.
+    """
+    # Longest frame time (in seconds) simulated in one frame
+    max_frame_time = 0.25
+
+    def __init__(self, screen):
+        self._screen = screen
+        self._clock = pygame.time.Clock()
+        # Load resources
+        ResourceManager.set_rle_acceleration(Settings.rle_sprites)
+        if Settings.asset_bundle:
+            ResourceManager.load_bundle(Settings.asset_bundle)
+        SkinRegistry.preload_random_skins()
+        SkinRegistry.preload_special_skins()
+        self._shield_img = ResourceManager.load_img("shield.png")
+        self._director = Director(GameInterface.get_actors())
+        GameInterface.set_director(self._director)
+        self._deltatime = 0
+        # Game logic runs in fixed steps; leftover frame time carries over to the next frame
+        self._timestep = 1/Settings.simulation_rate
+        self._accumulator = 0
+        self._renderer = DirtyRectRenderer() if Settings.dirty_rect_rendering else Renderer()
+        self._governor = QualityGovernor(Settings.framerate, Settings.quality_governor)
+        self._frame = 0
+        self._step = 0
+        FrameProfiler.set_buffer_size(Settings.profiler_buffer_size)
+        FrameProfiler.set_enabled(Settings.profiler or Settings.profiler_overlay)
+        CommandTracer.set_enabled(Settings.command_tracing)
+        Metrics.set_enabled(bool(Settings.metrics_port or Settings.metrics_file))
+        Metrics.set_director(self._director)
+
+    def get_director(self):
+        return self._director
+
+    def get_deltatime(self):
+        return self._deltatime
+
+    def get_timestep(self):
+        return self._timestep
+
+    def get_governor(self):
+        return self._governor
+
+    def handle_events(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return "QUIT"
+            # The window contents may have been lost
+            if event.type in (pygame.VIDEOEXPOSE, pygame.VIDEORESIZE):
+                self._renderer.invalidate()
+        return "RUNNING"
+
+    def update(self, deltatime):
+        # Run game interface logic
+        GameInterface.run()
+        FrameProfiler.mark("interface")
+
+        # Remember where everyone was for interpolation
+        actor_store = GameInterface.get_actor_store()
+        if actor_store:
+            actor_store.save_previous_positions()
+        else:
+            for actor in GameInterface.get_actors().values():
+                actor["actor"].save_previous_position()
+
+        # Game logic
+        if actor_store:
+            move_rolls = actor_store.roll_moves(Settings.move_chance)
+        for actor in GameInterface.get_actors().values():
+            # Don't mess with actors that are currently being puppeted by the director
+            if actor["puppet"]:
+                continue
+            # Decide if we want this actor to move or not (if it's sitting around)
+            if actor_store:
+                move = move_rolls[actor["actor"].get_index()]
+            else:
+                move = True if Runtime.get_game_random().randint(1,Settings.move_chance) == 1 else False
+            # If some actor is just sitting around, consider moving them
+            if actor["animator"].get_animation_name() == "idle" and move:
+                actor["animator"].set_animation("walk")
+                actor["actor"].set_goal((Runtime.get_game_random().randint(Settings.sprite_spacing, Settings.screen_width-Settings.sprite_spacing), Settings.sprite_elevation))
+            # If an actor has reached their goal, return them to idle
+            if not actor["actor"].get_goal() and actor["animator"].get_animation_name() == "walk":
+                actor["animator"].set_animation("idle")
+            # Run actor logic (actors in the actor store all move at once below)
+            if not actor_store:
+                actor["actor"].run(deltatime)
+        if actor_store:
+            actor_store.run(deltatime)
+        FrameProfiler.mark("actors")
+
+        # Advance director interactions (this animates puppeted actors)
+        self._director.step(deltatime)
+        FrameProfiler.mark("director")
+
+        # Animate non-puppeted actors (puppeted actors get animated by the director)
+        # Idle animations may be updated less often if we're running behind
+        self._step += 1
+        idle_interval = self._governor.get_idle_animation_interval()
+        for actor in GameInterface.get_actors().values():
+            if not actor["puppet"]:
+                if idle_interval > 1 and actor["animator"].get_animation_name() == "idle":
+                    anim_status = actor["animator"].play(deltatime*idle_interval) if self._step%idle_interval == 0 else "RUNNING"
+                else:
+                    anim_status = actor["animator"].play(deltatime)
+                # If playing a non-looping animation and it's finished, return to idle
+                if anim_status != "RUNNING":
+                    actor["animator"].set_animation("idle")
+            # Set flipped status of the animator using the actor's flipped status
+            actor["animator"].set_flipped(actor["actor"].get_flipped())
+        FrameProfiler.mark("animation")
+
+    def add_draw_items(self, items, actor_name, actor, alpha=1.0, nametag=True):
+        # Draw between the last two simulation steps
+        x, y = actor["actor"].get_interpolated_position(alpha)
+        # Keys include the puppet flag since puppeted actors are drawn in a different layer
+        if GameInterface.is_actor_defended(actor_name):
+            items.append((
+                (actor_name, "shield", actor["puppet"]),
+                self._shield_img,
+                (int(x-self._shield_img.get_rect().width/2), int(y-self._shield_img.get_rect().height/2))
+            ))
+        items.append((
+            (actor_name, "sprite", actor["puppet"]),
+            actor["animator"].get_frame(),
+            (int(x-actor["animator"].get_half_size()), int(y-actor["animator"].get_half_size()))
+        ))
+        if nametag:
+            items.append(((actor_name, "nametag", actor["puppet"]), actor["nametag"].get_img(), actor["nametag"].get_position(actor, alpha)))
+
+    def render(self, alpha=1.0):
+        items = []
+        # Only draw actors if the timeout hasn't elapsed
+        if (not Settings.rendering_timeout or
+            time.time() < TwitchInterface.get_last_command_time() + Settings.rendering_timeout):
+            # Stack overlapping nametags
+            if self._governor.should_layout_nametags(self._frame):
+                layout_nametags(GameInterface.get_actors())
+            FrameProfiler.mark("layout")
+            # The governor may limit how many idle/walking actors and nametags get drawn
+            max_actors = self._governor.get_max_visible_actors()
+            max_nametags = self._governor.get_max_nametags()
+            drawn = 0
+            for actor_name, actor in GameInterface.get_actors().items():
+                if not actor["puppet"]:
+                    if max_actors is not None and drawn >= max_actors:
+                        break
+                    self.add_draw_items(items, actor_name, actor, alpha, max_nametags is None or drawn < max_nametags)
+                    drawn += 1
+            # Draw the puppeted actors on top
+            for actor_name, actor in GameInterface.get_actors().items():
+                if actor["puppet"]:
+                    self.add_draw_items(items, actor_name, actor, alpha)
+        # Performance overlay goes on top of everything
+        if Settings.profiler_overlay:
+            items.append((("profiler", "overlay"), FrameProfiler.get_overlay_img([
+                ("Chatters", len(GameInterface.get_actors())),
+                ("Queue", self._director.get_queue_length()),
+                ("Quality", self._governor.get_level_name())
+            ]), (0, 0)))
+        FrameProfiler.mark("draw_list")
+        self._renderer.render(self._screen, items)
+
+    def run_frame(self):
+        """
+        Runs one frame of the game without waiting for the next one. Returns "QUIT" if the window was closed.
+        """
+        FrameProfiler.begin_frame()
+        if self.handle_events() == "QUIT":
+            return "QUIT"
+        FrameProfiler.mark("events")
+        start = time.perf_counter()
+        # Run as many fixed steps as the last frame took, capped so a long hitch doesn't snowball
+        self._accumulator += min(self._deltatime, self.max_frame_time)
+        while self._accumulator >= self._timestep:
+            self.update(self._timestep)
+            self._accumulator -= self._timestep
+        self.render(self._accumulator/self._timestep)
+        self._frame += 1
+        frame_time = time.perf_counter()-start
+        self._governor.add_frame_time(frame_time)
+        Metrics.observe_frame_time(frame_time)
+        FrameProfiler.end_frame()
+        return "RUNNING"
+
+    def tick(self):
+        self._clock.tick(Settings.framerate)
+        self._deltatime = self._clock.get_time() * 0.001
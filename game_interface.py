@@ -1,33 +1,62 @@
 import os
-import random
-from actor import Actor, Animator
+import queue
+from collections import deque
+from actor import Actor, Animator, SkinRegistry
+from actor_store import ActorStore, StoredActor, numpy
 from settings import Settings
 from nametag import Nametag
 from skins import SkinOverrides
+from tracing import CommandTracer
+from runtime import Runtime
 
 class _GameInterface:
+    """
+    Owns the actors. Actors are only ever touched from the main (render) thread; other threads post requests through
+    add_actor, enqueue_delete_actor and enqueue_command, which are queued and applied once per frame in run.
+    """
     def __init__(self):
         self._actors = {}
-        self._remove_queue = []
+        self._remove_queue = deque()
+        self._remove_pending = set()
         self._director = None
+        self._inbox = queue.SimpleQueue()
+        self._actor_store = None
+        self._actor_store_checked = False
     
     def add_actor(self, name, x):
+        self._inbox.put(("add_actor", name, x))
+
+    def restore_actor(self, name, x, skin_path=None):
+        """
+        Creates an actor right away with the given skin (or the usual one if None) and returns it. Only call this from the
+        main thread, e.g. to restore a snapshot before the game starts.
+        """
+        self._add_actor(name, x, skin_path)
+        return self._actors[name]
+
+    def _add_actor(self, name, x, skin_path=None):
+        # A chatter that comes back before being removed keeps their actor
+        self._remove_pending.discard(name)
         if name not in self._actors:
             # Create actor
-            actor = Actor(x, Settings.sprite_elevation)
+            if self.get_actor_store():
+                actor = StoredActor(self._actor_store, x, Settings.sprite_elevation)
+            else:
+                actor = Actor(x, Settings.sprite_elevation)
             # Determine skin to use
             animator = None
             override = SkinOverrides.get_override_for_name(name)
-            if override:
+            if skin_path:
+                animator = Animator(skin_path)
+            elif override:
                 animator = Animator(override)
             else:
-                path = os.path.join("skins", "special", name)
-                if os.path.exists(path):
-                    animator = Animator(path)
+                if SkinRegistry.has_special_skin(name):
+                    animator = Animator(os.path.join("skins", "special", name))
                 else:
                     # Pick a random skin to use
-                    skins = SkinOverrides.get_available_skins()
-                    skin = random.choice(skins)
+                    skins = SkinRegistry.get_random_skins()
+                    skin = Runtime.get_game_random().choice(skins)
                     skin_path = os.path.join("skins", "random", skin)
                     animator = Animator(skin_path)
             # Sanity check
@@ -64,24 +93,66 @@ class _GameInterface:
             self._actors[name]["defended"] = False
     
     def is_actor_defended(self, name):
-        if name in self._actors:
-            return self._actors[name]["defended"]
-        else:
-            return False
+        # Safe to call from other threads; a single get can't race with the main thread deleting the actor
+        actor = self._actors.get(name)
+        return actor["defended"] if actor else False
 
     def run(self):
-        if len(self._remove_queue) < 1:
-            return
-        # Don't delete from actors if this actor is currently being puppeted by the director
-        if not self._actors[self._remove_queue[0]]["puppet"]:
-            del self._actors[self._remove_queue.pop(0)]
+        self.process_inbox()
+        self.remove_actors()
+
+    def remove_actors(self):
+        # Remove a batch of actors per frame. Actors the director is still using are deferred without holding up the rest
+        deferred = []
+        removed = 0
+        while len(self._remove_queue) > 0 and removed < Settings.actor_removal_batch_size:
+            name = self._remove_queue.popleft()
+            # Skip removals that were cancelled
+            if name not in self._remove_pending:
+                continue
+            if name not in self._actors:
+                self._remove_pending.discard(name)
+                continue
+            if self.is_actor_in_use(name):
+                deferred.append(name)
+                continue
+            self._actors[name]["actor"].remove()
+            del self._actors[name]
+            self._remove_pending.discard(name)
+            removed += 1
+        self._remove_queue.extend(deferred)
+
+    def is_actor_in_use(self, name):
+        if self._actors[name]["puppet"]:
+            return True
+        if self._director and self._director.is_actor_busy(name):
+            return True
+        return False
+    
+    def process_inbox(self):
+        # Apply everything other threads have posted since the last frame
+        while True:
+            try:
+                message = self._inbox.get_nowait()
+            except queue.Empty:
+                return
+            if message[0] == "add_actor":
+                self._add_actor(message[1], message[2])
+            elif message[0] == "delete_actor":
+                if message[1] not in self._remove_pending:
+                    self._remove_pending.add(message[1])
+                    self._remove_queue.append(message[1])
+            elif message[0] == "command":
+                if self._director:
+                    self._director.enqueue_command(message[1])
     
     def enqueue_delete_actor(self, actor):
-        self._remove_queue.append(actor)
+        self._inbox.put(("delete_actor", actor))
 
-    def enqueue_command(self, command):
-        if self._director:
-            self._director.enqueue_command(command)
+    def enqueue_command(self, command, received_time=None):
+        # received_time is when the chat message that caused the command arrived, for tracing
+        CommandTracer.start_trace(command, received_time)
+        self._inbox.put(("command", command))
     
     def set_director(self, director):
         self._director = director
@@ -89,5 +160,16 @@ class _GameInterface:
     def get_actors(self):
         return self._actors
 
+    def get_actor_store(self):
+        # Create the NumPy actor store on first use if it's enabled
+        if not self._actor_store_checked:
+            self._actor_store_checked = True
+            if Settings.numpy_actor_store:
+                if numpy is None:
+                    print("WARNING: NUMPY_ACTOR_STORE is enabled but numpy is not installed; using regular actors")
+                else:
+                    self._actor_store = ActorStore()
+        return self._actor_store
+
 
 GameInterface = _GameInterface()
\ No newline at end of file
@@ -0,0 +1,91 @@
+from collections import deque
+from settings import Settings
+
+class QualityGovernor:
+    """
+    The quality governor watches how long each frame takes against the frame budget and sheds drawing work when we go
+    over it, one level at a time. Levels are cumulative: each one keeps the savings of the levels below it. Quality is
+    restored one level at a time once there's plenty of headroom again.
+    """
+    levels = (
+        "FULL",             # Everything is drawn every frame
+        "ALTERNATE_LAYOUT", # Nametags are only laid out every other frame
+        "CAP_NAMETAGS",     # Only GOVERNOR_MAX_NAMETAGS idle/walking chatters get a nametag
+        "SLOW_IDLE",        # Idle animations are updated every other simulation step
+        "CAP_ACTORS"        # Only GOVERNOR_MAX_VISIBLE_ACTORS idle/walking chatters are drawn
+    )
+    # Frames averaged before deciding to change level
+    window = 30
+    # Drop a level when the average frame takes more than this fraction of the budget
+    degrade_threshold = 0.9
+    # Restore a level once this many windows in a row were under this fraction of the budget
+    restore_threshold = 0.5
+    restore_windows = 4
+
+    def __init__(self, framerate, enabled=True):
+        self._budget = 1/framerate
+        self._enabled = enabled
+        self._level = 0
+        self._samples = deque(maxlen=self.window)
+        self._headroom_windows = 0
+
+    def add_frame_time(self, frame_time):
+        """
+        Records how long the last frame took to run (in seconds, not counting time spent waiting for the next frame).
+        """
+        if not self._enabled:
+            return
+        self._samples.append(frame_time)
+        if len(self._samples) < self.window:
+            return
+        average = sum(self._samples)/len(self._samples)
+        self._samples.clear()
+        if average > self._budget*self.degrade_threshold:
+            self._headroom_windows = 0
+            if self._level < len(self.levels)-1:
+                self.set_level(self._level+1, average)
+        elif average < self._budget*self.restore_threshold:
+            self._headroom_windows += 1
+            if self._headroom_windows >= self.restore_windows and self._level > 0:
+                self._headroom_windows = 0
+                self.set_level(self._level-1, average)
+        else:
+            self._headroom_windows = 0
+
+    def set_level(self, level, average=None):
+        level = max(0, min(len(self.levels)-1, level))
+        if level == self._level:
+            return
+        if average is None:
+            print("Quality level changed to {}".format(self.levels[level]))
+        else:
+            print("Quality level changed to {} (average frame time {:.1f}ms, budget {:.1f}ms)".format(
+                self.levels[level], average*1000, self._budget*1000))
+        self._level = level
+
+    def get_level(self):
+        return self._level
+
+    def get_level_name(self):
+        return self.levels[self._level]
+
+    def should_layout_nametags(self, frame):
+        return self._level < 1 or frame%2 == 0
+
+    def get_max_nametags(self):
+        return Settings.governor_max_nametags if self._level >= 2 else None
+
+    def get_idle_animation_interval(self):
+        return 2 if self._level >= 3 else 1
+
+    def get_max_visible_actors(self):
+        return Settings.governor_max_visible_actors if self._level >= 4 else None
+
+if __name__ == "__main__":
+    # Feed the governor slow frames, then fast ones, and watch it change levels
+    governor = QualityGovernor(60)
+    for i in range(QualityGovernor.window*len(QualityGovernor.levels)):
+        governor.add_frame_time(0.03)
+    for i in range(QualityGovernor.window*QualityGovernor.restore_windows*len(QualityGovernor.levels)):
+        governor.add_frame_time(0.002)
+    print("Final level: {}".format(governor.get_level_name()))
@@ -0,0 +1,213 @@
+import os
+import threading
+import traceback
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from game_interface import GameInterface
+from twitch_interface import TwitchInterface
+from resources import ResourceManager
+from tracing import Histogram, CommandTracer
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels) + "}"
+
+def format_histogram(lines, name, labels, buckets, count, total):
+    # buckets is a list of (upper bound, cumulative count) pairs ending with "+Inf"
+    for bound, bucket_count in buckets:
+        lines.append("{}_bucket{} {}".format(name, format_labels(labels + [("le", bound)]), bucket_count))
+    lines.append("{}_sum{} {}".format(name, format_labels(labels), total))
+    lines.append("{}_count{} {}".format(name, format_labels(labels), count))
+
+class _Metrics:
+    """
+    Collects counters for live monitoring and exposes them, along with gauges read from the other singletons, in the
+    Prometheus text format. Metrics are served over HTTP and/or written to a file from background threads, so the only
+    cost to the main loop is bumping counters.
+    """
+    frame_buckets = (0.002, 0.004, 0.008, 0.016, 0.033, 0.05, 0.1, 0.25, 0.5, 1)
+
+    def __init__(self):
+        self._enabled = False
+        self._director = None
+        self._lock = threading.Lock()
+        self._commands = {}
+        self._faints = 0
+        self._frame_times = Histogram(self.frame_buckets)
+        self._server = None
+        self._writer_thread = None
+        self._writer_stop = threading.Event()
+
+    def set_enabled(self, enabled):
+        self._enabled = enabled
+
+    def is_enabled(self):
+        return self._enabled
+
+    def set_director(self, director):
+        self._director = director
+        director.add_listener(self.on_director_event)
+
+    def on_director_event(self, event, command):
+        # Count commands as they finish
+        if not self._enabled or event != "finish":
+            return
+        with self._lock:
+            self._commands[command["action"]] = self._commands.get(command["action"], 0) + 1
+            if command["action"] == "faint":
+                self._faints += 1
+
+    def observe_frame_time(self, frame_time):
+        if not self._enabled:
+            return
+        with self._lock:
+            self._frame_times.observe(frame_time)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        lines.append("# HELP fight_pit_actors Chatters on screen.")
+        lines.append("# TYPE fight_pit_actors gauge")
+        lines.append("fight_pit_actors {}".format(len(GameInterface.get_actors())))
+        lines.append("# HELP fight_pit_chatters Chatters being tracked.")
+        lines.append("# TYPE fight_pit_chatters gauge")
+        lines.append("fight_pit_chatters {}".format(len(TwitchInterface.get_chatter_metadata())))
+        if self._director:
+            lines.append("# HELP fight_pit_director_queue_length Commands waiting for the director.")
+            lines.append("# TYPE fight_pit_director_queue_length gauge")
+            lines.append("fight_pit_director_queue_length {}".format(self._director.get_queue_length()))
+            lines.append("# HELP fight_pit_active_interactions Interactions the director is running.")
+            lines.append("# TYPE fight_pit_active_interactions gauge")
+            lines.append("fight_pit_active_interactions {}".format(self._director.get_active_interaction_count()))
+            lines.append("# HELP fight_pit_commands_dropped_total Commands skipped by the director queue.")
+            lines.append("# TYPE fight_pit_commands_dropped_total counter")
+            dropped = self._director.get_dropped_counts()
+            for reason in ("stale", "overflow"):
+                lines.append("fight_pit_commands_dropped_total{} {}".format(format_labels([("reason", reason)]), dropped.get(reason, 0)))
+            lines.append("# HELP fight_pit_commands_coalesced_total Commands folded into an identical waiting command.")
+            lines.append("# TYPE fight_pit_commands_coalesced_total counter")
+            lines.append("fight_pit_commands_coalesced_total {}".format(self._director.get_coalesced_count()))
+        lines.append("# HELP fight_pit_resource_cache_images Images and animation frames cached by the resource manager.")
+        lines.append("# TYPE fight_pit_resource_cache_images gauge")
+        lines.append("fight_pit_resource_cache_images {}".format(ResourceManager.get_cache_size()))
+        lines.append("# HELP fight_pit_resource_cache_bytes Approximate memory used by cached images and animation frames.")
+        lines.append("# TYPE fight_pit_resource_cache_bytes gauge")
+        lines.append("fight_pit_resource_cache_bytes {}".format(ResourceManager.get_cache_bytes()))
+        with self._lock:
+            commands = dict(self._commands)
+            faints = self._faints
+            frame_buckets = self._frame_times.get_buckets()
+            frame_count = self._frame_times.get_count()
+            frame_sum = self._frame_times.get_sum()
+        lines.append("# HELP fight_pit_commands_total Commands processed by the director.")
+        lines.append("# TYPE fight_pit_commands_total counter")
+        for action in sorted(commands):
+            lines.append("fight_pit_commands_total{} {}".format(format_labels([("action", action)]), commands[action]))
+        lines.append("# HELP fight_pit_faints_total Chatters that fainted.")
+        lines.append("# TYPE fight_pit_faints_total counter")
+        lines.append("fight_pit_faints_total {}".format(faints))
+        lines.append("# HELP fight_pit_frame_seconds Time spent running each frame, not counting waiting for the next one.")
+        lines.append("# TYPE fight_pit_frame_seconds histogram")
+        format_histogram(lines, "fight_pit_frame_seconds", [], frame_buckets, frame_count, frame_sum)
+        if CommandTracer.is_enabled():
+            lines.append("# HELP fight_pit_command_seconds Time between stages of a command, from chat message to the end of its animation.")
+            lines.append("# TYPE fight_pit_command_seconds histogram")
+            for interval, actions in CommandTracer.get_histograms().items():
+                for action, data in actions.items():
+                    format_histogram(lines, "fight_pit_command_seconds", [("interval", interval), ("action", action)],
+                                     data["buckets"], data["count"], data["sum"])
+        return "\n".join(lines) + "\n"
+
+    def start_server(self, address, port):
+        """
+        Serves the metrics at http://address:port/metrics from a background thread.
+        """
+        if self._server:
+            return "FAILURE"
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                try:
+                    body = metrics.render().encode("utf-8")
+                except:
+                    print(traceback.format_exc())
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Don't print every scrape
+                return
+
+        try:
+            self._server = ThreadingHTTPServer((address, port), MetricsHandler)
+        except:
+            print("WARNING: Failed to start metrics server on {}:{}".format(address, port))
+            print(traceback.format_exc())
+            return "FAILURE"
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print("Serving metrics on http://{}:{}/metrics".format(address, port))
+        return "SUCCESS"
+
+    def write_file(self, path):
+        # Write to a temporary file first so readers never see a half written file
+        try:
+            temp_path = path + ".tmp"
+            with open(temp_path, "w") as metrics_file:
+                metrics_file.write(self.render())
+            os.replace(temp_path, path)
+            return "SUCCESS"
+        except:
+            print("WARNING: Failed to write metrics to {}".format(path))
+            print(traceback.format_exc())
+            return "FAILURE"
+
+    def start_writer_thread(self, path, interval):
+        """
+        Writes the metrics to path every interval seconds from a background thread (e.g. for node_exporter's textfile collector).
+        """
+        if self._writer_thread:
+            return "FAILURE"
+        self._writer_stop.clear()
+
+        def write_loop():
+            while not self._writer_stop.wait(interval):
+                self.write_file(path)
+            self.write_file(path)
+
+        self._writer_thread = threading.Thread(target=write_loop, daemon=True)
+        self._writer_thread.start()
+        return "SUCCESS"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._writer_thread:
+            self._writer_stop.set()
+            self._writer_thread.join(10)
+            self._writer_thread = None
+        return "SUCCESS"
+
+Metrics = _Metrics()
+
+if __name__ == "__main__":
+    # Print the metrics with some fake data
+    Metrics.set_enabled(True)
+    for i in range(100):
+        Metrics.observe_frame_time(0.001*i)
+    Metrics.on_director_event("finish", {"action": "attack"})
+    Metrics.on_director_event("finish", {"action": "faint"})
+    print(Metrics.render())
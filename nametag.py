@@ -1,37 +1,79 @@
+from bisect import bisect_left, bisect_right
 from settings import Settings
+from resources import ResourceManager
 
 class Nametag:
     def __init__(self, name):
         self._name = name
-        self._img = Settings.nametag_font.render(name, Settings.nametag_antialias, Settings.nametag_color)
+        self._img = ResourceManager.convert_surface(Settings.nametag_font.render(name, Settings.nametag_antialias, Settings.nametag_color), True)
+        self._width = self._img.get_rect().width
+        self._height = self._img.get_rect().height
+        self._level = 0
 
     def get_img(self):
         return self._img
 
-    def blit(self, screen, actors):
-        # Set our initial location
-        our_actor = actors[self._name]
-        x = our_actor["actor"].get_x()
-        y = our_actor["actor"].get_y()-our_actor["animator"].get_half_size()
-        # If there are other actors to the right overlapping us, move up
-        x_min_bound = x-self._img.get_rect().width/2
-        x_max_bound = x+self._img.get_rect().width/2
-        overlaps = 0
-        for actor in actors:
-            actor_name = actor
-            if actor_name == self._name:
-                continue
-            actor = actors[actor]
-            if actor["actor"].get_x() < x:
-                continue
-            # Check bounds
-            actor_x_min_bound = actor["actor"].get_x()-actor["nametag"].get_img().get_rect().width/2
-            actor_x_max_bound = actor["actor"].get_x()+actor["nametag"].get_img().get_rect().width/2
-            if (((actor_x_min_bound >= x_min_bound and actor_x_min_bound <= x_max_bound) or
-                (actor_x_max_bound >= x_min_bound and actor_x_max_bound <= x_max_bound)) and
-                actor_x_min_bound >= x_min_bound):
-                overlaps += 1
-        # Limit y so it doesn't just go to the top of the screen
-        y -= (overlaps%Settings.nametag_overlap_limit)*(Settings.nametag_font_size+2)
-        # Now blit at our final position
-        screen.blit(self._img, (int(x-self._img.get_rect().width/2), int(y-self._img.get_rect().height)), self._img.get_rect())
\ No newline at end of file
+    def get_width(self):
+        return self._width
+
+    def set_level(self, level):
+        self._level = level
+
+    def get_level(self):
+        return self._level
+
+    def get_position(self, actor, alpha=1.0):
+        # Set our initial location (alpha interpolates between simulation steps)
+        x, y = actor["actor"].get_interpolated_position(alpha)
+        y -= actor["animator"].get_half_size()
+        # Move up by the stack level assigned in layout_nametags
+        y -= self._level*(Settings.nametag_font_size+2)
+        return (int(x-self._width/2), int(y-self._height))
+
+    def blit(self, screen, actor):
+        screen.blit(self._img, self.get_position(actor))
+
+def layout_nametags(actors):
+    """
+    Assigns a stack level to every nametag so overlapping nametags move up. Should be run once per frame before blitting.
+    A nametag moves up once for every other nametag at or to the right of it whose left edge falls within its bounds,
+    wrapping around after NAMETAG_OVERLAP_LIMIT levels. Runs in O(n log n) using a Fenwick tree over left edges.
+    """
+    # Collect position and bounds of every nametag
+    entries = []
+    for actor in actors.values():
+        x = actor["actor"].get_x()
+        half_width = actor["nametag"].get_width()/2
+        entries.append((x, x-half_width, x+half_width, actor["nametag"]))
+    # Compress left edges into indices for the Fenwick tree
+    min_bounds = sorted(set(entry[1] for entry in entries))
+    tree = [0]*(len(min_bounds)+1)
+
+    def insert(index):
+        index += 1
+        while index < len(tree):
+            tree[index] += 1
+            index += index & -index
+
+    def count_below(index):
+        # Count inserted left edges with compressed index < index
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+    # Sweep from right to left, inserting actors with equal x together so they count each other
+    entries.sort(key=lambda entry: entry[0], reverse=True)
+    i = 0
+    while i < len(entries):
+        j = i
+        while j < len(entries) and entries[j][0] == entries[i][0]:
+            insert(bisect_left(min_bounds, entries[j][1]))
+            j += 1
+        for x, x_min_bound, x_max_bound, nametag in entries[i:j]:
+            # Left edges within our bounds, minus ourselves
+            overlaps = count_below(bisect_right(min_bounds, x_max_bound)) - count_below(bisect_left(min_bounds, x_min_bound)) - 1
+            # Limit y so it doesn't just go to the top of the screen
+            nametag.set_level(overlaps%Settings.nametag_overlap_limit)
+        i = j
@@ -0,0 +1,162 @@
+import csv
+import json
+import time
+import pygame
+import traceback
+
+class _FrameProfiler:
+    """
+    The frame profiler records how long each stage of every frame took in a fixed-size ring buffer. Stages are timed by
+    calling mark() at the end of each one; a stage that runs several times in a frame (e.g. once per simulation step)
+    adds up. When disabled every call returns straight away.
+    """
+    stages = ("events", "interface", "actors", "director", "animation", "layout", "draw_list", "blit", "flip")
+    # How often the overlay text is refreshed, in seconds
+    overlay_interval = 0.5
+
+    def __init__(self):
+        self._enabled = False
+        self._stage_indices = {stage: i for i, stage in enumerate(self.stages)}
+        self.set_buffer_size(1)
+        self._last_mark = 0
+        self._overlay_img = None
+        self._overlay_time = 0
+        self._overlay_font = None
+
+    def set_enabled(self, enabled):
+        self._enabled = enabled
+
+    def is_enabled(self):
+        return self._enabled
+
+    def set_buffer_size(self, size):
+        # Preallocate the ring buffer so recording a frame doesn't allocate anything
+        self._size = max(1, size)
+        self._starts = [0.0]*self._size
+        self._totals = [0.0]*self._size
+        self._stage_times = [[0.0]*len(self.stages) for i in range(self._size)]
+        self._index = 0
+        self._count = 0
+        self._frame_start = 0
+
+    def begin_frame(self):
+        if not self._enabled:
+            return
+        now = time.perf_counter()
+        self._frame_start = now
+        self._last_mark = now
+        row = self._stage_times[self._index]
+        for i in range(len(row)):
+            row[i] = 0.0
+
+    def mark(self, stage):
+        """
+        Ends the named stage, charging it with the time since the previous mark.
+        """
+        if not self._enabled:
+            return
+        now = time.perf_counter()
+        self._stage_times[self._index][self._stage_indices[stage]] += now-self._last_mark
+        self._last_mark = now
+
+    def end_frame(self):
+        if not self._enabled:
+            return
+        self._starts[self._index] = self._frame_start
+        self._totals[self._index] = time.perf_counter()-self._frame_start
+        self._index = (self._index+1)%self._size
+        self._count = min(self._count+1, self._size)
+
+    def get_frames(self):
+        """
+        Returns the recorded frames, oldest first, as (start time, total seconds, list of seconds per stage) tuples.
+        """
+        first = (self._index-self._count)%self._size
+        frames = []
+        for i in range(self._count):
+            index = (first+i)%self._size
+            frames.append((self._starts[index], self._totals[index], list(self._stage_times[index])))
+        return frames
+
+    def get_stats(self, last=None):
+        """
+        Returns FPS and p50/p99 frame time (in milliseconds) over the last frames recorded (all of them by default).
+        """
+        frames = self.get_frames()
+        if last:
+            frames = frames[-last:]
+        if len(frames) < 2:
+            return {"fps": 0, "p50": 0, "p99": 0}
+        totals = sorted(frame[1] for frame in frames)
+        elapsed = frames[-1][0]-frames[0][0]
+        return {
+            "fps": (len(frames)-1)/elapsed if elapsed > 0 else 0,
+            "p50": totals[int(0.5*(len(totals)-1))]*1000,
+            "p99": totals[int(0.99*(len(totals)-1))]*1000
+        }
+
+    def get_overlay_img(self, info):
+        """
+        Returns an image with FPS, frame times and the given extra info (a list of (label, value) pairs). The image is
+        only redrawn every overlay_interval seconds.
+        """
+        now = time.perf_counter()
+        if self._overlay_img and now < self._overlay_time+self.overlay_interval:
+            return self._overlay_img
+        self._overlay_time = now
+        if not self._overlay_font:
+            self._overlay_font = pygame.font.SysFont("monospace", 14)
+        stats = self.get_stats(120)
+        lines = ["FPS {:.1f}".format(stats["fps"]), "Frame p50 {:.2f}ms p99 {:.2f}ms".format(stats["p50"], stats["p99"])]
+        lines += ["{} {}".format(label, value) for label, value in info]
+        line_imgs = [self._overlay_font.render(line, True, (255,255,255)) for line in lines]
+        width = max(img.get_rect().width for img in line_imgs)
+        line_height = self._overlay_font.get_linesize()
+        self._overlay_img = pygame.Surface((width+8, line_height*len(line_imgs)+8))
+        for i, img in enumerate(line_imgs):
+            self._overlay_img.blit(img, (4, 4+i*line_height))
+        return self._overlay_img
+
+    def dump(self, path):
+        """
+        Writes the recorded frames to path, as JSON if it ends in .json and CSV otherwise. Times are in milliseconds.
+        """
+        try:
+            frames = self.get_frames()
+            if path.lower().endswith(".json"):
+                with open(path, "w") as dump_file:
+                    json.dump({
+                        "stages": list(self.stages),
+                        "frames": [{
+                            "start": start,
+                            "total_ms": total*1000,
+                            "stages_ms": {stage: stage_times[i]*1000 for i, stage in enumerate(self.stages)}
+                        } for start, total, stage_times in frames]
+                    }, dump_file, indent=4)
+            else:
+                with open(path, "w", newline="") as dump_file:
+                    writer = csv.writer(dump_file)
+                    writer.writerow(["frame", "start", "total_ms"] + [stage+"_ms" for stage in self.stages])
+                    for i, (start, total, stage_times) in enumerate(frames):
+                        writer.writerow([i, "{:.6f}".format(start), "{:.4f}".format(total*1000)] + ["{:.4f}".format(t*1000) for t in stage_times])
+            print("Wrote {} profiled frames to {}".format(len(frames), path))
+            return "SUCCESS"
+        except:
+            print("WARNING: Failed to write profile to {}".format(path))
+            print(traceback.format_exc())
+            return "FAILURE"
+
+FrameProfiler = _FrameProfiler()
+
+if __name__ == "__main__":
+    # Profile some fake frames and print the stats
+    FrameProfiler.set_buffer_size(100)
+    FrameProfiler.set_enabled(True)
+    for i in range(150):
+        FrameProfiler.begin_frame()
+        for stage in FrameProfiler.stages:
+            time.sleep(0.0001)
+            FrameProfiler.mark(stage)
+        FrameProfiler.end_frame()
+    print(FrameProfiler.get_stats())
+    print(FrameProfiler.get_frames()[-1])
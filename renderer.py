@@ -0,0 +1,90 @@
+import pygame
+from settings import Settings
+from profiler import FrameProfiler
+
+class Renderer:
+    """
+    Draws a list of (key, surface, position) items in order over the background, redrawing the whole screen every frame.
+    """
+    def invalidate(self):
+        return "SUCCESS"
+
+    def render(self, screen, items):
+        screen.fill(Settings.background_color)
+        for key, surface, position in items:
+            screen.blit(surface, position)
+        FrameProfiler.mark("blit")
+        pygame.display.flip()
+        FrameProfiler.mark("flip")
+
+def merge_rects(rects):
+    # Union overlapping rects so no area gets repainted (and pushed to the display) twice
+    merged = []
+    for rect in rects:
+        rect = rect.copy()
+        i = 0
+        while i < len(merged):
+            if rect.colliderect(merged[i]):
+                rect.union_ip(merged.pop(i))
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+    return merged
+
+class DirtyRectRenderer(Renderer):
+    """
+    Only repaints the parts of the screen that changed since the last frame. An item is dirty if it's new, gone, or its
+    surface or position changed; both its old and new areas are repainted, along with every other item overlapping them.
+    """
+    def __init__(self):
+        self._previous = {}
+        self._full_redraw = True
+
+    def invalidate(self):
+        # Force the next frame to redraw everything (e.g. when the window was uncovered)
+        self._full_redraw = True
+        return "SUCCESS"
+
+    def render(self, screen, items):
+        # Work out where everything goes this frame
+        current = {}
+        rects = []
+        for key, surface, position in items:
+            rect = surface.get_rect(topleft=position)
+            current[key] = (surface, rect)
+            rects.append(rect)
+        previous = self._previous
+        self._previous = current
+        if self._full_redraw:
+            self._full_redraw = False
+            super().render(screen, items)
+            return
+        # Find what changed
+        dirty = []
+        for key in current:
+            surface, rect = current[key]
+            if key not in previous:
+                dirty.append(rect)
+            elif previous[key][0] is not surface or previous[key][1] != rect:
+                dirty.append(previous[key][1])
+                dirty.append(rect)
+        for key in previous:
+            if key not in current:
+                dirty.append(previous[key][1])
+        screen_rect = screen.get_rect()
+        dirty = [rect.clip(screen_rect) for rect in merge_rects(dirty)]
+        dirty = [rect for rect in dirty if rect.width > 0 and rect.height > 0]
+        if len(dirty) < 1:
+            FrameProfiler.mark("blit")
+            return
+        # Repaint the dirty areas, clipped so items partly outside them aren't blended twice
+        for area in dirty:
+            screen.set_clip(area)
+            screen.fill(Settings.background_color, area)
+            for index in area.collidelistall(rects):
+                screen.blit(items[index][1], items[index][2])
+        screen.set_clip(None)
+        FrameProfiler.mark("blit")
+        pygame.display.update(dirty)
+        FrameProfiler.mark("flip")
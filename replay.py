@@ -0,0 +1,239 @@
+import json
+import threading
+import traceback
+from runtime import Runtime
+from settings import Settings
+from store import ChatterStore
+from twitch_interface import TwitchInterface
+
+REPLAY_VERSION = 1
+
+# Settings that aren't written to recordings
+PRIVATE_SETTINGS = ("TWITCH_APP_ID", "TWITCH_APP_SECRET")
+
+class _Recorder:
+    """
+    The recorder appends every chat message, command and inactivity sweep the twitch thread handles to a log, one JSON
+    array per line: [time, "message", user, text], [time, "command", user, name, parameter] or [time, "expire"], plus
+    any values observed from the main thread while handling it. Each time recording starts, a header line with the seed,
+    settings and chatter state is written first, so a log can hold several runs (e.g. before and after a restart).
+
+    Chat handlers are run through the recorder even when it isn't recording so they always see a frozen clock. Every
+    event runs on the chat's callback loop, so they're logged in the order they happened; handlers must not wait on
+    anything, or another event could start in the middle of theirs.
+    """
+    def __init__(self):
+        self._file = None
+        self._lock = threading.Lock()
+
+    def start(self, path, seed=None):
+        """
+        Starts appending to the log at path. The chat RNG is reseeded with seed (or a new random seed) so the recording
+        doesn't depend on anything drawn before it started.
+        """
+        if self._file:
+            return "FAILURE"
+        if seed is None:
+            seed = Runtime.get_seed()
+        if seed is None:
+            seed = random_seed()
+        Runtime.seed(seed)
+        settings = dict(Settings.get_dict())
+        for key in PRIVATE_SETTINGS:
+            settings.pop(key, None)
+        try:
+            self._file = open(path, "a", buffering=1, encoding="utf-8")
+            self.write({
+                "version": REPLAY_VERSION,
+                "seed": seed,
+                "start": Runtime.time(),
+                "settings": settings,
+                "health": ChatterStore.get_all_health(),
+                "chatters": {name: dict(metadata) for name, metadata in dict(TwitchInterface.get_chatter_metadata()).items()},
+                "last_command_time": TwitchInterface.get_last_command_time()
+            })
+            print("Recording chat to {} with seed {}".format(path, seed))
+            return "SUCCESS"
+        except:
+            print("WARNING: Failed to start recording to {}".format(path))
+            print(traceback.format_exc())
+            self._file = None
+            return "FAILURE"
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        try:
+            with self._lock:
+                if self._file:
+                    self._file.write(line)
+        except:
+            print("WARNING: Failed to write to recording")
+            print(traceback.format_exc())
+
+    def stop(self):
+        with self._lock:
+            if not self._file:
+                return "FAILURE"
+            self._file.close()
+            self._file = None
+        return "SUCCESS"
+
+    def is_recording(self):
+        return self._file is not None
+
+    async def run_event(self, handler, event, fields, observations=None):
+        # Handle an event with the clock frozen, then log it with anything it observed
+        Runtime.begin_event(observations)
+        try:
+            return await handler(event)
+        finally:
+            event_time, observed = Runtime.end_event()
+            if self._file:
+                self.write([event_time] + fields + ([observed] if observed else []))
+
+    def run_expiry(self, expire):
+        # Only sweeps that removed someone are logged; the others didn't change anything
+        Runtime.begin_event()
+        try:
+            expired = expire()
+        finally:
+            event_time, observed = Runtime.end_event()
+        if expired and self._file:
+            self.write([event_time, "expire"])
+        return expired
+
+    def wrap_message_handler(self, handler):
+        async def recorded_handler(msg):
+            return await self.run_event(handler, msg, ["message", str(msg.user.name), msg.text])
+        return recorded_handler
+
+    def wrap_command_handler(self, handler):
+        async def recorded_handler(cmd):
+            return await self.run_event(handler, cmd, ["command", str(cmd.user.name), cmd.name, cmd.parameter])
+        return recorded_handler
+
+Recorder = _Recorder()
+
+def random_seed():
+    import random
+    return random.SystemRandom().randrange(2**32)
+
+def read_recording(path):
+    """
+    Returns a list of (header, events) for each run in the log at path. A half written last line is ignored.
+    """
+    runs = []
+    with open(path, "r", encoding="utf-8") as log_file:
+        for line in log_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print("WARNING: Ignoring unreadable line in {}".format(path))
+                continue
+            if isinstance(record, dict):
+                if record.get("version") != REPLAY_VERSION:
+                    raise ValueError("{} was recorded by another version".format(path))
+                runs.append((record, []))
+            elif runs:
+                runs[-1][1].append(record)
+    return runs
+
+async def replay(runs, settings_override=None, transcript=None):
+    """
+    Feeds recorded runs through the handlers in twitch.py as fast as possible with the recorded clock and seed. Returns
+    a hashlib object over every chat reply and the final chatter health, which is the same on every replay of a log.
+    """
+    import time
+    import hashlib
+    import twitch
+    from fakes import FakeMessage, FakeCommand
+    from chat_outbox import ChatOutbox
+
+    clock = [0]
+    Runtime.set_clock(lambda: clock[0])
+    digest = hashlib.sha256()
+    results = {"events": 0, "replies": 0, "handler_times": []}
+    for header, events in runs:
+        # Start from the state the run started with
+        settings = dict(header["settings"])
+        settings.update(settings_override or {})
+        for key in PRIVATE_SETTINGS:
+            settings[key] = "replay"
+        Settings.init_from_dict(settings)
+        TwitchInterface.set_target_channel(Settings.target_channel)
+        TwitchInterface.set_ignore_list(Settings.ignore_list)
+        TwitchInterface.set_chatter_default_health(Settings.default_health)
+        TwitchInterface.set_chatter_inactivity_timeout(Settings.chatter_inactivity_timeout)
+        for name in list(TwitchInterface.get_chatter_metadata()):
+            TwitchInterface.delete_chatter(name)
+        clock[0] = header["start"]
+        Runtime.seed(header["seed"])
+        ChatterStore.restore_health(header["health"])
+        for name, metadata in header["chatters"].items():
+            TwitchInterface.restore_chatter(name, metadata)
+        TwitchInterface.set_last_command_time(header["last_command_time"])
+        handlers = twitch.get_command_handlers()
+
+        for event in events:
+            clock[0] = event[0]
+            start = time.perf_counter()
+            if event[1] == "message":
+                await Recorder.run_event(twitch.on_message, FakeMessage(event[2], event[3]), [], event[4] if len(event) > 4 else None)
+            elif event[1] == "command":
+                handler = handlers.get(event[3].lower())
+                if handler:
+                    await Recorder.run_event(handler, FakeCommand(event[2], event[3], event[4]), [], event[5] if len(event) > 5 else None)
+            elif event[1] == "expire":
+                Recorder.run_expiry(twitch.expire_chatters)
+            results["handler_times"].append(time.perf_counter()-start)
+            results["events"] += 1
+            for reply in ChatOutbox.drain():
+                digest.update(reply.encode("utf-8") + b"\n")
+                results["replies"] += 1
+                if transcript:
+                    transcript.write("{}\t{}\n".format(event[0], reply))
+    for name in sorted(TwitchInterface.get_chatter_metadata()):
+        digest.update("{}={}\n".format(name, TwitchInterface.get_chatter_metadata()[name]["health"]).encode("utf-8"))
+    results["digest"] = digest.hexdigest()
+    return results
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+    import asyncio
+    import argparse
+    import pygame
+    from fakes import percentile
+
+    parser = argparse.ArgumentParser(description="Replay a chat recording (RECORD_FILE) through the chat handlers without a Twitch connection and print a digest of the outcome.")
+    parser.add_argument("recording", help="Recording to replay")
+    parser.add_argument("--settings", help="JSON settings to replay with instead of the recorded ones (only the given settings are replaced)")
+    parser.add_argument("--transcript", help="Write every chat reply to this file, e.g. to diff two versions")
+    args = parser.parse_args()
+
+    runs = read_recording(args.recording)
+    if not runs:
+        sys.exit("{} has no recorded runs".format(args.recording))
+    settings_override = None
+    if args.settings:
+        with open(args.settings, "r") as settings_file:
+            settings_override = json.load(settings_file)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    # Settings need fonts
+    pygame.init()
+    pygame.font.init()
+    transcript = open(args.transcript, "w", encoding="utf-8") if args.transcript else None
+    start = time.perf_counter()
+    results = asyncio.run(replay(runs, settings_override, transcript))
+    elapsed = time.perf_counter()-start
+    if transcript:
+        transcript.close()
+    recorded = sum(events[-1][0]-header["start"] for header, events in runs if events)
+    handler_times = [t*1000 for t in results["handler_times"]]
+    print("Runs:            {}".format(len(runs)))
+    print("Events:          {} ({:.0f}s recorded, replayed in {:.2f}s)".format(results["events"], recorded, elapsed))
+    print("Handler (ms):    p50 {:.3f}  p99 {:.3f}  max {:.3f}".format(
+        percentile(handler_times, 50), percentile(handler_times, 99), max(handler_times) if handler_times else 0))
+    print("Replies:         {}".format(results["replies"]))
+    print("Digest:          {}".format(results["digest"]))
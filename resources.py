@@ -1,19 +1,204 @@
+import os
+import sys
+import json
+import mmap
+import struct
 import pygame
 import traceback
-import sys
+
+# Asset bundle layout: magic, version and index length, then the JSON index, then raw RGBA pixel data
+BUNDLE_MAGIC = b"FPAB"
+BUNDLE_VERSION = 2
+BUNDLE_HEADER = struct.Struct("<4sII")
+
+# Stands in for transparent pixels in RLE accelerated sprites
+COLORKEY = (255, 0, 255)
+
+def bundle_key(path):
+    # Paths are stored with forward slashes so a bundle built on one platform works on another
+    return os.path.normpath(path).replace(os.sep, "/")
+
+def get_source_stamps(paths):
+    """
+    Returns the modification time of each path by bundle key, or None for missing ones. A bundle stores these for the
+    skin folders and extra images it was built from, so it can tell when they've changed with one stat each.
+    """
+    stamps = {}
+    for path in paths:
+        try:
+            stamps[bundle_key(path)] = os.stat(path).st_mtime_ns
+        except OSError:
+            stamps[bundle_key(path)] = None
+    return stamps
 
 class _ResourceManager:
     def __init__(self):
         self._memo = {}
+        self._frames_memo = {}
+        self._bundle_file = None
+        self._bundle_data = None
+        self._bundle_index = None
+        self._converted = False
+        self._rle = True
+
+    def load_bundle(self, bundle_path):
+        """
+        Memory-maps an asset bundle made by build_bundle.py. Images and skins in the bundle are then created straight from
+        its pixel data, with no PNG decoding or directory listing. If a skin folder or image it was built from has changed
+        since (going by modification times, so only the folders are checked for skins), the bundle isn't used and
+        everything is loaded from disk instead.
+        """
+        try:
+            bundle_file = open(bundle_path, "rb")
+            # Copy-on-write so surfaces can wrap the mapping directly; nothing is ever written back
+            bundle_data = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_COPY)
+            magic, version, index_length = BUNDLE_HEADER.unpack_from(bundle_data, 0)
+            if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+                print("WARNING: {} is not a compatible asset bundle; rebuild it with build_bundle.py".format(bundle_path))
+                bundle_data.close()
+                bundle_file.close()
+                return "FAILURE"
+            index_start = BUNDLE_HEADER.size
+            index = json.loads(bytes(bundle_data[index_start:index_start+index_length]).decode("utf-8"))
+            if get_source_stamps(index["sources"]) != index["sources"]:
+                print("WARNING: {} is out of date with the skins folder; loading skins from disk. Rebuild it with build_bundle.py".format(bundle_path))
+                bundle_data.close()
+                bundle_file.close()
+                return "FAILURE"
+            self._bundle_index = index
+            self._bundle_index["data_start"] = index_start+index_length
+            self._bundle_file = bundle_file
+            self._bundle_data = bundle_data
+            return "SUCCESS"
+        except:
+            print("WARNING: Failed to load asset bundle {}".format(bundle_path))
+            print(traceback.format_exc())
+            return "FAILURE"
+
+    def get_bundle_skin(self, skin_path):
+        """
+        Returns the spritesheets of a bundled skin as (image path, animation name, seconds per frame, looping) tuples,
+        or None if the skin isn't bundled.
+        """
+        if not self._bundle_index or not bundle_key(skin_path) in self._bundle_index["skins"]:
+            return None
+        return [tuple(sheet) for sheet in self._bundle_index["skins"][bundle_key(skin_path)]]
+
+    def get_bundle_skin_names(self):
+        if not self._bundle_index:
+            return None
+        return self._bundle_index["skin_names"]
+
+    def _load_bundle_img(self, img_path):
+        image = self._bundle_index["images"][bundle_key(img_path)]
+        start = self._bundle_index["data_start"]+image["offset"]
+        pixels = memoryview(self._bundle_data)[start:start+image["width"]*image["height"]*4]
+        return pygame.image.frombuffer(pixels, (image["width"], image["height"]), "RGBA")
+
+    def set_rle_acceleration(self, rle):
+        self._rle = rle
+
+    def convert_surface(self, surface, sprite=False):
+        """
+        Converts a surface to the display's pixel format so blitting it doesn't need a conversion every time. Sprites that
+        are mostly transparent also get RLE acceleration if enabled, as long as every pixel is either fully opaque or fully
+        transparent; they're turned into colorkey surfaces for it. Sprites with soft edges (e.g. antialiased nametags) keep
+        their per-pixel alpha without RLE. Surfaces are returned unchanged if there's no display yet.
+        """
+        if not pygame.display.get_surface():
+            return surface
+        surface = surface.convert_alpha()
+        if sprite and self._rle:
+            visible = pygame.mask.from_surface(surface, 0)
+            # Only worth it when most pixels can be skipped
+            if visible.count() < surface.get_width()*surface.get_height()/2:
+                return self.make_colorkey_surface(surface, visible)
+        return surface
+
+    def make_colorkey_surface(self, surface, visible):
+        # Returns an RLE accelerated colorkey copy of surface, or surface if it has partly transparent pixels or uses
+        # the colorkey color
+        if pygame.mask.from_surface(surface, 254).count() != visible.count():
+            return surface
+        keyed = pygame.mask.from_threshold(surface, COLORKEY+(255,), (1, 1, 1, 255))
+        if keyed.overlap_area(visible, (0, 0)):
+            return surface
+        colorkey_surface = pygame.Surface(surface.get_size()).convert()
+        colorkey_surface.fill(COLORKEY)
+        colorkey_surface.blit(surface, (0, 0))
+        colorkey_surface.set_colorkey(COLORKEY, pygame.RLEACCEL)
+        return colorkey_surface
+
+    def convert_for_display(self):
+        """
+        Upgrades every image and frame loaded before the display existed. Frame lists are converted in place so animations
+        that already share them pick up the converted frames.
+        """
+        if self._converted or not pygame.display.get_surface():
+            return
+        self._converted = True
+        for img_path in self._memo:
+            self._memo[img_path] = self.convert_surface(self._memo[img_path])
+        for frames, flipped_frames in self._frames_memo.values():
+            for i in range(len(frames)):
+                frames[i] = self.convert_surface(frames[i], True)
+                flipped_frames[i] = self.convert_surface(flipped_frames[i], True)
 
     def load_img(self, img_path):
+        # Upgrade anything loaded before the display was created
+        if not self._converted:
+            self.convert_for_display()
         try:
             if not img_path in self._memo:
-                self._memo[img_path] = pygame.image.load(img_path)
+                if self._bundle_index and bundle_key(img_path) in self._bundle_index["images"]:
+                    img = self._load_bundle_img(img_path)
+                else:
+                    img = pygame.image.load(img_path)
+                self._memo[img_path] = self.convert_surface(img)
             return self._memo[img_path]
         except:
             # We could return none and try to handle it, but meh, just exit
             print("Failed to load image {}".format(img_path))
             sys.exit(traceback.format_exc())
 
-ResourceManager = _ResourceManager()
\ No newline at end of file
+    def load_frames(self, img_path):
+        """
+        Splits a spritesheet of square frames into individual frame surfaces, plus horizontally flipped copies.
+        Frames are built once per sheet and shared by every animation using it.
+        """
+        if not self._converted:
+            self.convert_for_display()
+        try:
+            if not img_path in self._frames_memo:
+                img = self.load_img(img_path)
+                size = img.get_rect().height
+                frame_count = int(img.get_rect().width/size)
+                frames = [img.subsurface((size*i, 0, size, size)).copy() for i in range(frame_count)]
+                flipped_frames = [self.convert_surface(pygame.transform.flip(frame, True, False), True) for frame in frames]
+                frames = [self.convert_surface(frame, True) for frame in frames]
+                self._frames_memo[img_path] = (frames, flipped_frames)
+            return self._frames_memo[img_path]
+        except:
+            print("Failed to load frames from {}".format(img_path))
+            sys.exit(traceback.format_exc())
+
+    def get_cached_surfaces(self):
+        # Copy the caches first since this may be called from another thread while images are loading
+        surfaces = list(self._memo.values())
+        for frames, flipped_frames in list(self._frames_memo.values()):
+            surfaces += frames + flipped_frames
+        return surfaces
+
+    def get_cache_size(self):
+        """
+        Returns the number of cached images and frames.
+        """
+        return len(self.get_cached_surfaces())
+
+    def get_cache_bytes(self):
+        """
+        Returns roughly how much memory the cached images and frames take up.
+        """
+        return sum(surface.get_width()*surface.get_height()*surface.get_bytesize() for surface in self.get_cached_surfaces())
+
+ResourceManager = _ResourceManager()
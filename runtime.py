@@ -0,0 +1,82 @@
+import time
+import random
+import threading
+
+class _Runtime:
+    """
+    The runtime is where the chat handlers get the time and random numbers from, so a recorded stream can be replayed
+    with the same outcomes. Normally it's the system clock and an unseeded RNG; a replay swaps in the recorded clock and
+    seed, and feeds back anything the handlers observed from the game thread (see observe).
+
+    The chat side and the main (render) thread draw from separate RNGs so the game loop never shifts the chat's numbers.
+    The event being handled is kept per thread, so other threads always see the real clock.
+    """
+    def __init__(self):
+        self._clock = time.time
+        self._seed = None
+        self._random = random.Random()
+        self._game_random = random.Random()
+        # Per thread: event_time, observations and replay_observations of the event being handled
+        self._local = threading.local()
+
+    def seed(self, seed):
+        self._seed = seed
+        self._random.seed(seed)
+        self._game_random.seed(None if seed is None else "game-{}".format(seed))
+
+    def get_seed(self):
+        return self._seed
+
+    def set_clock(self, clock):
+        # clock() must return seconds since the epoch, like time.time
+        self._clock = clock
+
+    def time(self):
+        # The time is frozen while handling an event so every check in a handler sees the same time
+        event_time = getattr(self._local, "event_time", None)
+        if event_time is not None:
+            return event_time
+        return self._clock()
+
+    def get_random(self):
+        """
+        Returns the RNG for chat outcomes (damage, counters, spawn points). Only use it from the twitch thread.
+        """
+        return self._random
+
+    def get_game_random(self):
+        """
+        Returns the RNG for the main thread (wandering, skins, animation variants).
+        """
+        return self._game_random
+
+    def begin_event(self, observations=None):
+        """
+        Starts handling an event at the current time. observations are values recorded with the event being replayed.
+        """
+        self._local.event_time = self._clock()
+        self._local.observations = []
+        self._local.replay_observations = list(observations) if observations is not None else None
+
+    def end_event(self):
+        """
+        Returns the event's time and the values observed while handling it.
+        """
+        event_time, observations = self._local.event_time, self._local.observations
+        self._local.event_time = None
+        self._local.observations = []
+        self._local.replay_observations = None
+        return event_time, observations
+
+    def observe(self, value):
+        """
+        Handlers pass state owned by another thread (e.g. if an actor is defended) through here. It's recorded with the
+        event, and during a replay the recorded value is returned instead.
+        """
+        if getattr(self._local, "replay_observations", None):
+            value = self._local.replay_observations.pop(0)
+        if getattr(self._local, "event_time", None) is not None:
+            self._local.observations.append(value)
+        return value
+
+Runtime = _Runtime()
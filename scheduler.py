@@ -0,0 +1,265 @@
+import heapq
+import itertools
+from collections import deque
+from runtime import Runtime
+
+def merge_metadata(metadata, other):
+    # Coalesced commands keep a count and add up any numbers (e.g. damage) in their metadata
+    merged = dict(metadata) if metadata else {}
+    merged["count"] = merged.get("count", 1) + (other.get("count", 1) if other else 1)
+    for key, value in (other or {}).items():
+        if key == "count" or isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        merged[key] = merged.get(key, 0) + value
+    return merged
+
+class CommandScheduler:
+    """
+    Holds queued director commands and hands out the next one that can run. A command that needs a busy actor is parked
+    on that actor and only looked at again once the director releases it, so picking the next runnable command costs the
+    same no matter how many commands are blocked. Released commands go back to the place in line they were queued at.
+
+    The queue is kept from falling too far behind chat in three ways:
+    - A pair command (e.g. A attacks B) that's still waiting absorbs any repeats of itself, summing their metadata
+    - Droppable commands that waited longer than max_age are dropped when they come up
+    - Past max_length commands, one is dropped: a new droppable command, or else the oldest ready droppable command, or
+      else the oldest ready command of any kind, or else the new command. Faints and skin updates are never dropped
+    Dropped commands are passed to on_drop(command, reason) so their effects can still be applied without the animation.
+    """
+    # Commands that are never dropped, even past max_length
+    protected_actions = ("faint", "update_skin")
+
+    def __init__(self, max_length=None, max_age=None, droppable_actions=(), coalesce=False, on_drop=None):
+        # Heap of (sequence, entry) so released commands keep their place in line
+        self._ready = []
+        self._sequence = itertools.count()
+        self._waiting = {}
+        self._length = 0
+        self._max_length = max_length
+        self._max_age = max_age
+        self._droppable_actions = set(droppable_actions)
+        self._coalesce = coalesce
+        self._on_drop = on_drop
+        # Waiting pair commands by (action, actor1, actor2), for coalescing
+        self._pending_pairs = {}
+        self._dropped = {}
+        self._coalesced = 0
+
+    def push(self, command):
+        # Fold repeats into a matching command that hasn't started yet
+        key = self.get_pair_key(command)
+        if key in self._pending_pairs:
+            pending = self._pending_pairs[key][1]
+            pending["metadata"] = merge_metadata(pending["metadata"], command["metadata"])
+            self._coalesced += 1
+            return "COALESCED"
+        if self._max_length is not None and self._length >= self._max_length:
+            if command["action"] in self._droppable_actions or (not self.make_room() and
+                                                                 command["action"] not in self.protected_actions):
+                self.drop(command, "overflow")
+                return "DROPPED"
+        entry = self.make_entry(command)
+        self.track_entry(entry)
+        if key is not None:
+            self._pending_pairs[key] = entry
+        self.add_ready(entry)
+        self._length += 1
+        return "QUEUED"
+
+    def pop_runnable(self, get_busy_actor):
+        """
+        Returns the oldest ready command whose actors are free, or None. get_busy_actor(command) must return the name of
+        an actor the command needs that is currently busy, or None if the command can run.
+        """
+        while True:
+            entry = self.take_ready()
+            if entry is None:
+                return None
+            queued_time, command = entry[0], entry[1]
+            if (self._max_age is not None and command["action"] in self._droppable_actions and
+                Runtime.time()-queued_time > self._max_age):
+                self.forget(entry)
+                self.drop(command, "stale")
+                continue
+            busy_actor = get_busy_actor(command)
+            if busy_actor is not None:
+                # Park the command until this actor is released
+                if not busy_actor in self._waiting:
+                    self._waiting[busy_actor] = deque()
+                self._waiting[busy_actor].append(entry)
+                continue
+            self.forget(entry)
+            return command
+
+    def release(self, actor):
+        """
+        Wakes every command parked on actor. Call whenever an actor stops being busy.
+        """
+        if actor in self._waiting:
+            for entry in self._waiting.pop(actor):
+                self.add_ready(entry)
+
+    # Subclasses can change the order commands are handed out in by overriding the following.
+    # Entries are tuples starting with (queued time, command, sequence), where sequence counts up as commands are queued.
+
+    def make_entry(self, command):
+        return (Runtime.time(), command, next(self._sequence))
+
+    def track_entry(self, entry):
+        # Called once for each new entry, before it's first added
+        pass
+
+    def add_ready(self, entry):
+        heapq.heappush(self._ready, (entry[2], entry))
+
+    def take_ready(self):
+        # Remove and return the entry that should run next, or None
+        if self._ready:
+            return heapq.heappop(self._ready)[1]
+        return None
+
+    def get_ready_entries(self):
+        return [item[1] for item in self._ready]
+
+    def get_overflow_rank(self, command):
+        # Droppable commands are dropped first when the queue is full, then anything else but protected commands (None)
+        if command["action"] in self._droppable_actions:
+            return 0
+        if command["action"] in self.protected_actions:
+            return None
+        return 1
+
+    def take_overflow(self):
+        # Remove and return the ready entry to drop when the queue is full (the oldest of the lowest rank), or None
+        candidates = [item for item in self._ready if self.get_overflow_rank(item[1][1]) is not None]
+        if not candidates:
+            return None
+        item = min(candidates, key=lambda item: (self.get_overflow_rank(item[1][1]), item[0]))
+        self._ready.remove(item)
+        heapq.heapify(self._ready)
+        return item[1]
+
+    def make_room(self):
+        entry = self.take_overflow()
+        if entry is None:
+            return False
+        self.forget(entry)
+        self.drop(entry[1], "overflow")
+        return True
+
+    def forget(self, entry):
+        # The entry left the queue
+        self._length -= 1
+        key = self.get_pair_key(entry[1])
+        if key in self._pending_pairs and self._pending_pairs[key] is entry:
+            del self._pending_pairs[key]
+
+    def drop(self, command, reason):
+        self._dropped[reason] = self._dropped.get(reason, 0) + 1
+        if self._on_drop:
+            self._on_drop(command, reason)
+
+    def get_pair_key(self, command):
+        if not self._coalesce or not "actor1" in command:
+            return None
+        return (command["action"], command["actor1"], command["actor2"])
+
+    def get_commands(self):
+        """
+        Returns every queued command, ready or parked, oldest first.
+        """
+        entries = self.get_ready_entries()
+        for parked in self._waiting.values():
+            entries.extend(parked)
+        entries.sort(key=lambda entry: entry[2])
+        return [entry[1] for entry in entries]
+
+    def get_dropped_counts(self):
+        """
+        Returns the number of dropped commands by reason ("stale" or "overflow").
+        """
+        return dict(self._dropped)
+
+    def get_coalesced_count(self):
+        return self._coalesced
+
+    def __len__(self):
+        return self._length
+
+def get_commander(command):
+    # The chatter who caused a command
+    return command["actor1"] if "actor1" in command else command["actor"]
+
+class FairScheduler(CommandScheduler):
+    """
+    Hands out commands by priority class, then by weighted fair queueing between commanders within a class:
+    - Faints and skin updates
+    - A chatter's first command since their last one was handed out
+    - Every other command
+    Each commander's commands are given virtual finish times spaced 1/weight apart, starting from the virtual time of the
+    last command handed out, so a chatter sending lots of commands can't starve the others. Commanders have a weight of 1
+    unless given one in weights. A commander is forgotten once the virtual time passes their last finish time, so only
+    chatters with queued commands are tracked.
+    """
+    priority_actions = ("faint", "update_skin")
+
+    def __init__(self, weights=None, **kwargs):
+        super().__init__(**kwargs)
+        self._weights = weights if weights else {}
+        self._heap = []
+        self._virtual_time = 0
+        # Last finish time by commander, and a heap of (finish, commander) to forget them by
+        self._last_finish = {}
+        self._finish_heap = []
+
+    def get_priority(self, command):
+        if command["action"] in self.priority_actions:
+            return 0
+        if get_commander(command) not in self._last_finish:
+            return 1
+        return 2
+
+    def make_entry(self, command):
+        commander = get_commander(command)
+        finish = max(self._virtual_time, self._last_finish.get(commander, 0)) + 1/self._weights.get(commander, 1)
+        return (Runtime.time(), command, next(self._sequence), self.get_priority(command), finish)
+
+    def track_entry(self, entry):
+        commander = get_commander(entry[1])
+        self._last_finish[commander] = entry[4]
+        heapq.heappush(self._finish_heap, (entry[4], commander))
+
+    def add_ready(self, entry):
+        heapq.heappush(self._heap, (entry[3], entry[4], entry[2], entry))
+
+    def take_ready(self):
+        if not self._heap:
+            return None
+        entry = heapq.heappop(self._heap)[3]
+        self._virtual_time = max(self._virtual_time, entry[4])
+        # Forget commanders with nothing queued past the virtual time; they'd start from it anyway
+        while self._finish_heap and self._finish_heap[0][0] <= self._virtual_time:
+            commander = heapq.heappop(self._finish_heap)[1]
+            if self._last_finish.get(commander, 0) <= self._virtual_time:
+                self._last_finish.pop(commander, None)
+        return entry
+
+    def get_ready_entries(self):
+        return [item[3] for item in self._heap]
+
+    def take_overflow(self):
+        # Drop the command of the lowest rank that would be handed out last
+        candidates = [item for item in self._heap if self.get_overflow_rank(item[3][1]) is not None]
+        if not candidates:
+            return None
+        rank = min(self.get_overflow_rank(item[3][1]) for item in candidates)
+        item = max(item for item in candidates if self.get_overflow_rank(item[3][1]) == rank)
+        self._heap.remove(item)
+        heapq.heapify(self._heap)
+        return item[3]
+
+# Schedulers selectable with the DIRECTOR_SCHEDULER setting
+SCHEDULERS = {
+    "fifo": CommandScheduler,
+    "fair": FairScheduler
+}
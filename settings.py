@@ -14,6 +14,9 @@ class _Settings:
             "CHATTER_INACTIVITY_TIMEOUT": None,
             "COMMAND_TIMEOUT_SECONDS": 0,
             "COMMAND_TIMEOUT_PER_USER": 0,
+            "CHAT_MESSAGE_LIMIT": 20,
+            "CHAT_MESSAGE_PERIOD": 30,
+            "CHAT_BATCH_DELAY": 0.5,
             "SCREEN_WIDTH": 800,
             "SCREEN_HEIGHT": 600,
             "DEBUG": False,
@@ -27,6 +30,7 @@ class _Settings:
             "RUN_SPEED": 100,
             "MOVE_EPSILON": 2,
             "FRAMERATE": 60,
+            "SIMULATION_RATE": 60,
             "DEFAULT_HEALTH": 20000,
             "DAMAGE_RANGE": [99,9999],
             "HEALING_RANGE": [99,2999],
@@ -37,6 +41,36 @@ class _Settings:
             "NAMETAG_ANTIALIAS": True,
             "NAMETAG_OVERLAP_LIMIT": 5,
             "MINIMUM_FAINT_TIME": 5.0,
+            "DATABASE_FILE": None,
+            "DATABASE_FLUSH_INTERVAL": 1.0,
+            "SNAPSHOT_FILE": None,
+            "SNAPSHOT_INTERVAL": 10,
+            "SNAPSHOT_MAX_AGE": 600,
+            "RECORD_FILE": None,
+            "RANDOM_SEED": None,
+            "DIRECTOR_SCHEDULER": "fifo",
+            "DIRECTOR_QUEUE_LIMIT": 100,
+            "STALE_COMMAND_AGE": 30.0,
+            "COALESCE_COMMANDS": True,
+            "ACTOR_REMOVAL_BATCH_SIZE": 100,
+            "ASSET_BUNDLE": None,
+            "RLE_SPRITES": True,
+            "DIRTY_RECT_RENDERING": False,
+            "NUMPY_ACTOR_STORE": False,
+            "QUALITY_GOVERNOR": True,
+            "GOVERNOR_MAX_NAMETAGS": 100,
+            "GOVERNOR_MAX_VISIBLE_ACTORS": 300,
+            "PROFILER": False,
+            "PROFILER_OVERLAY": False,
+            "PROFILER_BUFFER_SIZE": 3600,
+            "PROFILER_DUMP_FILE": None,
+            "COMMAND_TRACING": True,
+            "TRACE_FILE": None,
+            "TRACE_EXPORT_INTERVAL": 60,
+            "METRICS_PORT": None,
+            "METRICS_ADDRESS": "127.0.0.1",
+            "METRICS_FILE": None,
+            "METRICS_INTERVAL": 15,
             "INFO_CMD": "fight",
             "ATTACK_CMD": "attack",
             "ATTACK_PAST_TENSE": "attacked",
@@ -65,8 +99,15 @@ class _Settings:
     def init_from_file(self, filepath):
         # Parse json file
         with open(filepath, "r") as settings_file:
-            self._settings_json = json.load(settings_file)
-        
+            self.init_from_dict(json.load(settings_file))
+
+    def get_dict(self):
+        # The settings in effect, including defaults
+        return self._settings_json
+
+    def init_from_dict(self, settings_json):
+        self._settings_json = dict(settings_json)
+
         # Copy default settings for any missing settings
         for item in self._default_settings:
             if item not in self._settings_json:
@@ -94,6 +135,9 @@ class _Settings:
         self.rendering_timeout = max(30, self._settings_json["RENDERING_TIMEOUT_SECONDS"]) if self._settings_json["RENDERING_TIMEOUT_SECONDS"] else None
         self.command_timeout = max(0, self._settings_json["COMMAND_TIMEOUT_SECONDS"])
         self.command_timeout_per_user = max(0, self._settings_json["COMMAND_TIMEOUT_PER_USER"])
+        self.chat_message_limit = max(1, self._settings_json["CHAT_MESSAGE_LIMIT"])
+        self.chat_message_period = max(1, self._settings_json["CHAT_MESSAGE_PERIOD"])
+        self.chat_batch_delay = max(0, self._settings_json["CHAT_BATCH_DELAY"])
         self.screen_width = max(320, self._settings_json["SCREEN_WIDTH"])
         self.screen_height = max(240, self._settings_json["SCREEN_HEIGHT"])
         self.screen_size = (
@@ -111,6 +155,38 @@ class _Settings:
         self.debug = self._settings_json["DEBUG"]
         self.debug_characters = max(0, self._settings_json["DEBUG_CHARACTERS"])
         self.minimum_faint_time = max(1.0, self._settings_json["MINIMUM_FAINT_TIME"])
+        self.database_file = self._settings_json["DATABASE_FILE"]
+        self.database_flush_interval = max(0.1, self._settings_json["DATABASE_FLUSH_INTERVAL"])
+        self.snapshot_file = self._settings_json["SNAPSHOT_FILE"]
+        self.snapshot_interval = max(1, self._settings_json["SNAPSHOT_INTERVAL"])
+        self.snapshot_max_age = self._settings_json["SNAPSHOT_MAX_AGE"]
+        self.record_file = self._settings_json["RECORD_FILE"]
+        self.random_seed = self._settings_json["RANDOM_SEED"]
+        self.director_scheduler = str(self._settings_json["DIRECTOR_SCHEDULER"]).lower()
+        self.director_queue_limit = self._settings_json["DIRECTOR_QUEUE_LIMIT"]
+        self.director_queue_limit = max(1, self.director_queue_limit) if self.director_queue_limit else None
+        self.stale_command_age = self._settings_json["STALE_COMMAND_AGE"]
+        self.stale_command_age = max(0, self.stale_command_age) if self.stale_command_age else None
+        self.coalesce_commands = self._settings_json["COALESCE_COMMANDS"]
+        self.actor_removal_batch_size = max(1, self._settings_json["ACTOR_REMOVAL_BATCH_SIZE"])
+        self.asset_bundle = self._settings_json["ASSET_BUNDLE"]
+        self.rle_sprites = self._settings_json["RLE_SPRITES"]
+        self.dirty_rect_rendering = self._settings_json["DIRTY_RECT_RENDERING"]
+        self.numpy_actor_store = self._settings_json["NUMPY_ACTOR_STORE"]
+        self.quality_governor = self._settings_json["QUALITY_GOVERNOR"]
+        self.governor_max_nametags = max(0, self._settings_json["GOVERNOR_MAX_NAMETAGS"])
+        self.governor_max_visible_actors = max(0, self._settings_json["GOVERNOR_MAX_VISIBLE_ACTORS"])
+        self.profiler = self._settings_json["PROFILER"]
+        self.profiler_overlay = self._settings_json["PROFILER_OVERLAY"]
+        self.profiler_buffer_size = max(1, self._settings_json["PROFILER_BUFFER_SIZE"])
+        self.profiler_dump_file = self._settings_json["PROFILER_DUMP_FILE"]
+        self.command_tracing = self._settings_json["COMMAND_TRACING"]
+        self.trace_file = self._settings_json["TRACE_FILE"]
+        self.trace_export_interval = max(1, self._settings_json["TRACE_EXPORT_INTERVAL"])
+        self.metrics_port = self._settings_json["METRICS_PORT"]
+        self.metrics_address = self._settings_json["METRICS_ADDRESS"]
+        self.metrics_file = self._settings_json["METRICS_FILE"]
+        self.metrics_interval = max(1, self._settings_json["METRICS_INTERVAL"])
         self.ignore_list = self._settings_json["IGNORE_LIST"]
         self.move_chance = self._settings_json["MOVE_CHANCE"]
         self.sprite_spacing = self._settings_json["SPRITE_SPACING"]
@@ -118,6 +194,7 @@ class _Settings:
         self.run_speed = self._settings_json["RUN_SPEED"]
         self.move_epsilon = max(0, self._settings_json["MOVE_EPSILON"])
         self.framerate = max(12, self._settings_json["FRAMERATE"])
+        self.simulation_rate = max(12, self._settings_json["SIMULATION_RATE"])
         self.default_health = max(0, self._settings_json["DEFAULT_HEALTH"])
         self.damage_range_min = max(0, self._settings_json["DAMAGE_RANGE"][0])
         self.damage_range_max = max(1, self._settings_json["DAMAGE_RANGE"][1])
@@ -1,49 +1,108 @@
 import os
 import json
+import threading
 import traceback
+from actor import SkinRegistry
+from store import ChatterStore
 
 class _SkinOverrides:
-    def __init__(self, path):
-        self._overrides = {}
-        self._overrides_filepath = path
-        # Load overrides from file if it exists
+    """
+    Skin overrides chosen with the skin command are kept in the chatter store. The overrides file can still be edited by
+    hand; it's imported into the store at startup whenever it has changed. Without a database the store doesn't keep
+    anything between restarts, so the overrides are written back to the file from a background thread instead.
+    """
+    def __init__(self):
+        self._path = None
+        self._changed = False
+        self._writer_thread = None
+        self._writer_stop = threading.Event()
+
+    def import_file(self, path):
         try:
-            if os.path.exists(self._overrides_filepath):
-                with open(self._overrides_filepath, "r") as overrides_file:
-                    self._overrides = json.load(overrides_file)
+            if not os.path.exists(path):
+                return "SUCCESS"
+            modified_time = str(os.path.getmtime(path))
+            if ChatterStore.get_meta("skin_overrides_mtime") == modified_time:
+                return "SUCCESS"
+            with open(path, "r") as overrides_file:
+                overrides = json.load(overrides_file)
+            for name, skin_path in overrides.items():
+                ChatterStore.set_skin(name, skin_path)
+            ChatterStore.set_meta("skin_overrides_mtime", modified_time)
+            print("Imported {} skin overrides from {}".format(len(overrides), path))
+            return "SUCCESS"
         except:
             print("WARNING: Failed to load skin overrides from {}".format(path))
             print(traceback.format_exc())
-    
+            return "FAILURE"
+
     def get_available_skins(self):
-        random_skins_path = os.path.join("skins", "random")
-        return list(filter(lambda x: not os.path.isfile(x), os.listdir(random_skins_path)))
-    
+        return list(SkinRegistry.get_random_skins())
+
     def get_override_for_name(self, name):
-        if name in self._overrides:
-            return self._overrides[name]
-        return None
-    
+        return ChatterStore.get_skin(name)
+
     def set_override(self, name, skin):
-        # Check if skin exists
-        skin_path = os.path.join("skins", "random", "default")
+        # Check if skin exists (using the skin registry's lists so there's no disk access)
         if name == skin:
-            skin_path = os.path.join("skins", "special", skin)
-            if not os.path.exists(skin_path) or os.path.isfile(skin_path):
+            if not SkinRegistry.has_special_skin(skin):
                 return "FAILURE"
+            skin_path = os.path.join("skins", "special", skin)
         else:
-            skin_path = os.path.join("skins", "random", skin)
-            if not os.path.exists(skin_path) or os.path.isfile(skin_path):
+            if not skin in SkinRegistry.get_random_skins():
                 return "FAILURE"
-        # Set override
-        self._overrides[name] = skin_path
-        # Dump overrides to file
+            skin_path = os.path.join("skins", "random", skin)
+        # Set override (saved in the background)
+        ChatterStore.set_skin(name, skin_path)
+        self._changed = True
+        return "SUCCESS"
+
+    def write_file(self, path):
+        # Write to a temporary file first so a crash mid-write keeps the last overrides
         try:
-            with open(self._overrides_filepath, "w+") as overrides_file:
-                json.dump(self._overrides, overrides_file, indent=2)
+            temp_path = path + ".tmp"
+            with open(temp_path, "w") as overrides_file:
+                json.dump(ChatterStore.get_skins(), overrides_file, indent=2)
+            os.replace(temp_path, path)
+            # Don't import our own changes again at the next startup
+            ChatterStore.set_meta("skin_overrides_mtime", str(os.path.getmtime(path)))
+            return "SUCCESS"
         except:
-            print("WARNING: Failed to save skin overrides to {}".format(self._overrides_filepath))
+            print("WARNING: Failed to save skin overrides to {}".format(path))
             print(traceback.format_exc())
+            return "FAILURE"
+
+    def start_writer_thread(self, path, interval):
+        """
+        Writes the overrides to path every interval seconds if they changed. Use this when there's no database.
+        """
+        if self._writer_thread:
+            return "FAILURE"
+        self._path = path
+        self._writer_stop.clear()
+
+        def write_loop():
+            while True:
+                stopping = self._writer_stop.wait(interval)
+                if self._changed:
+                    self._changed = False
+                    self.write_file(path)
+                if stopping:
+                    return
+
+        self._writer_thread = threading.Thread(target=write_loop, daemon=True)
+        self._writer_thread.start()
+        return "SUCCESS"
+
+    def stop(self):
+        """
+        Writes any remaining changes and stops the writer thread.
+        """
+        if not self._writer_thread:
+            return "FAILURE"
+        self._writer_stop.set()
+        self._writer_thread.join()
+        self._writer_thread = None
         return "SUCCESS"
 
-SkinOverrides = _SkinOverrides("skin_overrides.json")
\ No newline at end of file
+SkinOverrides = _SkinOverrides()
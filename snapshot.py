@@ -0,0 +1,253 @@
+import os
+import time
+import zlib
+import json
+import threading
+import traceback
+from array import array
+from actor import SkinRegistry
+from resources import ResourceManager
+from settings import Settings
+from game_interface import GameInterface
+from twitch_interface import TwitchInterface
+
+SNAPSHOT_VERSION = 2
+
+# Non-puppeted actors come back in these animations; anything else (e.g. the middle of an attack) comes back idle
+RESTORED_ANIMATIONS = ("idle", "walk", "fainted", "faint")
+
+def skin_exists(path):
+    # Checks the skin registry's lists where possible, since loading a missing skin exits
+    folder, name = os.path.split(os.path.normpath(path))
+    if folder == os.path.join("skins", "random"):
+        return name in SkinRegistry.get_random_skins()
+    if folder == os.path.join("skins", "special"):
+        return SkinRegistry.has_special_skin(name)
+    return ResourceManager.get_bundle_skin(path) is not None or os.path.isdir(path)
+
+class _Snapshots:
+    """
+    Snapshots let the fight pit pick up where it left off after a restart. Every interval the main thread takes a quick
+    copy of the actors, chatters and director commands, then a background thread writes it as compressed JSON (plain
+    data, so loading a snapshot can't run code). Actors are stored column by column with skins and animations as indices
+    into shared tables, so thousands of chatters come to a few tens of kilobytes.
+    """
+    def __init__(self):
+        self._path = None
+        self._interval = 10
+        self._director = None
+        self._last_capture_time = time.time()
+        self._writer_thread = None
+        self._writer_stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = None
+
+    def set_director(self, director):
+        self._director = director
+
+    def capture(self):
+        """
+        Returns the current state as plain data. Only call this from the main thread.
+        """
+        skins = {}
+        animations = {}
+        actors = {
+            "names": [],
+            "x": array("d"),
+            "goal_x": array("d"),
+            "flipped": bytearray(),
+            "defended": bytearray(),
+            "skin": array("H"),
+            "animation": array("H")
+        }
+        for name, actor in GameInterface.get_actors().items():
+            skin_path = actor["animator"].get_path()
+            animation = actor["animator"].get_animation_name()
+            if actor["puppet"] or animation not in RESTORED_ANIMATIONS:
+                animation = "idle"
+            goal = actor["actor"].get_goal()
+            actors["names"].append(name)
+            actors["x"].append(actor["actor"].get_x())
+            actors["goal_x"].append(goal[0] if goal else -1)
+            actors["flipped"].append(actor["actor"].get_flipped())
+            actors["defended"].append(actor["defended"])
+            actors["skin"].append(skins.setdefault(skin_path, len(skins)))
+            actors["animation"].append(animations.setdefault(animation, len(animations)))
+        actors["skins"] = list(skins)
+        actors["animations"] = list(animations)
+        # Played and queued commands start over; traces belong to the old run
+        commands = []
+        if self._director:
+            for command in self._director.get_pending_commands():
+                command = dict(command)
+                command.pop("trace", None)
+                commands.append(command)
+        return {
+            "version": SNAPSHOT_VERSION,
+            "time": time.time(),
+            "actors": actors,
+            # Copied in one go since the twitch thread may be adding chatters
+            "chatters": {name: dict(metadata) for name, metadata in dict(TwitchInterface.get_chatter_metadata()).items()},
+            "commands": commands
+        }
+
+    def write(self, path, state):
+        # Write to a temporary file first so a crash mid-write keeps the last snapshot
+        try:
+            # Arrays are written as lists
+            data = zlib.compress(json.dumps(state, separators=(",", ":"), default=list).encode("utf-8"), 1)
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as snapshot_file:
+                snapshot_file.write(data)
+            os.replace(temp_path, path)
+            return "SUCCESS"
+        except:
+            print("WARNING: Failed to write snapshot to {}".format(path))
+            print(traceback.format_exc())
+            return "FAILURE"
+
+    def read(self, path, max_age=None):
+        """
+        Returns the snapshot at path, or None if there isn't a usable one.
+        """
+        try:
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as snapshot_file:
+                state = json.loads(zlib.decompress(snapshot_file.read()).decode("utf-8"))
+            if not isinstance(state, dict) or state.get("version") != SNAPSHOT_VERSION:
+                print("WARNING: Ignoring snapshot {} from another version".format(path))
+                return None
+            if max_age is not None and time.time()-state["time"] > max_age:
+                print("Ignoring snapshot {}; it's older than SNAPSHOT_MAX_AGE".format(path))
+                return None
+            return state
+        except:
+            print("WARNING: Failed to read snapshot {}".format(path))
+            print(traceback.format_exc())
+            return None
+
+    def restore(self, state):
+        """
+        Brings back the actors, chatters and commands in state. Only call this from the main thread before the twitch
+        thread starts, once the director exists.
+        """
+        actors = state["actors"]
+        skins = [skin if skin_exists(skin) else None for skin in actors["skins"]]
+        restored = 0
+        for i, name in enumerate(actors["names"]):
+            if name in TwitchInterface.get_ignore_list() or name not in state["chatters"]:
+                continue
+            try:
+                # The screen may have changed size since
+                x = min(max(actors["x"][i], Settings.sprite_spacing), Settings.screen_width-Settings.sprite_spacing)
+                actor = GameInterface.restore_actor(name, x, skins[actors["skin"][i]])
+                actor["defended"] = bool(actors["defended"][i])
+                actor["actor"].set_flipped(bool(actors["flipped"][i]))
+                animation = actors["animations"][actors["animation"][i]]
+                if animation != "idle" and actor["animator"].set_animation(animation) == "FAILURE":
+                    animation = "idle"
+                if animation == "walk" and actors["goal_x"][i] >= 0:
+                    goal_x = min(max(actors["goal_x"][i], Settings.sprite_spacing), Settings.screen_width-Settings.sprite_spacing)
+                    actor["actor"].set_goal((goal_x, Settings.sprite_elevation))
+                restored += 1
+            except:
+                print("WARNING: Failed to restore actor {}".format(name))
+                print(traceback.format_exc())
+        for name, metadata in state["chatters"].items():
+            if name in GameInterface.get_actors():
+                TwitchInterface.restore_chatter(name, metadata)
+        for command in state["commands"]:
+            GameInterface.enqueue_command(command)
+        print("Restored {} chatters and {} commands from snapshot".format(restored, len(state["commands"])))
+        return "SUCCESS"
+
+    def load(self, path, max_age=None):
+        state = self.read(path, max_age)
+        if state is None:
+            return "FAILURE"
+        return self.restore(state)
+
+    def start_writer_thread(self, path, interval):
+        """
+        Starts writing snapshots to path from a background thread. Call run every frame to take them.
+        """
+        if self._writer_thread:
+            return "FAILURE"
+        self._path = path
+        self._interval = interval
+        self._last_capture_time = time.time()
+        self._writer_stop.clear()
+
+        def write_loop():
+            while True:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                # stop hands over the last snapshot before setting the flag, so it's written before exiting
+                stopping = self._writer_stop.is_set()
+                with self._lock:
+                    state, self._pending = self._pending, None
+                if state is not None:
+                    self.write(path, state)
+                if stopping:
+                    return
+
+        self._writer_thread = threading.Thread(target=write_loop, daemon=True)
+        self._writer_thread.start()
+        return "SUCCESS"
+
+    def run(self):
+        # Take a snapshot if it's time and hand it to the writer thread
+        if not self._writer_thread or time.time() < self._last_capture_time+self._interval:
+            return
+        self._last_capture_time = time.time()
+        state = self.capture()
+        with self._lock:
+            self._pending = state
+        self._wakeup.set()
+
+    def stop(self):
+        """
+        Hands one last snapshot to the writer thread and waits for it to be written.
+        """
+        if not self._writer_thread:
+            return "FAILURE"
+        state = self.capture()
+        with self._lock:
+            self._pending = state
+        self._writer_stop.set()
+        self._wakeup.set()
+        self._writer_thread.join()
+        self._writer_thread = None
+        return "SUCCESS"
+
+Snapshots = _Snapshots()
+
+if __name__ == "__main__":
+    import sys
+    import pygame
+
+    # Snapshot a few thousand chatters, then time restoring them
+    pygame.init()
+    pygame.font.init()
+    pygame.display.set_mode((800, 600))
+    Settings.init_from_dict({"TWITCH_APP_ID": "-", "TWITCH_APP_SECRET": "-", "TWITCH_CHANNEL": "fightpit"})
+    SkinRegistry.preload_random_skins()
+    path = sys.argv[1] if len(sys.argv) > 1 else "test_snapshot.bin"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    for i in range(count):
+        TwitchInterface.add_chatter("chatter{}".format(i))
+    GameInterface.run()
+    start = time.perf_counter()
+    state = Snapshots.capture()
+    capture_time = time.perf_counter()-start
+    Snapshots.write(path, state)
+    print("Captured {} chatters in {:.1f}ms; snapshot is {} bytes".format(count, capture_time*1000, os.path.getsize(path)))
+
+    # Start over and restore
+    GameInterface.get_actors().clear()
+    TwitchInterface.get_chatter_metadata().clear()
+    start = time.perf_counter()
+    Snapshots.load(path)
+    print("Restore took {:.1f}ms".format((time.perf_counter()-start)*1000))
@@ -0,0 +1,187 @@
+import sqlite3
+import threading
+import traceback
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS health (name TEXT PRIMARY KEY, health INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS skins (name TEXT PRIMARY KEY, skin TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS stats (name TEXT NOT NULL, stat TEXT NOT NULL, value INTEGER NOT NULL, PRIMARY KEY (name, stat))",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+)
+
+class _ChatterStore:
+    """
+    The chatter store keeps chatter health, skin overrides and stats. Everything is loaded into memory once at startup
+    and read from there; changes are collected and written to an SQLite database (in WAL mode) in batches from a
+    background thread, so nothing on the chat or render path ever waits on the disk. Without a database it works the
+    same, just without keeping anything between restarts, except that health isn't kept at all: a chatter who leaves
+    and comes back starts over at full health.
+    """
+    def __init__(self):
+        self._path = None
+        self._keep_health = False
+        self._health = {}
+        self._skins = {}
+        self._stats = {}
+        self._meta = {}
+        # Changes not written yet; only the latest value per key matters, stats are added up
+        self._lock = threading.Lock()
+        self._dirty_health = {}
+        self._dirty_skins = {}
+        self._dirty_stats = {}
+        self._dirty_meta = {}
+        self._writer_thread = None
+        self._writer_stop = threading.Event()
+
+    def connect(self):
+        connection = sqlite3.connect(self._path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def open(self, path, flush_interval=1.0):
+        """
+        Loads everything from the database at path (creating it if needed) and starts writing changes back every
+        flush_interval seconds.
+        """
+        try:
+            self._path = path
+            connection = self.connect()
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+            for name, health in connection.execute("SELECT name, health FROM health"):
+                self._health[name] = health
+            for name, skin in connection.execute("SELECT name, skin FROM skins"):
+                self._skins[name] = skin
+            for name, stat, value in connection.execute("SELECT name, stat, value FROM stats"):
+                if name not in self._stats:
+                    self._stats[name] = {}
+                self._stats[name][stat] = value
+            for key, value in connection.execute("SELECT key, value FROM meta"):
+                self._meta[key] = value
+            connection.close()
+            self._keep_health = True
+        except:
+            print("WARNING: Failed to open database {}; chatter state won't be saved".format(path))
+            print(traceback.format_exc())
+            self._path = None
+            return "FAILURE"
+        self._writer_stop.clear()
+        self._writer_thread = threading.Thread(target=self.write_loop, args=[flush_interval], daemon=True)
+        self._writer_thread.start()
+        return "SUCCESS"
+
+    def write_loop(self, flush_interval):
+        connection = self.connect()
+        while not self._writer_stop.wait(flush_interval):
+            self.flush(connection)
+        self.flush(connection)
+        connection.close()
+
+    def flush(self, connection):
+        # Take everything that changed and write it in one transaction
+        with self._lock:
+            health, self._dirty_health = self._dirty_health, {}
+            skins, self._dirty_skins = self._dirty_skins, {}
+            stats, self._dirty_stats = self._dirty_stats, {}
+            meta, self._dirty_meta = self._dirty_meta, {}
+        if not (health or skins or stats or meta):
+            return
+        try:
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO health (name, health) VALUES (?, ?)", health.items())
+                connection.executemany("INSERT OR REPLACE INTO skins (name, skin) VALUES (?, ?)", skins.items())
+                connection.executemany(
+                    "INSERT INTO stats (name, stat, value) VALUES (?, ?, ?) ON CONFLICT (name, stat) DO UPDATE SET value = value + excluded.value",
+                    [(name, stat, value) for (name, stat), value in stats.items()])
+                connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+        except:
+            print("WARNING: Failed to save chatter state to {}".format(self._path))
+            print(traceback.format_exc())
+
+    def close(self):
+        """
+        Writes any remaining changes and stops the writer thread.
+        """
+        if not self._writer_thread:
+            return "FAILURE"
+        self._writer_stop.set()
+        self._writer_thread.join(10)
+        self._writer_thread = None
+        return "SUCCESS"
+
+    def get_health(self, name, default=None):
+        return self._health.get(name, default)
+
+    def set_health(self, name, health):
+        if not self._keep_health:
+            return
+        self._health[name] = health
+        if self._path:
+            with self._lock:
+                self._dirty_health[name] = health
+
+    def get_all_health(self):
+        """
+        Returns the kept health of every chatter, or None if health isn't kept.
+        """
+        if not self._keep_health:
+            return None
+        return dict(self._health)
+
+    def restore_health(self, health):
+        # Replaces the kept health (e.g. from a recording); None stops keeping health, like running without a database
+        self._keep_health = health is not None
+        self._health = dict(health) if health is not None else {}
+
+    def get_skin(self, name):
+        return self._skins.get(name)
+
+    def get_skins(self):
+        return dict(self._skins)
+
+    def set_skin(self, name, skin):
+        self._skins[name] = skin
+        if self._path:
+            with self._lock:
+                self._dirty_skins[name] = skin
+
+    def get_stats(self, name):
+        return dict(self._stats.get(name, {}))
+
+    def add_stat(self, name, stat, amount=1):
+        if name not in self._stats:
+            self._stats[name] = {}
+        self._stats[name][stat] = self._stats[name].get(stat, 0) + amount
+        if self._path:
+            with self._lock:
+                self._dirty_stats[(name, stat)] = self._dirty_stats.get((name, stat), 0) + amount
+
+    def get_meta(self, key):
+        return self._meta.get(key)
+
+    def set_meta(self, key, value):
+        self._meta[key] = value
+        if self._path:
+            with self._lock:
+                self._dirty_meta[key] = value
+
+ChatterStore = _ChatterStore()
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+
+    # Write some state to a test database, then read it back
+    path = sys.argv[1] if len(sys.argv) > 1 else "test_store.db"
+    ChatterStore.open(path, 0.1)
+    print("Loaded: health {}, skin {}, stats {}".format(ChatterStore.get_health("aeomech"), ChatterStore.get_skin("aeomech"), ChatterStore.get_stats("aeomech")))
+    start = time.perf_counter()
+    for i in range(10000):
+        ChatterStore.set_health("aeomech", 20000-i)
+        ChatterStore.add_stat("aeomech", "attacks")
+    ChatterStore.set_skin("aeomech", os.path.join("skins", "random", "default"))
+    print("10000 updates took {:.1f}ms".format((time.perf_counter()-start)*1000))
+    ChatterStore.close()
@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import asyncio
+import unittest
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chat_outbox import _ChatOutbox, TokenBucket
+
+class FakeChat:
+    """
+    Stand-in for twitchAPI's Chat that keeps what was sent and when.
+    """
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, channel, text):
+        self.sent.append((time.monotonic(), None, text))
+
+class FakeMessage:
+    """
+    Stand-in for the twitchAPI ChatMessage being replied to.
+    """
+    def __init__(self, chat, id):
+        self.chat = chat
+        self.id = id
+
+    async def reply(self, text):
+        self.chat.sent.append((time.monotonic(), self.id, text))
+
+class OutboxThread:
+    """
+    Runs an outbox on its own loop in another thread, like the chat's callback loop.
+    """
+    def __init__(self, outbox):
+        self.outbox = outbox
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.run()))
+
+    async def run(self):
+        self.started.set()
+        await self.outbox.run()
+
+    def __enter__(self):
+        self.thread.start()
+        self.started.wait(5)
+        # Let run() create its wakeup event
+        while not self.outbox.is_running():
+            time.sleep(0.001)
+        return self
+
+    def __exit__(self, *args):
+        self.outbox.stop()
+        self.thread.join(5)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+class ChatOutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.chat = FakeChat()
+        self.outbox = _ChatOutbox()
+        self.outbox.set_chat(self.chat, "fightpit")
+
+    def test_post_from_another_thread_wakes_the_outbox(self):
+        with OutboxThread(self.outbox):
+            # The outbox is idle and waiting, so only the post can wake it up
+            time.sleep(0.05)
+            posted = time.monotonic()
+            self.outbox.post("hello")
+            self.assertTrue(wait_for(lambda: len(self.chat.sent) == 1))
+        self.assertLess(self.chat.sent[0][0] - posted, 0.5)
+        self.assertEqual(self.chat.sent[0][2], "hello")
+
+    def test_lone_message_is_a_threaded_reply(self):
+        with OutboxThread(self.outbox):
+            self.outbox.post("hi back", FakeMessage(self.chat, "abc"))
+            self.assertTrue(wait_for(lambda: len(self.chat.sent) == 1))
+        self.assertEqual(self.chat.sent[0][1:], ("abc", "hi back"))
+
+    def test_burst_is_merged(self):
+        self.outbox.set_batch_delay(0.1)
+        with OutboxThread(self.outbox):
+            for i in range(10):
+                self.outbox.post("message {}".format(i), FakeMessage(self.chat, i))
+            self.assertTrue(wait_for(lambda: self.outbox.get_pending_count() == 0 and len(self.chat.sent) > 0))
+            time.sleep(0.2)
+        self.assertEqual(len(self.chat.sent), 1)
+        # Merged messages answer several people, so they aren't replies
+        self.assertIsNone(self.chat.sent[0][1])
+        self.assertEqual(self.chat.sent[0][2], " | ".join("message {}".format(i) for i in range(10)))
+        self.assertEqual(self.outbox.get_merged_count(), 9)
+
+    def test_merged_messages_stay_under_max_length(self):
+        with OutboxThread(self.outbox):
+            self.outbox.set_batch_delay(0.1)
+            for i in range(10):
+                self.outbox.post("x"*200)
+            self.assertTrue(wait_for(lambda: len(self.chat.sent) == 5))
+        for sent in self.chat.sent:
+            self.assertLessEqual(len(sent[2]), _ChatOutbox.max_length)
+
+    def test_backlog_is_not_delayed(self):
+        # Only the first message into an empty outbox waits for the batch delay
+        self.outbox.set_batch_delay(0.3)
+        with OutboxThread(self.outbox):
+            start = time.monotonic()
+            for i in range(4):
+                # Too long to merge
+                self.outbox.post(str(i)*400)
+            self.assertTrue(wait_for(lambda: len(self.chat.sent) == 4))
+        times = [sent[0] - start for sent in self.chat.sent]
+        self.assertGreaterEqual(times[0], 0.25)
+        self.assertLess(times[3] - times[0], 0.1)
+
+    def test_rate_limit(self):
+        # 2 messages at once, then one every 0.1 seconds
+        self.outbox.set_rate_limit(2, 0.2)
+        with OutboxThread(self.outbox):
+            start = time.monotonic()
+            for i in range(6):
+                # Too long to merge
+                self.outbox.post(str(i)*400)
+            self.assertTrue(wait_for(lambda: len(self.chat.sent) == 6))
+        times = [sent[0] - start for sent in self.chat.sent]
+        self.assertLess(times[1], 0.05)
+        self.assertGreaterEqual(times[5], 0.35)
+
+    def test_oldest_messages_are_dropped_when_full(self):
+        self.outbox.set_max_pending(3)
+        for i in range(5):
+            self.outbox.post(str(i))
+        self.assertEqual(self.outbox.drain(), ["2", "3", "4"])
+        self.assertEqual(self.outbox.get_dropped_count(), 2)
+
+class TokenBucketTest(unittest.TestCase):
+    def test_capacity_then_refill(self):
+        bucket = TokenBucket(10, 2)
+        self.assertTrue(bucket.try_take())
+        self.assertTrue(bucket.try_take())
+        self.assertFalse(bucket.try_take())
+        self.assertGreater(bucket.get_wait(), 0)
+        time.sleep(0.11)
+        self.assertTrue(bucket.try_take())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import combat
+from combat import CombatEngine
+
+def make_actions(count, seed=0):
+    rng = random.Random(seed)
+    chatters = ["chatter{}".format(i) for i in range(20)]
+    return [{"action": "attack" if rng.randint(1, 4) > 1 else "heal", "actor1": rng.choice(chatters), "actor2": rng.choice(chatters)} for i in range(count)]
+
+def roll(actions, threshold, seed=1):
+    engine = CombatEngine((99, 9999), (99, 2999), 10, 20000)
+    engine.vectorize_threshold = threshold
+    return engine.roll(actions, lambda name: name.endswith("3"), random.Random(seed))
+
+class CombatEngineTest(unittest.TestCase):
+    @unittest.skipIf(combat.numpy is None, "NumPy isn't installed")
+    def test_numpy_and_python_draw_the_same_numbers(self):
+        actions = make_actions(200)
+        self.assertEqual(roll(actions, 0), roll(actions, 10**9))
+
+    @unittest.skipIf(combat.numpy is None, "NumPy isn't installed")
+    def test_mix_array_matches_mix(self):
+        seed = random.Random(2).getrandbits(64)
+        self.assertEqual(combat.mix_array(seed, 5, 50).tolist(), [combat.mix(seed, 5+i) for i in range(50)])
+
+    def test_same_seed_same_rolls(self):
+        actions = make_actions(10)
+        self.assertEqual(roll(actions, 16), roll(actions, 16))
+        self.assertNotEqual(roll(actions, 16, seed=1), roll(actions, 16, seed=2))
+
+    def test_rolls_are_in_range(self):
+        rolls = roll(make_actions(2000), 10**9)
+        attacks = [r for r in rolls if r["action"] == "attack"]
+        for r in attacks:
+            self.assertTrue(49 <= r["damage"] <= 9999)
+        for r in rolls:
+            if r["action"] == "heal":
+                self.assertTrue(99 <= r["healing"] <= 2999)
+        counters = sum(r["counter"] for r in attacks)/len(attacks)
+        self.assertTrue(0.05 < counters < 0.15)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scheduler import CommandScheduler, FairScheduler
+
+def make_command(action, actor1, actor2):
+    return {"action": action, "actor1": actor1, "actor2": actor2, "metadata": {}}
+
+def pop_all(scheduler, busy=()):
+    commands = []
+    while True:
+        command = scheduler.pop_runnable(lambda command: command["actor1"] if command["actor1"] in busy else None)
+        if command is None:
+            return commands
+        commands.append(command)
+
+class CommandSchedulerTest(unittest.TestCase):
+    def test_released_commands_keep_their_place(self):
+        scheduler = CommandScheduler()
+        for i, actor in enumerate(["a", "b", "a", "c"]):
+            scheduler.push(make_command("pet", actor, "x{}".format(i)))
+        # a is busy, so its commands are parked behind b's
+        self.assertEqual(scheduler.pop_runnable(lambda command: "a" if command["actor1"] == "a" else None)["actor2"], "x1")
+        scheduler.release("a")
+        self.assertEqual([command["actor2"] for command in pop_all(scheduler)], ["x0", "x2", "x3"])
+
+    def test_get_commands_is_in_queued_order(self):
+        scheduler = CommandScheduler()
+        for i, actor in enumerate(["a", "b", "a", "c"]):
+            scheduler.push(make_command("pet", actor, "x{}".format(i)))
+        pop_all(scheduler, busy=("a",))
+        scheduler.release("a")
+        self.assertEqual([command["actor2"] for command in scheduler.get_commands()], ["x0", "x2"])
+
+    def test_overflow_drops_oldest_after_release(self):
+        dropped = []
+        scheduler = CommandScheduler(max_length=3, droppable_actions=("pet",), on_drop=lambda command, reason: dropped.append(command["actor2"]))
+        for i, actor in enumerate(["a", "b", "c"]):
+            scheduler.push(make_command("pet", actor, "x{}".format(i)))
+        scheduler.pop_runnable(lambda command: "a" if command["actor1"] == "a" else None)
+        scheduler.release("a")
+        scheduler.push(make_command("pet", "d", "x3"))
+        scheduler.push(make_command("attack", "e", "x4"))
+        self.assertEqual(dropped, ["x0"])
+
+    def test_overflow_drops_droppable_commands_first(self):
+        dropped = []
+        scheduler = CommandScheduler(max_length=2, droppable_actions=("pet",), on_drop=lambda command, reason: dropped.append(command["action"]))
+        scheduler.push(make_command("attack", "a", "b"))
+        scheduler.push(make_command("pet", "a", "b"))
+        self.assertEqual(scheduler.push(make_command("attack", "c", "d")), "QUEUED")
+        self.assertEqual(dropped, ["pet"])
+        self.assertEqual(scheduler.push(make_command("pet", "c", "d")), "DROPPED")
+        self.assertEqual(len(scheduler), 2)
+
+    def test_overflow_sheds_attacks_but_not_faints_or_skins(self):
+        dropped = []
+        scheduler = CommandScheduler(max_length=2, droppable_actions=("pet",), on_drop=lambda command, reason: dropped.append(command["actor2"]))
+        scheduler.push(make_command("attack", "a", "x0"))
+        scheduler.push(make_command("attack", "b", "x1"))
+        self.assertEqual(scheduler.push(make_command("attack", "c", "x2")), "QUEUED")
+        self.assertEqual(dropped, ["x0"])
+        self.assertEqual(scheduler.push({"action": "faint", "actor": "a"}), "QUEUED")
+        self.assertEqual(scheduler.push({"action": "update_skin", "actor": "b"}), "QUEUED")
+        self.assertEqual(dropped, ["x0", "x1", "x2"])
+        # Only protected commands are left, so a new attack is dropped instead
+        self.assertEqual(scheduler.push(make_command("attack", "d", "x3")), "DROPPED")
+        self.assertEqual(len(scheduler), 2)
+
+class FairSchedulerTest(unittest.TestCase):
+    def test_released_commands_keep_their_place(self):
+        scheduler = FairScheduler()
+        for i, actor in enumerate(["a", "b", "c"]):
+            scheduler.push(make_command("pet", actor, "x{}".format(i)))
+        self.assertEqual(scheduler.pop_runnable(lambda command: "a" if command["actor1"] == "a" else None)["actor2"], "x1")
+        scheduler.release("a")
+        self.assertEqual([command["actor2"] for command in pop_all(scheduler)], ["x0", "x2"])
+
+    def test_overflow_only_drops_droppable_commands(self):
+        dropped = []
+        scheduler = FairScheduler(max_length=2, droppable_actions=("pet",), on_drop=lambda command, reason: dropped.append(command["actor2"]))
+        scheduler.push(make_command("pet", "a", "x0"))
+        scheduler.push(make_command("attack", "b", "x1"))
+        scheduler.push(make_command("attack", "c", "x2"))
+        self.assertEqual(dropped, ["x0"])
+        self.assertEqual([command["actor2"] for command in pop_all(scheduler)], ["x1", "x2"])
+
+    def test_make_entry_has_no_side_effects(self):
+        scheduler = FairScheduler()
+        command = make_command("pet", "a", "b")
+        self.assertEqual(scheduler.make_entry(command)[3], 1)
+        self.assertEqual(scheduler.make_entry(command)[3], 1)
+
+    def test_commanders_are_forgotten_once_caught_up(self):
+        scheduler = FairScheduler()
+        for i in range(100):
+            scheduler.push(make_command("pet", "chatter{}".format(i), "x"))
+        scheduler.push(make_command("pet", "chatter0", "y"))
+        self.assertEqual(len(pop_all(scheduler)), 101)
+        self.assertEqual(scheduler._last_finish, {})
+        self.assertEqual(scheduler._finish_heap, [])
+        # Back to being a new commander
+        self.assertEqual(scheduler.make_entry(make_command("pet", "chatter0", "x"))[3], 1)
+
+if __name__ == "__main__":
+    unittest.main()
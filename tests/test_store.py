@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from store import _ChatterStore
+import skins
+
+class ChatterStoreTest(unittest.TestCase):
+    def test_health_not_kept_without_database(self):
+        store = _ChatterStore()
+        store.set_health("a", 5)
+        self.assertEqual(store.get_health("a", 20000), 20000)
+        self.assertIsNone(store.get_all_health())
+
+    def test_health_kept_with_database(self):
+        folder = tempfile.mkdtemp()
+        try:
+            store = _ChatterStore()
+            store.open(os.path.join(folder, "test.db"), 0.05)
+            store.set_health("a", 5)
+            store.close()
+            store = _ChatterStore()
+            store.open(os.path.join(folder, "test.db"), 0.05)
+            self.assertEqual(store.get_health("a", 20000), 5)
+            store.close()
+        finally:
+            shutil.rmtree(folder)
+
+    def test_restore_health(self):
+        store = _ChatterStore()
+        store.restore_health({"a": 5})
+        self.assertEqual(store.get_health("a"), 5)
+        store.set_health("b", 6)
+        self.assertEqual(store.get_all_health(), {"a": 5, "b": 6})
+        store.restore_health(None)
+        self.assertIsNone(store.get_all_health())
+
+class SkinOverridesFileTest(unittest.TestCase):
+    def test_overrides_written_without_database(self):
+        folder = tempfile.mkdtemp()
+        store = _ChatterStore()
+        original_store = skins.ChatterStore
+        skins.ChatterStore = store
+        try:
+            path = os.path.join(folder, "skin_overrides.json")
+            overrides = skins._SkinOverrides()
+            overrides.start_writer_thread(path, 0.05)
+            store.set_skin("a", "skins/random/default")
+            overrides._changed = True
+            overrides.stop()
+            with open(path, "r") as overrides_file:
+                self.assertEqual(json.load(overrides_file), {"a": "skins/random/default"})
+        finally:
+            skins.ChatterStore = original_store
+            shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    unittest.main()
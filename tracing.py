@@ -0,0 +1,186 @@
+import json
+import time
+import itertools
+import threading
+import traceback
+
+class Histogram:
+    """
+    A cumulative histogram of durations in seconds, in the same shape Prometheus uses: each bucket counts the observations
+    less than or equal to its upper bound.
+    """
+    default_buckets = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, buckets=default_buckets):
+        self._buckets = tuple(buckets)
+        self._counts = [0]*(len(self._buckets)+1)
+        self._count = 0
+        self._sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                self._counts[i] += 1
+                break
+        else:
+            self._counts[-1] += 1
+        self._count += 1
+        self._sum += value
+
+    def get_count(self):
+        return self._count
+
+    def get_sum(self):
+        return self._sum
+
+    def get_buckets(self):
+        """
+        Returns a list of (upper bound, cumulative count) pairs, ending with ("+Inf", total count).
+        """
+        buckets = []
+        total = 0
+        for bound, count in zip(self._buckets + ("+Inf",), self._counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+# Stages of a command's life, in order
+TRACE_EVENTS = ("received", "enqueued", "dequeued", "movement_started", "animation_started", "completed")
+
+# Intervals measured for each command as (name, from event, to event)
+TRACE_INTERVALS = (
+    ("handling", "received", "enqueued"),
+    ("queueing", "enqueued", "dequeued"),
+    ("movement", "movement_started", "animation_started"),
+    ("animation", "animation_started", "completed"),
+    ("execution", "dequeued", "completed"),
+    ("total", "received", "completed")
+)
+
+class _CommandTracer:
+    """
+    The command tracer follows commands from the chat message that caused them to the end of their interaction. Each
+    traced command gets a "trace" dictionary with an ID and a timestamp for every event in TRACE_EVENTS it reached. When
+    a command completes, the time between events is added to a histogram per interval and action.
+    """
+    def __init__(self):
+        self._enabled = True
+        self._ids = itertools.count(1)
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._export_thread = None
+        self._export_stop = threading.Event()
+
+    def set_enabled(self, enabled):
+        self._enabled = enabled
+
+    def is_enabled(self):
+        return self._enabled
+
+    def start_trace(self, command, received_time=None):
+        """
+        Gives command a trace ID and marks it as received (now, if received_time isn't given) and enqueued.
+        """
+        if not self._enabled:
+            return command
+        now = time.time()
+        command["trace"] = {
+            "id": next(self._ids),
+            "received": received_time if received_time is not None else now,
+            "enqueued": now
+        }
+        return command
+
+    def mark(self, command, event):
+        # Only the first time a command reaches an event counts
+        if not self._enabled or "trace" not in command or event in command["trace"]:
+            return
+        command["trace"][event] = time.time()
+        if event == "completed":
+            self.record(command)
+
+    def record(self, command):
+        trace = command["trace"]
+        with self._lock:
+            for name, start, end in TRACE_INTERVALS:
+                if start in trace and end in trace:
+                    key = (name, command["action"])
+                    if key not in self._histograms:
+                        self._histograms[key] = Histogram()
+                    self._histograms[key].observe(max(0, trace[end]-trace[start]))
+
+    def get_histograms(self):
+        """
+        Returns a copy of the histograms as a dictionary of interval name to action to histogram data.
+        """
+        histograms = {}
+        with self._lock:
+            for (name, action), histogram in self._histograms.items():
+                if name not in histograms:
+                    histograms[name] = {}
+                histograms[name][action] = {
+                    "count": histogram.get_count(),
+                    "sum": histogram.get_sum(),
+                    "buckets": histogram.get_buckets()
+                }
+        return histograms
+
+    def get_summary(self):
+        """
+        Returns the number of traced commands and mean seconds for each interval, across all actions.
+        """
+        summary = {}
+        for name, actions in self.get_histograms().items():
+            count = sum(data["count"] for data in actions.values())
+            total = sum(data["sum"] for data in actions.values())
+            summary[name] = {"count": count, "mean": total/count if count > 0 else 0}
+        return summary
+
+    def export(self, path):
+        """
+        Writes the histograms to path as JSON.
+        """
+        try:
+            with open(path, "w") as export_file:
+                json.dump({"time": time.time(), "histograms": self.get_histograms()}, export_file, indent=4)
+            return "SUCCESS"
+        except:
+            print("WARNING: Failed to export command traces to {}".format(path))
+            print(traceback.format_exc())
+            return "FAILURE"
+
+    def start_export_thread(self, path, interval):
+        """
+        Exports the histograms to path every interval seconds from a background thread, and once more when stopped.
+        """
+        if self._export_thread:
+            return "FAILURE"
+        self._export_stop.clear()
+
+        def export_loop():
+            while not self._export_stop.wait(interval):
+                self.export(path)
+            self.export(path)
+
+        self._export_thread = threading.Thread(target=export_loop, daemon=True)
+        self._export_thread.start()
+        return "SUCCESS"
+
+    def stop_export_thread(self):
+        if not self._export_thread:
+            return "FAILURE"
+        self._export_stop.set()
+        self._export_thread.join(10)
+        self._export_thread = None
+        return "SUCCESS"
+
+CommandTracer = _CommandTracer()
+
+if __name__ == "__main__":
+    # Trace a fake command through every event and print the result
+    command = CommandTracer.start_trace({"action": "attack", "actor1": "a", "actor2": "b", "metadata": None}, time.time()-0.1)
+    for event in TRACE_EVENTS[2:]:
+        time.sleep(0.05)
+        CommandTracer.mark(command, event)
+    print(command)
+    print(json.dumps(CommandTracer.get_summary(), indent=4))
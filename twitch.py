@@ -1,10 +1,14 @@
-import time
-import random
+import asyncio
 import traceback
 from twitch_interface import TwitchInterface
 from game_interface import GameInterface
 from settings import Settings
 from skins import SkinOverrides
+from chat_outbox import ChatOutbox
+from store import ChatterStore
+from runtime import Runtime
+from combat import CombatEngine
+from replay import Recorder
 from twitchAPI.twitch import Twitch
 from twitchAPI.oauth import UserAuthenticator
 from twitchAPI.type import AuthScope, ChatEvent
@@ -26,12 +30,28 @@ def split_skins_message(skins_list):
     return msg_list
     
 
+# Tasks that run on the loop twitchAPI calls the chat handlers on, so they never run at the same time as a handler
+# (everything that changes TwitchInterface's chatters runs on that loop)
+chat_tasks = []
+
+def start_chat_tasks():
+    # The ready event fires again after reconnecting
+    if chat_tasks:
+        return
+    chat_tasks.append(asyncio.create_task(ChatOutbox.run()))
+    chat_tasks.append(asyncio.create_task(expire_chatters_loop()))
+
+async def stop_chat_tasks():
+    ChatOutbox.stop()
+    await asyncio.gather(*chat_tasks)
+
 # Callback for the chat connection being ready
 async def on_ready(ready_event: EventData):
     try:
         print('Bot is ready for work; joining channel {}'.format(TwitchInterface.get_target_channel()))
         await ready_event.chat.join_room(TwitchInterface.get_target_channel())
-        await ready_event.chat.send_message(TwitchInterface.get_target_channel(), f'Fight pit bot has connected to chat {Settings.connect_emote}')
+        start_chat_tasks()
+        ChatOutbox.post(f'Fight pit bot has connected to chat {Settings.connect_emote}')
     except:
         print(traceback.format_exc())
 
@@ -45,26 +65,67 @@ async def on_message(msg: ChatMessage):
         print("Failed to process chat message")
         print(traceback.format_exc())
 
+def get_combat_engine():
+    return CombatEngine(
+        (Settings.damage_range_min, Settings.damage_range_max),
+        (Settings.healing_range_min, Settings.healing_range_max),
+        Settings.counter_chance,
+        TwitchInterface.get_chatter_default_health())
+
+def apply_combat_rolls(engine, rolls, received_time):
+    """
+    Applies combat rolls to the chatters' health, queues up the counters and faints for the director and records stats.
+    Returns the combat events.
+    """
+    health = {}
+    for roll in rolls:
+        for name in (roll["actor1"], roll["actor2"]):
+            health[name] = TwitchInterface.get_chatter_health(name)
+    events = engine.apply(rolls, health)
+    for name in health:
+        TwitchInterface.set_chatter_health(name, health[name])
+    for event in events:
+        if event["type"] in ("damage", "counter"):
+            ChatterStore.add_stat(event["source"], "damage_dealt", event["amount"])
+        if event["type"] == "counter":
+            ChatterStore.add_stat(event["source"], "counters")
+            GameInterface.enqueue_command({
+                "action": Settings.attack_cmd,
+                "actor1": event["source"],
+                "actor2": event["target"],
+                "metadata": {"damage": event["amount"]}
+            }, received_time)
+        elif event["type"] == "faint":
+            ChatterStore.add_stat(event["target"], "faints")
+            GameInterface.enqueue_command({
+                "action": "faint",
+                "actor": event["target"],
+                "metadata": None
+            }, received_time)
+        elif event["type"] == "heal":
+            ChatterStore.add_stat(event["source"], "healing_done", event["amount"])
+    return events
+
 # Function to handle typical commands
-async def handle_command(cmd, commander, chatter, action, action_past_tense, emote, send_reply=True):
+async def handle_command(cmd, commander, chatter, action, action_past_tense, emote, send_reply=True, received_time=None, metadata=None):
     try:
         # Add the commander chatter if he isn't there already
         TwitchInterface.add_chatter(commander)
 
         # Ignore command if commander is in ignore list or has recently sent a command
         if (commander in TwitchInterface.get_ignore_list() or
-            time.time() < TwitchInterface.get_chatter_metadata()[commander]["last_command_time"]+Settings.command_timeout_per_user):
+            Runtime.time() < TwitchInterface.get_chatter_metadata()[commander]["last_command_time"]+Settings.command_timeout_per_user):
             print(f'{commander} is in ignore list or trying to send commands too quickly')
             return "FAILURE"
         
         # Ignore command if last command in general was too recent
-        if time.time() < TwitchInterface.get_last_command_time()+Settings.command_timeout:
+        if Runtime.time() < TwitchInterface.get_last_command_time()+Settings.command_timeout:
             print("Chatters are trying to send commands too quickly; ignoring")
             return "FAILURE"
 
         # Non-commanding user must already be in chatters for this to work
         if chatter not in TwitchInterface.get_chatter_metadata():
-            await cmd.reply(f'{commander} tried to {action} {chatter}, but they were nowhere to be found! {Settings.not_found_emote}')
+            ChatOutbox.post(f'{commander} tried to {action} {chatter}, but they were nowhere to be found! {Settings.not_found_emote}', cmd)
             return "FAILURE"
         
         # Queue the command
@@ -72,15 +133,17 @@ async def handle_command(cmd, commander, chatter, action, action_past_tense, emo
             "action": action,
             "actor1": commander,
             "actor2": chatter,
-            "metadata": None
-        })
+            "metadata": metadata
+        }, received_time)
 
         # Tell the user it's happening
         if send_reply:
-            await cmd.reply(f'{commander} {action_past_tense} {chatter}! {emote}')
+            ChatOutbox.post(f'{commander} {action_past_tense} {chatter}! {emote}', cmd)
 
-        # Update last command time
+        # Update last command time and stats
         TwitchInterface.set_chatter_last_command_time(commander)
+        ChatterStore.add_stat(commander, "{}_sent".format(action))
+        ChatterStore.add_stat(chatter, "{}_received".format(action))
 
         return "SUCCESS"
     except:
@@ -89,6 +152,7 @@ async def handle_command(cmd, commander, chatter, action, action_past_tense, emo
 
 # Callback for the pet command
 async def pet_command(cmd: ChatCommand):
+    received_time = Runtime.time()
     try:
         # Ignore zero length parameters
         if len(cmd.parameter) < 1:
@@ -97,7 +161,7 @@ async def pet_command(cmd: ChatCommand):
         commander = str(cmd.user.name).lower()
         chatter = str(cmd.parameter).lower()
         # Handle command
-        await handle_command(cmd, commander, chatter, Settings.pet_cmd, Settings.pet_past_tense, Settings.pet_emote)
+        await handle_command(cmd, commander, chatter, Settings.pet_cmd, Settings.pet_past_tense, Settings.pet_emote, received_time=received_time)
     except:
         print("Unknown error occurred handling pet command")
         print(traceback.format_exc())
@@ -105,6 +169,7 @@ async def pet_command(cmd: ChatCommand):
 
 # Callback for the squash command
 async def attack_command(cmd: ChatCommand):
+    received_time = Runtime.time()
     try:
         # Ignore zero length parameters
         if len(cmd.parameter) < 1:
@@ -112,55 +177,33 @@ async def attack_command(cmd: ChatCommand):
         # Get actors
         commander = str(cmd.user.name).lower()
         chatter = str(cmd.parameter).lower()
+        # Roll damage and counter
+        # (Defended status is set by the main thread, so it's recorded for replays)
+        engine = get_combat_engine()
+        rolls = engine.roll([{"action": "attack", "actor1": commander, "actor2": chatter}],
+                            lambda name: Runtime.observe(GameInterface.is_actor_defended(name)), Runtime.get_random())
         # Handle command
-        result = await handle_command(cmd, commander, chatter, Settings.attack_cmd, Settings.attack_past_tense, Settings.attack_emote, False)
+        result = await handle_command(cmd, commander, chatter, Settings.attack_cmd, Settings.attack_past_tense, Settings.attack_emote, False,
+                                      received_time=received_time, metadata={"damage": rolls[0]["damage"]})
         if result != "SUCCESS":
             return "FAILURE"
-        # Determine damage and counter
-        damage = random.randint(Settings.damage_range_min, Settings.damage_range_max)
-        if GameInterface.is_actor_defended(chatter):
-            damage = int(damage/2)
-        counter_damage = random.randint(Settings.damage_range_min, Settings.damage_range_max)
-        if GameInterface.is_actor_defended(commander):
-            counter_damage = int(damage/2)
-        counter = True if random.randint(1,Settings.counter_chance) == 1 else False
-        # Apply damage
-        chatter_status = TwitchInterface.damage_chatter(chatter, damage)
-        if chatter_status == "FAINTED":
-            counter = False # Can't counter if you've fainted
-            GameInterface.enqueue_command({
-                "action": "faint",
-                "actor": chatter,
-                "metadata": None
-            })
-        # If countering, queue that up
-        if counter:
-            GameInterface.enqueue_command({
-                "action": Settings.attack_cmd,
-                "actor1": chatter,
-                "actor2": commander,
-                "metadata": None
-            })
-        commander_status = "ALIVE"
-        if counter:
-            commander_status = TwitchInterface.damage_chatter(commander, counter_damage)
-            if commander_status == "FAINTED":
-                GameInterface.enqueue_command({
-                    "action": "faint",
-                    "actor": commander,
-                    "metadata": None
-                })
+        # Apply damage and queue up any counters and faints
+        events = apply_combat_rolls(engine, rolls, received_time)
         # Build message
-        msg = f'{commander} {Settings.attack_past_tense} {chatter} for {damage} damage!'
-        if counter:
-            msg += f' {chatter} counters for {counter_damage} damage!'
+        msg = ""
+        fainted = []
+        for event in events:
+            if event["type"] == "damage":
+                msg += f'{commander} {Settings.attack_past_tense} {chatter} for {event["amount"]} damage!'
+            elif event["type"] == "counter":
+                msg += f' {chatter} counters for {event["amount"]} damage!'
+            elif event["type"] == "faint":
+                fainted.append(event["target"])
         msg += f' {Settings.attack_emote}'
-        if chatter_status == "FAINTED":
-            msg += f' {chatter} fainted! {Settings.faint_emote}'
-        if commander_status == "FAINTED":
-            msg += f' {commander} fainted! {Settings.faint_emote}'
+        for name in fainted:
+            msg += f' {name} fainted! {Settings.faint_emote}'
         # Send message
-        await cmd.reply(msg)
+        ChatOutbox.post(msg, cmd)
         return "SUCCESS"
     except:
         print("Unknown error occurred handling attack command")
@@ -169,6 +212,7 @@ async def attack_command(cmd: ChatCommand):
 
 # Callback for the heal command
 async def heal_command(cmd: ChatCommand):
+    received_time = Runtime.time()
     try:
         # Ignore zero length parameters
         if len(cmd.parameter) < 1:
@@ -176,13 +220,18 @@ async def heal_command(cmd: ChatCommand):
         # Get actors
         commander = str(cmd.user.name).lower()
         chatter = str(cmd.parameter).lower()
+        # Calculate healing value
+        engine = get_combat_engine()
+        rolls = engine.roll([{"action": "heal", "actor1": commander, "actor2": chatter}], None, Runtime.get_random())
         # Handle command
-        await handle_command(cmd, commander, chatter, Settings.heal_cmd, Settings.healed_past_tense, Settings.heal_emote, False)
-        # Calculate and apply healing value
-        healing = random.randint(Settings.healing_range_min, Settings.healing_range_max)
-        new_health = TwitchInterface.heal_chatter(chatter, healing)
+        result = await handle_command(cmd, commander, chatter, Settings.heal_cmd, Settings.healed_past_tense, Settings.heal_emote, False,
+                                      received_time=received_time, metadata={"healing": rolls[0]["healing"]})
+        if result != "SUCCESS":
+            return "FAILURE"
+        # Apply healing value
+        event = apply_combat_rolls(engine, rolls, received_time)[0]
         # Send reply
-        await cmd.reply(f'{commander} {Settings.healed_past_tense} {chatter} for {healing} HP! They now have {new_health}/{Settings.default_health} HP! {Settings.heal_emote}')
+        ChatOutbox.post(f'{commander} {Settings.healed_past_tense} {chatter} for {event["amount"]} HP! They now have {event["health"]}/{Settings.default_health} HP! {Settings.heal_emote}', cmd)
         return "SUCCESS"
     except:
         print("Unknown error occurred handling heal command")
@@ -191,6 +240,7 @@ async def heal_command(cmd: ChatCommand):
 
 # Callback for the defend command
 async def defend_command(cmd: ChatCommand):
+    received_time = Runtime.time()
     try:
         # Ignore zero length parameters
         if len(cmd.parameter) < 1:
@@ -199,7 +249,7 @@ async def defend_command(cmd: ChatCommand):
         commander = str(cmd.user.name).lower()
         chatter = str(cmd.parameter).lower()
         # Handle command
-        await handle_command(cmd, commander, chatter, Settings.defend_cmd, Settings.defend_past_tense, Settings.defend_emote)
+        await handle_command(cmd, commander, chatter, Settings.defend_cmd, Settings.defend_past_tense, Settings.defend_emote, received_time=received_time)
         # Set defended status on chatter
         # GameInterface.defend_actor(chatter) # Set this during animation instead
         return "SUCCESS"
@@ -210,6 +260,7 @@ async def defend_command(cmd: ChatCommand):
 
 # Callback for the skin command
 async def skin_command(cmd: ChatCommand):
+    received_time = Runtime.time()
     try:
         # Get parameters
         commander = str(cmd.user.name).lower()
@@ -218,30 +269,30 @@ async def skin_command(cmd: ChatCommand):
         TwitchInterface.add_chatter(commander)
         # Ignore command if commander is in ignore list or has recently sent a command
         if (commander in TwitchInterface.get_ignore_list() or
-            time.time() < TwitchInterface.get_chatter_metadata()[commander]["last_command_time"]+Settings.command_timeout_per_user):
+            Runtime.time() < TwitchInterface.get_chatter_metadata()[commander]["last_command_time"]+Settings.command_timeout_per_user):
             print(f'{commander} is in ignore list or trying to send commands too quickly')
             return "FAILURE"
         # Ignore command if last command in general was too recent
-        if time.time() < TwitchInterface.get_last_command_time()+Settings.command_timeout:
+        if Runtime.time() < TwitchInterface.get_last_command_time()+Settings.command_timeout:
             print("Chatters are trying to send commands too quickly; ignoring")
             return "FAILURE"
         # Print available skins to chat if a skin wasn't specified
         if len(cmd.parameter) < 1:
             skins_msg = split_skins_message(SkinOverrides.get_available_skins())
             for msg in skins_msg:
-                await cmd.reply(msg)
+                ChatOutbox.post(msg, cmd)
             return "SUCCESS"
         # Set skin override
         result = SkinOverrides.set_override(commander, skin)
         if result == "FAILURE":
-            await cmd.reply(f'Selecting skin {skin} failed. Did you spell it correctly?')
+            ChatOutbox.post(f'Selecting skin {skin} failed. Did you spell it correctly?', cmd)
             return "FAILURE"
         GameInterface.enqueue_command({
                 "action": "update_skin",
                 "actor": commander,
                 "metadata": None
-            })
-        await cmd.reply(f'Updating skin for {commander} to {skin} {Settings.skin_update_emote}')
+            }, received_time)
+        ChatOutbox.post(f'Updating skin for {commander} to {skin} {Settings.skin_update_emote}', cmd)
         TwitchInterface.set_chatter_last_command_time(commander)
         return "SUCCESS"
     except:
@@ -265,7 +316,7 @@ async def lurk_command(cmd: ChatCommand):
 # Callback for the info command
 async def info_command(cmd: ChatCommand):
     try:
-        await cmd.reply(f'{Settings.fight_emote_1} {Settings.fight_emote_2} ' +
+        ChatOutbox.post(f'{Settings.fight_emote_1} {Settings.fight_emote_2} ' +
                         f'Participate in the {Settings.fight_pit_name}! Throw hands with each other using any of these commands: ' +
                         f'!{Settings.info_cmd}, ' +
                         f'!{Settings.attack_cmd}, ' +
@@ -274,13 +325,44 @@ async def info_command(cmd: ChatCommand):
                         f'!{Settings.pet_cmd}, ' +
                         f'!{Settings.skin_cmd}, ' +
                         f'!{Settings.skins_cmd}, ' +
-                        f'!{Settings.lurk_cmd}')
+                        f'!{Settings.lurk_cmd}', cmd)
         return "SUCCESS"
     except:
         print("Unknown error occurred handling lurk command")
         print(traceback.format_exc())
         return "FAILURE"
 
+def get_command_handlers():
+    return {
+        Settings.attack_cmd: attack_command,
+        Settings.defend_cmd: defend_command,
+        Settings.heal_cmd: heal_command,
+        Settings.pet_cmd: pet_command,
+        Settings.skin_cmd: skin_command,
+        Settings.skins_cmd: skin_command,
+        Settings.lurk_cmd: lurk_command,
+        Settings.info_cmd: info_command
+    }
+
+def expire_chatters():
+    # Delete chatters whose inactivity timeout has passed
+    expired = TwitchInterface.pop_expired_chatters(Runtime.time())
+    for chatter in expired:
+        GameInterface.enqueue_delete_actor(chatter)
+        TwitchInterface.delete_chatter(chatter)
+    return expired
+
+async def expire_chatters_loop():
+    while not TwitchInterface.want_quit():
+        # Delete chatters whose inactivity timeout has passed
+        Recorder.run_expiry(expire_chatters)
+        # Sleep until the next chatter could expire, but wake up regularly to check for quit
+        sleep_time = 0.5
+        next_expiry = TwitchInterface.get_next_expiry_time()
+        if next_expiry is not None:
+            sleep_time = max(0, min(sleep_time, next_expiry - Runtime.time()))
+        await asyncio.sleep(sleep_time)
+
 # this is where we set up the bot
 async def run_twitch_handler():
     # Define twitch connection details
@@ -293,39 +375,28 @@ async def run_twitch_handler():
     # Create chat connection
     chat = await Chat(twitch)
 
-    # Register event handlers
+    # Replies are queued and sent from their own task (started once chat is ready) so handlers never wait on chat
+    ChatOutbox.set_chat(chat, TwitchInterface.get_target_channel())
+    ChatOutbox.set_rate_limit(Settings.chat_message_limit, Settings.chat_message_period)
+    ChatOutbox.set_batch_delay(Settings.chat_batch_delay)
+
+    # Register event handlers (chat events go through the recorder so they can be replayed)
     chat.register_event(ChatEvent.READY, on_ready)
-    chat.register_event(ChatEvent.MESSAGE, on_message)
+    chat.register_event(ChatEvent.MESSAGE, Recorder.wrap_message_handler(on_message))
 
     # Register command handlers
-    chat.register_command(Settings.attack_cmd, attack_command)
-    chat.register_command(Settings.defend_cmd, defend_command)
-    chat.register_command(Settings.heal_cmd, heal_command)
-    chat.register_command(Settings.pet_cmd, pet_command)
-    chat.register_command(Settings.skin_cmd, skin_command)
-    chat.register_command(Settings.skins_cmd, skin_command)
-    chat.register_command(Settings.lurk_cmd, lurk_command)
-    chat.register_command(Settings.info_cmd, info_command)
+    for name, handler in get_command_handlers().items():
+        chat.register_command(name, Recorder.wrap_command_handler(handler))
 
     # Start chat connection
     chat.start()
 
+    # Chat handling happens on the chat's loop; wait here until it's time to quit
     while not TwitchInterface.want_quit():
-        if TwitchInterface.want_quit():
-            break
-        # Check if we need to delete any chatters
-        delete_queue = []
-        for chatter in TwitchInterface.get_chatter_metadata():
-            chatter_name = chatter
-            chatter = TwitchInterface.get_chatter_metadata()[chatter]
-            if (Settings.chatter_inactivity_timeout and 
-                time.time() > chatter["last_chat_time"] + Settings.chatter_inactivity_timeout
-                and chatter_name != TwitchInterface.get_target_channel()):
-                GameInterface.enqueue_delete_actor(chatter_name)
-                delete_queue += [chatter_name]
-        for chatter in delete_queue:
-            TwitchInterface.delete_chatter(chatter)
-        time.sleep(0.1)
-    
+        await asyncio.sleep(0.5)
+
+    # Finish sending replies on the chat's loop before disconnecting
+    if chat_tasks:
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(stop_chat_tasks(), chat_tasks[0].get_loop()))
     chat.stop()
     await twitch.close()
\ No newline at end of file
@@ -1,9 +1,15 @@
-import time
-import random
+import heapq
 import traceback
 from game_interface import GameInterface
+from store import ChatterStore
+from runtime import Runtime
 
 class _TwitchInterface:
+    """
+    Keeps track of chatters and their health. Once the twitch thread is running, chatters are only added, changed,
+    expired and deleted from the chat's callback loop (see twitch.py); other threads may only read, e.g. by copying
+    get_chatter_metadata() with dict().
+    """
     def __init__(self):
         self._chatter_metadata = {}
         self._ignore_list = []
@@ -11,7 +17,10 @@ class _TwitchInterface:
         self._app_secret = ""
         self._target_channel = ""
         self._chatter_default_health = 20000
-        self._last_command_time = time.time()
+        self._chatter_inactivity_timeout = None
+        self._expiry_heap = []
+        self._scheduled_expiry = {}
+        self._last_command_time = Runtime.time()
         self._want_quit = False
     
     # This actually gets called every time a chatter chats
@@ -22,41 +31,84 @@ class _TwitchInterface:
             self._chatter_metadata[name] = {
                 "last_chat_time": 0,
                 "last_command_time": 0,
-                "health": self._chatter_default_health
+                "health": ChatterStore.get_health(name, self._chatter_default_health)
             }
             self.set_chatter_last_command_time(name)
-        self.set_chatter_last_chat_time(name)
-        GameInterface.add_actor(name, random.randint(100,700))
+            self.set_chatter_last_chat_time(name)
+            self.schedule_chatter_expiry(name)
+        else:
+            self.set_chatter_last_chat_time(name)
+        GameInterface.add_actor(name, Runtime.get_random().randint(100,700))
+
+    def restore_chatter(self, name, metadata):
+        # Brings back a chatter from a snapshot without adding an actor for them (the snapshot has their actor)
+        if name in self._ignore_list:
+            return
+        self._chatter_metadata[name] = dict(metadata)
+        self.schedule_chatter_expiry(name)
+
+    def schedule_chatter_expiry(self, name):
+        if not self._chatter_inactivity_timeout or name == self._target_channel:
+            return
+        deadline = self._chatter_metadata[name]["last_chat_time"] + self._chatter_inactivity_timeout
+        self._scheduled_expiry[name] = deadline
+        heapq.heappush(self._expiry_heap, (deadline, name))
+
+    def pop_expired_chatters(self, now):
+        """
+        Returns the chatters who haven't chatted within the inactivity timeout as of now. Chatters who chatted again since
+        their deadline was scheduled are pushed back to their new deadline instead (lazy invalidation).
+        """
+        expired = []
+        while len(self._expiry_heap) > 0 and self._expiry_heap[0][0] <= now:
+            deadline, name = heapq.heappop(self._expiry_heap)
+            # Ignore entries for chatters that were deleted (or deleted and added again since)
+            if name not in self._chatter_metadata or self._scheduled_expiry.get(name) != deadline:
+                continue
+            if self._chatter_metadata[name]["last_chat_time"] + self._chatter_inactivity_timeout > now:
+                self.schedule_chatter_expiry(name)
+                continue
+            del self._scheduled_expiry[name]
+            expired.append(name)
+        return expired
+
+    def get_next_expiry_time(self):
+        if len(self._expiry_heap) < 1:
+            return None
+        return self._expiry_heap[0][0]
     
     def update_last_command_time(self):
-        self._last_command_time = time.time()
+        self._last_command_time = Runtime.time()
 
-    def damage_chatter(self, name, damage):
-        self._chatter_metadata[name]["health"] -= damage
-        # GameInterface.undefend_actor(name) # Set this during the animation instead
-        if self._chatter_metadata[name]["health"] <= 0:
-            self._chatter_metadata[name]["health"] = self._chatter_default_health
-            return "FAINTED"
-        return "ALIVE"
-    
-    def heal_chatter(self, name, healing):
-        self._chatter_metadata[name]["health"] += healing
-        if self._chatter_metadata[name]["health"] > self._chatter_default_health:
-            self._chatter_metadata[name]["health"] = self._chatter_default_health
+    def set_last_command_time(self, last_command_time):
+        self._last_command_time = last_command_time
+
+    def get_chatter_health(self, name):
         return self._chatter_metadata[name]["health"]
+
+    def set_chatter_health(self, name, health):
+        # Damage, healing and fainting are worked out by the combat engine
+        self._chatter_metadata[name]["health"] = health
+        ChatterStore.set_health(name, health)
     
     def set_chatter_default_health(self, health):
         self._chatter_default_health = health
+
+    def get_chatter_default_health(self):
+        return self._chatter_default_health
+
+    def set_chatter_inactivity_timeout(self, timeout):
+        self._chatter_inactivity_timeout = timeout
     
     def set_chatter_last_chat_time(self, name):
         if name in self._ignore_list or name not in self._chatter_metadata:
             return
-        self._chatter_metadata[name]["last_chat_time"] = time.time()
+        self._chatter_metadata[name]["last_chat_time"] = Runtime.time()
     
     def set_chatter_last_command_time(self, name):
         if name in self._ignore_list or name not in self._chatter_metadata:
             return
-        self._chatter_metadata[name]["last_command_time"] = time.time()
+        self._chatter_metadata[name]["last_command_time"] = Runtime.time()
         self.update_last_command_time()
     
     def delete_chatter(self, name):
@@ -64,6 +116,7 @@ class _TwitchInterface:
             if name not in self._chatter_metadata:
                 return "SUCCESS"
             del self._chatter_metadata[name]
+            self._scheduled_expiry.pop(name, None)
             return "SUCCESS"
         except:
             print("Failed to delete chatter {}".format(name))